@@ -0,0 +1,44 @@
+"""Benchmark pandas.Series.first_member on a 1M row Series.
+
+Usage:
+    python benchmarks/bench_first_member.py [rows]
+
+Compares the vectorized first_member against the previous per row
+implementation on a column shaped like "Master Protein Accessions".
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from omin.core.pandomics import pandas as pd
+
+
+def per_row_first_member(series, delim=';'):
+    """The previous implementation, kept for comparison."""
+    result = series.astype(str).apply(lambda x: x.split(delim)[0])
+    return result.replace('nan', float('nan'))
+
+
+def make_series(rows, seed=0):
+    rng = np.random.RandomState(seed)
+    accessions = np.array(["P{:05d}".format(i) for i in range(20000)], dtype=object)
+    first = accessions[rng.randint(0, len(accessions), rows)]
+    second = accessions[rng.randint(0, len(accessions), rows)]
+    values = np.where(rng.rand(rows) < .3, first + "; " + second, first).astype(object)
+    values[rng.rand(rows) < .05] = np.nan
+    return pd.Series(values, name="Master Protein Accessions")
+
+
+def main(rows=1000000, repeat=3):
+    series = make_series(rows)
+    assert series.first_member().equals(per_row_first_member(series))
+
+    for label, func in [("first_member", lambda: series.first_member()),
+                        ("per row", lambda: per_row_first_member(series))]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print("{:>14}: {:.3f}s for {} rows".format(label, best, rows))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
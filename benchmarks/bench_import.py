@@ -0,0 +1,44 @@
+"""Benchmark `import omin` in fresh interpreters.
+
+Usage:
+    python benchmarks/bench_import.py [runs]
+
+Every run starts a new Python process so nothing is cached in sys.modules.
+Prints the median import time and the heavy modules loaded by the import,
+which should be none.
+"""
+import os
+import subprocess
+import sys
+
+HEAVY = ["pandas", "numpy", "scipy", "statsmodels", "matplotlib", "altair",
+         "dominate", "xlrd", "tkinter"]
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import omin
+print(time.perf_counter() - start)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+""".format(heavy=HEAVY)
+
+
+def run_once():
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    seconds, loaded = output.decode().split("\n")[-3:-1]
+    return float(seconds), [i for i in loaded.split(",") if i]
+
+
+def main(runs=7):
+    times = []
+    loaded = []
+    for _ in range(runs):
+        seconds, loaded = run_once()
+        times.append(seconds)
+    times.sort()
+    print("import omin: {:.4f}s median of {} runs".format(times[len(times) // 2], runs))
+    print("heavy modules loaded: {}".format(", ".join(loaded) or "none"))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 7)
@@ -69,49 +69,59 @@ __version__
 # EXTERNAL IMPORTS
 # ----------------
 import os, sys, warnings
-
-# -------------
-# UTILS IMPORTS
-# -------------
-from .utils import StringTools
-from .utils import SelectionTools
-from .utils import IOTools
-from .utils import UniProtTools
+import importlib
 
 # ------------
-# CORE IMPORTS
+# LAZY IMPORTS
 # ------------
-from . import core
-from .core.handles import Process
-from .core.operations import Operate
-### START ###
-start = Operate.start
-
-# -------------
-# STATS IMPORTS
-# -------------
-from . import stats
-from .stats import Compare
-
-# -----------------
-# VISUALIZE IMPORTS
-# -----------------
-from . import visualize
-
-# ----------------
-# DATABASE IMPORTS
-# ----------------
-from .databases import MitoCartaTwo
-
-# -----------
-# CLI IMPORTS
-# -----------
-from . import cli
+# Subpackages and the names below are imported on first attribute access so
+# that `import omin` does not pull in pandas, scipy, matplotlib, tkinter etc.
+# In the format: name -> (module, attribute) where attribute None is the module.
+_lazy_imports = {
+    # UTILS IMPORTS
+    "utils": (".utils", None),
+    "StringTools": (".utils", "StringTools"),
+    "SelectionTools": (".utils", "SelectionTools"),
+    "IOTools": (".utils", "IOTools"),
+    "UniProtTools": (".utils", "UniProtTools"),
+    # CORE IMPORTS
+    "core": (".core", None),
+    "Process": (".core.handles", "Process"),
+    "Operate": (".core.operations", "Operate"),
+    "MultiPlex": (".core.multiplex", "MultiPlex"),
+    # STATS IMPORTS
+    "stats": (".stats", None),
+    "Compare": (".stats", "Compare"),
+    # VISUALIZE IMPORTS
+    "visualize": (".visualize", None),
+    # DATABASE IMPORTS
+    "databases": (".databases", None),
+    "MitoCartaTwo": (".databases", "MitoCartaTwo"),
+    # CLI IMPORTS
+    "cli": (".cli", None),
+    "example_data": (".example_data", None),
+}
+
+
+def __getattr__(name):
+    """Import the lazy names of omin on first access."""
+    if name == "start":
+        # START
+        value = __getattr__("Operate").start
+    elif name in _lazy_imports:
+        module_name, attribute = _lazy_imports[name]
+        value = importlib.import_module(module_name, __name__)
+        if attribute is not None:
+            value = getattr(value, attribute)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports) | {"start"})
 
-# -----------
-# CLI IMPORTS
-# -----------
-from . import example_data
 
 # -------
 # VERSION
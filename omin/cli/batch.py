@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+omin.cli.batch
+--------------
+
+Provides the non-interactive `omin run` command. A manifest lists the jobs,
+every job is a Proteome Discoverer peptide groups and proteins export that is
+run through Process and written out with std_out.
+
+Manifest
+--------
+A JSON file with a list of jobs, or a dict with "jobs" and "defaults"::
+
+    {
+        "defaults": {"selected_mod": "Phospho", "comparisons": [["KO", "WT"]]},
+        "jobs": [
+            {"name": "exp_01",
+             "peptides_file": "exp_01/PeptideGroups.txt",
+             "proteins_file": "exp_01/Proteins.txt",
+             "output": "results/exp_01"}
+        ]
+    }
+
+Relative paths are relative to the manifest. Every job writes
+proteins.csv, peptide_groups.csv (if selected_mod is given) and a state file
+into its output dir. A job is skipped when the state file says it already
+ran on the same inputs with the same settings.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import os
+import json
+import time
+import hashlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ..utils.io_tools import TableCache
+
+
+class Manifest(object):
+    """Read batch manifests."""
+
+    # Settings a job may give, in the format: name -> default.
+    job_defaults = {"name": None,
+                    "peptides_file": None,
+                    "proteins_file": None,
+                    "comparisons": [],
+                    "output": None,
+                    "selected_mod": None,
+                    "rescue_entrez_ids": False}
+
+    @classmethod
+    def load(cls, manifest_path):
+        """Return the jobs of a manifest as a list of dicts.
+
+        Raises
+        ------
+        ValueError
+            If a job is missing a file or an output, or has unknown keys.
+        """
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        if isinstance(manifest, list):
+            manifest = {"jobs": manifest}
+
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        defaults = dict(cls.job_defaults, **manifest.get("defaults", dict()))
+
+        jobs = []
+        for n, entry in enumerate(manifest["jobs"]):
+            unknown = set(entry) - set(cls.job_defaults)
+            if len(unknown) > 0:
+                raise ValueError("Job {} has unknown keys: {}".format(n, ", ".join(sorted(unknown))))
+
+            job = dict(defaults, **entry)
+            for key in ["peptides_file", "proteins_file", "output"]:
+                if job[key] is None:
+                    raise ValueError("Job {} has no {}.".format(n, key))
+                job[key] = os.path.normpath(os.path.join(base_dir, job[key]))
+
+            job["comparisons"] = [list(i) for i in job["comparisons"]]
+            if job["name"] is None:
+                job["name"] = os.path.basename(os.path.normpath(job["output"]))
+            jobs.append(job)
+
+        names = [i["name"] for i in jobs]
+        outputs = [os.path.normpath(i["output"]) for i in jobs]
+        if len(set(names)) != len(names) or len(set(outputs)) != len(outputs):
+            raise ValueError("Job names and outputs must be unique.")
+
+        return jobs
+
+
+class BatchRun(object):
+    """Run manifest jobs in a pool of worker processes."""
+
+    state_file_name = "omin_run_state.json"
+
+    @staticmethod
+    def output_files(job):
+        """Return the files a job writes, in the format: name -> path."""
+        result = {"proteins": os.path.join(job["output"], "proteins.csv")}
+        if job["selected_mod"] is not None:
+            result["peptide_groups"] = os.path.join(job["output"], "peptide_groups.csv")
+        return result
+
+    @staticmethod
+    def fingerprint(job):
+        """Return a digest of a job's inputs and settings.
+
+        The inputs are hashed by content so touching or copying a file does
+        not trigger a rerun.
+        """
+        from .. import __version__
+
+        settings = dict((k, job[k]) for k in ["comparisons", "selected_mod", "rescue_entrez_ids"])
+        sha = hashlib.sha1()
+        sha.update(TableCache.file_digest(job["peptides_file"]).encode())
+        sha.update(TableCache.file_digest(job["proteins_file"]).encode())
+        sha.update(json.dumps(settings, sort_keys=True).encode())
+        sha.update(__version__.encode())
+        return sha.hexdigest()
+
+    @classmethod
+    def state_path(cls, job):
+        return os.path.join(job["output"], cls.state_file_name)
+
+    @classmethod
+    def is_current(cls, job, fingerprint):
+        """Return True if the job's outputs were made from the same inputs."""
+        try:
+            with open(cls.state_path(job), "r") as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return False
+        outputs = cls.output_files(job).values()
+        return state.get("fingerprint") == fingerprint and all(os.path.exists(i) for i in outputs)
+
+    @classmethod
+    def run_job(cls, job, force=False):
+        """Process one job and write its outputs.
+
+        Returns
+        -------
+        result : dict
+            With the keys name, status ("done", "skipped" or "failed"),
+            seconds and error.
+        """
+        start = time.time()
+        result = {"name": job["name"], "status": "done", "seconds": 0., "error": None}
+        try:
+            fingerprint = cls.fingerprint(job)
+            if not force and cls.is_current(job, fingerprint):
+                result["status"] = "skipped"
+            else:
+                # Remove the state first so an interrupted job is never skipped.
+                if os.path.exists(cls.state_path(job)):
+                    os.remove(cls.state_path(job))
+                cls._process(job)
+                with open(cls.state_path(job), "w") as f:
+                    json.dump({"fingerprint": fingerprint,
+                               "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+                               "seconds": time.time() - start}, f)
+        except Exception as err:
+            result["status"] = "failed"
+            result["error"] = "{}: {}".format(type(err).__name__, err)
+            result["traceback"] = traceback.format_exc()
+        result["seconds"] = time.time() - start
+        return result
+
+    @classmethod
+    def _process(cls, job):
+        """Run Process and std_out for a job."""
+        from ..core.handles import Process
+
+        proc = Process(peptides_file=job["peptides_file"],
+                       proteins_file=job["proteins_file"],
+                       rescue_entrez_ids=job["rescue_entrez_ids"])
+
+        os.makedirs(job["output"], exist_ok=True)
+        outputs = cls.output_files(job)
+        proc.proteins.std_out(job["selected_mod"], job["comparisons"]).to_csv(outputs["proteins"])
+        if "peptide_groups" in outputs:
+            proc.peptide_groups.std_out(job["selected_mod"], job["comparisons"]).to_csv(outputs["peptide_groups"])
+
+    @classmethod
+    def run(cls, jobs, n_jobs=1, force=False, worker=None, log=print):
+        """Run many jobs, reporting each one as it finishes.
+
+        Parameters
+        ----------
+        jobs : list
+            Jobs as returned by Manifest.load.
+
+        n_jobs : int
+            Number of jobs to run at once in worker processes. 1 runs the
+            jobs one after another in this process, -1 uses every core.
+
+        force : bool
+            Rerun jobs even if their inputs have not changed.
+
+        worker : callable
+            Called as worker(job, force) and returns a result like run_job.
+            Must be picklable when n_jobs is not 1. Defaults to run_job.
+
+        log : callable
+
+        Returns
+        -------
+        results : list
+            One result dict per job in the order of jobs.
+        """
+        worker = worker or cls.run_job
+        if n_jobs is not None and n_jobs < 0:
+            n_jobs = os.cpu_count()
+        total = len(jobs)
+        results = [None] * total
+
+        def report(done, index, result):
+            results[index] = result
+            line = "[{}/{}] {}: {} in {:.1f}s".format(done, total, result["name"], result["status"], result["seconds"])
+            if result["error"] is not None:
+                line += " ({})".format(result["error"])
+            log(line)
+
+        if n_jobs is None or n_jobs == 1:
+            for index, job in enumerate(jobs):
+                report(index + 1, index, worker(job, force))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = dict((executor.submit(worker, job, force), index) for index, job in enumerate(jobs))
+                for done, future in enumerate(as_completed(futures), 1):
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as err:
+                        # The worker process itself died.
+                        result = {"name": jobs[index]["name"], "status": "failed",
+                                  "seconds": 0., "error": "{}: {}".format(type(err).__name__, err)}
+                    report(done, index, result)
+
+        counts = dict((k, sum(1 for i in results if i["status"] == k)) for k in ["done", "skipped", "failed"])
+        log("{done} done, {skipped} skipped, {failed} failed.".format(**counts))
+        return results
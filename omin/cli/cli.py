@@ -23,14 +23,13 @@
 
 
 
+import json
 import argparse
 import sys
 import time
 
-import guipyter
-import guipyter as gptr
-# import omin
-from ..core import handles
+from ..core.guipyter import filedialog
+from .batch import Manifest, BatchRun
 
 
 class FileHandleCLI(object):
@@ -43,13 +42,13 @@ class FileHandleCLI(object):
         print("Select proteins file:\n")
         time.sleep(1)
         # self.proteins = gptr.DataLoader()
-        self.proteins_file_name = gptr.filedialog.askopenfilename()
+        self.proteins_file_name = filedialog.askopenfilename()
 
     def set_peptide_groups_file_name(self):
         time.sleep(1)
         print("Select peptide groups file:\n")
         # self.peptide_groups= gptr.DataLoader()
-        self.peptide_groups_file_name = gptr.filedialog.askopenfilename()
+        self.peptide_groups_file_name = filedialog.askopenfilename()
 
     def get_proteins_file_name(self):
         return self.proteins_file_name
@@ -62,8 +61,10 @@ class FileHandleCLI(object):
         self.get_peptide_groups_file_name()
 
 
+def normalize_now():
+    """Select a peptide groups and proteins file with dialogs and process them."""
+    from ..core import handles
 
-def main():
     title = "omin normalize now:\n"
     print(len(title)*"-")
     print(title)
@@ -78,4 +79,52 @@ def main():
     om = handles.Process(peptides_file=fh.get_peptide_groups_file_name(),
                          proteins_file=fh.get_proteins_file_name())
 
-    print(om.raw_proteins.shape)
+    print(om.proteins.raw.shape)
+    return 0
+
+
+def run(args):
+    """Run the jobs of a manifest, see omin.cli.batch."""
+    try:
+        jobs = Manifest.load(args.manifest)
+    except (IOError, ValueError, KeyError) as err:
+        print("Could not read the manifest {}: {}".format(args.manifest, err))
+        return 2
+
+    results = BatchRun.run(jobs, n_jobs=args.jobs, force=args.force)
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [i for i in results if i["status"] == "failed"]
+    for result in failed:
+        if "traceback" in result:
+            print("\n{} failed:\n{}".format(result["name"], result["traceback"]))
+    return 1 if len(failed) > 0 else 0
+
+
+def parser():
+    result = argparse.ArgumentParser(prog="omin", description="Omics Modeling Integrating Normalization.")
+    commands = result.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="Process the jobs of a manifest without prompts.")
+    run_parser.add_argument("manifest", help="JSON manifest of jobs.")
+    run_parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="Number of jobs to run at once, -1 uses every core. Defaults to 1.")
+    run_parser.add_argument("-f", "--force", action="store_true",
+                            help="Rerun jobs whose inputs have not changed.")
+    run_parser.add_argument("--report", default=None,
+                            help="Write the status and timing of every job to this JSON file.")
+
+    commands.add_parser("select", help="Select the files with dialogs (default).")
+    return result
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.command == "run":
+        status = run(args)
+    else:
+        status = normalize_now()
+    sys.exit(status)
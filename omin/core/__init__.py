@@ -6,9 +6,18 @@
 # -------
 # Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
 
-from . import handles
-from . import containers
-from . import base
-from . import operations
-from . import pandomics
-from . import guipyter
+import importlib
+
+# Submodules are imported on first attribute access, see omin.__getattr__.
+_submodules = ["handles", "containers", "design", "base", "operations", "store", "multiplex", "imputation",
+               "pandomics", "guipyter"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
@@ -51,10 +51,19 @@ def repr_dec(cls):
         """
         # Create a list of attributes.
         keys = sorted(list(self.__dict__.keys()))
+        # Attributes that are still on disk are listed without loading them.
+        lazy = self.__dict__.get("_lazy_attributes", dict())
+        keys = [i for i in keys if i != "_lazy_attributes"]
         # Create a list of the attribute values types.
         value_types = list(map(lambda x: type(x).__name__, [self.__dict__[i] for i in keys]))
         # Zip the two lists above into a dict.
         att_dict = dict(zip(keys, value_types))
+        for k in sorted(lazy.keys()):
+            att_dict[k] = "not loaded"
+        # Thermo categories are built on access.
+        for k in sorted(self.__dict__.get("_thermo_categories", dict()).keys()):
+            if k not in att_dict:
+                att_dict[k] = "DataFrame"
         # Create the template string for all the reaults.
         template = "{}: {}\n"
         # Create the results string.
@@ -113,15 +122,36 @@ class Handle(object):
     type : type
     """
 
+    # Attributes that are caches and are not saved by omin.core.store.
+    _transient_attributes = ()
+
     def __init__(self):
         """Initalize the core handle."""
         self.numbers = dict()
         self.metadata = dict()
         self.type = type(self)
 
+    def __getattr__(self, name):
+        """Load attributes left on disk by omin.core.store.ProjectStore on first access.
+        """
+        lazy = self.__dict__.get("_lazy_attributes", None)
+        if lazy is not None and name in lazy:
+            value = lazy.pop(name)()
+            self.__dict__[name] = value
+            return value
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    def _load_lazy_attributes(self):
+        """Load every attribute that is still on disk.
+        """
+        for name in list(self.__dict__.get("_lazy_attributes", dict()).keys()):
+            getattr(self, name)
+        self.__dict__.pop("_lazy_attributes", None)
+
     def _introspect(self):
         """Return list of object attributes and their types.
         """
+        self._load_lazy_attributes()
         obj_ids = dict()
         # Try to make a list of the types of things inside obj.
         try:
@@ -14,9 +14,11 @@ PeptideGroups, and Proteins classes.
 # ----------------
 import re
 import os
+import time
 import string
 import itertools
 import numpy as np
+from collections import OrderedDict
 
 # Import pandas with the pandomics plug-in.
 # from pandomics import pandas as pd
@@ -32,6 +34,10 @@ from .guipyter import DataLoader
 # INTERNAL IMPORTS
 # ----------------
 from .base import repr_dec, Handle
+from .design import StudyDesign
+from .modifications import ModificationIndex
+from .sites import SiteIndex
+from .normalization import AbundanceCube
 
 # -------------
 # UTILS IMPORTS
@@ -40,6 +46,7 @@ from ..utils import IOTools
 from ..utils import StringTools
 # from ..utils import SelectionTools
 from ..utils import IntermineTools
+from ..utils import SequenceAnnotationTools
 
 # --------
 # DATBASES
@@ -58,6 +65,13 @@ class Normalized(object):
         for k,v in kwargs.items():
             self.__dict__[k] = v
 
+    def impute(self, method="min_prob", groups=None, **kwargs):
+        """Return a new Normalized with the missing values of every frame imputed.
+
+        See omin.core.imputation.Imputation.impute for the parameters.
+        """
+        return Normalized(**dict((k, v.impute(method=method, groups=groups, **kwargs)) for k, v in self.__dict__.items()))
+
 
 # ===============
 # OCCUPANCY CLASS
@@ -72,6 +86,15 @@ class Occupancy(object):
         for k,v in kwargs.items():
             self.__dict__[k] = v
 
+    def impute(self, method="min_prob", groups=None, log=False, **kwargs):
+        """Return a new Occupancy with the missing values of every frame imputed.
+
+        Relative occupancies are already Log2 ratios so log defaults to False.
+        See omin.core.imputation.Imputation.impute for the parameters.
+        """
+        return Occupancy(**dict((k, v.impute(method=method, groups=groups, log=log, **kwargs))
+                                for k, v in self.__dict__.items()))
+
 
 # ===============
 # CONTAINER CLASS
@@ -140,7 +163,20 @@ class ProteomeDiscovererRaw(Container):
     """Base class for Proteome Discoverer raw files.
 
     This class inherits attributes from the Container class.
+
+    Thermo's column categories (Abundance, Modifications, ect.) are exposed as
+    attributes. They are built from raw when they are first accessed and the
+    most recently used ones are kept in a small cache, see
+    category_cache_size. The pinned_categories are always kept.
     """
+    # Number of category DataFrames kept in memory, 0 disables the cache.
+    category_cache_size = 2
+
+    # Categories that are never evicted, most computations start from them.
+    pinned_categories = ("Abundance",)
+
+    _transient_attributes = ("_thermo_category_cache", "_study_design", "_abundance_cube", "_key_codes",
+                             "_raw_version")
 
     def __init__(self, *args, **kwargs):
         """Initialize base class for Proteome Discoverer raw files.
@@ -157,27 +193,149 @@ class ProteomeDiscovererRaw(Container):
         self.quantified_index = self.Abundance.dropna(axis=0, how='all').index
 
 
+    def __setattr__(self, name, value):
+        """Count the assignments of raw, see raw_version.
+        """
+        if name == "raw":
+            self.raw_changed()
+        Container.__setattr__(self, name, value)
+
+
+    def __delattr__(self, name):
+        if name == "raw":
+            self.raw_changed()
+        Container.__delattr__(self, name)
+
+
+    @property
+    def raw_version(self):
+        """A counter bumped whenever raw is assigned or raw_changed is called.
+
+        The caches of abundance_cube and load_normalized are valid for one
+        version of raw.
+        """
+        return self.__dict__.get("_raw_version", 0)
+
+
+    def raw_changed(self):
+        """Mark raw as changed, call this after editing raw in place.
+        """
+        self.__dict__["_raw_version"] = self.raw_version + 1
+
+
+    def __getattr__(self, name):
+        """Build Thermo category DataFrames on first access.
+        """
+        lazy = self.__dict__.get("_lazy_attributes", None)
+        categories = self.__dict__.get("_thermo_categories", None)
+        if categories is not None and name in categories:
+            if lazy is None or name not in lazy:
+                return self.thermo_category(name)
+        return Handle.__getattr__(self, name)
+
+
     def _expose_thermo_categories(self):
-        """Creates attributes that are pandas DataFrames based on Thermo's categories.
+        """Index the columns of raw by Thermo's categories.
+
+        Creates thermo_columns, a MultiIndex of (category, channel) aligned
+        with raw.columns, and a map of category attribute names to column
+        positions in raw. The category DataFrames themselves are only created
+        when they are accessed, see thermo_category.
         """
         # FIXME: This method could potentially create collisions, figure out a way to safe gard against this.
-        # fixme: Perhaps we could use one multi-index dataframe, in any case this loop is probably a substantial memory leak.
         thermo_category_values = set([i.split(":")[0] for i in self.raw.columns])
         thermo_category_keys = list(map(StringTools.remove_punctuation, thermo_category_values))
         thermo_category_keys = list(map(lambda x: x.strip().replace(" ", "_"), thermo_category_keys))
         thermo_category = dict(zip(thermo_category_keys, thermo_category_values))
-        # This loop creates DataFrames for each category that Thermo has decided is important.
+
+        columns = [str(i) for i in self.raw.columns]
+        self.thermo_columns = pd.MultiIndex.from_arrays([[i.split(":")[0] for i in columns],
+                                                         [i.partition(":")[-1].strip() for i in columns]],
+                                                        names=["category", "channel"])
+
+        # Same matching as raw.filter(regex=...), categories may overlap.
+        self._thermo_categories = dict()
         for k,v in thermo_category.items():
-            filter_with_colon = self.raw.filter(regex=v+":")
-            if filter_with_colon.shape[-1] > 0:
-                self.__dict__[k] = filter_with_colon
-            else:
-                filter_without_colon = self.raw.filter(regex=v)
-                self.__dict__[k] = filter_without_colon
+            with_colon = re.compile(v+":")
+            positions = [n for n, i in enumerate(columns) if with_colon.search(i)]
+            if len(positions) == 0:
+                without_colon = re.compile(v)
+                positions = [n for n, i in enumerate(columns) if without_colon.search(i)]
+            self._thermo_categories[k] = positions
+
+        self._thermo_category_cache = OrderedDict()
+
+
+    def thermo_category(self, name):
+        """Return the DataFrame for a Thermo category e.g. Abundance.
+
+        Parameters
+        ----------
+        name: str
+            The category attribute name.
+
+        Returns
+        -------
+        result: pandas.DataFrame
+        """
+        cache = self.__dict__.setdefault("_thermo_category_cache", OrderedDict())
+        if name in cache:
+            cache.move_to_end(name)
+            return cache[name]
+
+        result = self.raw.iloc[:, self._thermo_categories[name]]
+
+        if self.category_cache_size > 0 or name in self.pinned_categories:
+            cache[name] = result
+            # Evict the least recently used categories that are not pinned.
+            evictable = [k for k in cache if k not in self.pinned_categories]
+            for k in evictable[:max(len(evictable) - self.category_cache_size, 0)]:
+                del cache[k]
+        return result
+
+
+    @property
+    def abundance_cube(self):
+        """The Abundance columns as a fractions x rows x channels AbundanceCube.
+
+        See omin.core.normalization. Rebuilt when raw or the study design
+        changes.
+        """
+        key = (self.raw_version, self.raw.shape, self.study_design)
+        cached = self.__dict__.get("_abundance_cube", None)
+        if cached is None or not self._same_key(cached[0], key):
+            cube = AbundanceCube.from_study_factor_table(self.Abundance, self.study_factor_table)
+            cached = (key, cube)
+            self._abundance_cube = cached
+        return cached[1]
+
+
+    @staticmethod
+    def _same_key(left, right):
+        """Return True if two cache keys match, objects in them are compared by identity."""
+        return len(left) == len(right) and all(i is j or (isinstance(i, (int, str, tuple)) and i == j)
+                                               for i, j in zip(left, right))
+
 
     # ------------------
     # STUDY FACTOR TOOLS
     # ------------------
+    @property
+    def study_design(self):
+        """Return the StudyDesign parsed from the Abundance column headers.
+
+        The headers are only parsed again if the Abundance columns change.
+        They are read from raw at the cached column positions of the
+        Abundance category, the category itself is not built.
+        """
+        design = self.__dict__.get("_study_design", None)
+        positions = self.__dict__.get("_thermo_categories", dict()).get("Abundance", None)
+        columns = self.Abundance.columns if positions is None else self.raw.columns[positions]
+        if design is None or not design.matches(columns):
+            design = StudyDesign(columns)
+            self._study_design = design
+        return design
+
     @property
     def study_factor_table(self):
         """Attempt to retrieve the study factors from Abundance column headers.
@@ -187,49 +345,13 @@ class ProteomeDiscovererRaw(Container):
 
         If study factor cannot be identified then StudyFactor_<ABC...> will be assigned.
         """
-        column_names = [i.split(":")[-1].strip() for i in self.Abundance.columns]
-
-        column_names = pd.DataFrame(list(map(lambda x: x.split(','), column_names)))
-
-        # Remove the sample column if present.
-        if len(column_names.iloc[:, 1].unique()) < 2:
-            column_names = pd.concat([column_names.iloc[:, 0], column_names.iloc[:, 2:]], axis=1)
-
-        # Compile the regular expression to catch things in (parenthesis).
-        # FIXME: BIG ASSUMPTION HERE. DOCUMENT OR DIE. #DOD
-        rx = re.compile("[\[\(](.+)[\[\)\]]")
-
-        study_factors = []
-        for i in range(1, len(column_names.columns)):
-            try:
-                ucols = column_names.iloc[:, i].apply(lambda x: rx.findall(x)[0])
-                ucols = ucols.unique()
-                study_factor = ucols[0]
-                study_factors.append(study_factor)
-
-            except IndexError as err:
-                # If study factor cannot be identified then StudyFactor_<ABC...> will be assigned.
-                study_factor = "StudyFactor_" + string.ascii_uppercase[i-1]
-                study_factors.append(study_factor)
-
-        column_names.columns = ['_TMT_tag'] + study_factors
-        # Prepend the fraction number.
-        fn = [i.split(":")[1].strip() for i in self.Abundance.columns]
-        fn = pd.DataFrame(fn, columns=["_Fn"])
-
-        column_names = pd.concat([fn, column_names],axis=1)
-        return column_names
+        return self.study_design.study_factor_table.copy()
 
     @property
     def study_factor_dict(self):
         """Return the study_factor_table as a flattened dict.
         """
-        study_factor_dict = dict()
-        for i in range(2, self.study_factor_table.columns.shape[0]):
-            usf = self.study_factor_table.iloc[:, i].unique()
-            usf = list(map(lambda x: x.strip(), usf))
-            study_factor_dict[self.study_factor_table.iloc[:, i].name] = usf
-        return study_factor_dict
+        return dict((k, list(v)) for k,v in self.study_design.study_factor_dict.items())
 
     @property
     def tmt_plex_number(self):
@@ -238,7 +360,7 @@ class ProteomeDiscovererRaw(Container):
         plex_number = 0
 
         try:
-            plex_number = self.study_factor_table._TMT_tag.unique().shape[0]
+            plex_number = self.study_design.tmt_plex_number
 
         except Exception as err:
             print(err)
@@ -250,22 +372,13 @@ class ProteomeDiscovererRaw(Container):
     def input_number(self):
         """Return number of inputs as a float.
 
-        Parameters
-        ----------
-        dataframe : DataFrame
-
         Returns
         -------
         number_input : float
         """
         number_input = 0.0
         try:
-            plex_number = self.tmt_plex_number
-            # FIXME: Proof this against Inputase ect.
-            # To do that that load the regex with ~ [Ii]nput[\w[punctuation]]
-            # FIXME: Redundant filtering of raw DataFrames = memory leak
-            input_abundance = self.Abundance.filter(regex="[Ii][Nn][Pp][Uu][Tt]").shape[1]
-            number_input = input_abundance/plex_number
+            number_input = self.study_design.input_number
         except Exception:
             print("utils.SelectionTools.find_number_input failed")
         return number_input
@@ -284,17 +397,16 @@ class ProteomeDiscovererRaw(Container):
 
         """
         # FIXME: Ensure that the methods that use this know what to do with None.
-        # FIXME: Inputase-proof this function or provide informative error handling with messages.
-        rx = re.compile("[Ii][Nn][Pp][Uu][Tt]")
-        study_factor_with_input = None
-        for k,v in self.study_factor_dict.items():
-            #FIXME: BIG ASSUMPTION HERE -> There will be only one study factor that contains a term including [Ii]nput.
-            li = bool(sum(list(map(lambda x:bool(len(rx.findall(x))), v))))
-            if li:
-                study_factor_with_input = k
-            else:
-                pass
-        return study_factor_with_input
+        return self.study_design.study_factor_with_input
+
+
+    @property
+    def bridge_channels(self):
+        """Return the Abundance columns that are pooled bridge channels.
+
+        See omin.core.design.StudyDesign.bridge_mask.
+        """
+        return list(self.Abundance.columns[self.study_design.bridge_mask.values])
 
 
     def fraction_tag(self, fraction_number=None):
@@ -305,53 +417,14 @@ class ProteomeDiscovererRaw(Container):
         fraction_number: str
             Must be the form Fn e.g. F1, F2, ect.
         """
-        # FIXME: Add try and excepts with some kind of unique string passed
-        by_fn = self.study_factor_table.loc[self.study_factor_table._Fn == fraction_number].iloc[:, 2:]
-
-        # Regex for isolating the study factor from it's category.
-        rx = re.compile('(.+)\s[\[\(].+[\]\)]')
-
-        tag_for_fraction = ""
-        for i in by_fn:
-            terms = by_fn[i].unique()
-
-            terms = list(map(lambda x:x.strip(), terms))
-
-            terms = list(filter(lambda k: 'POOL' not in k, terms))
-
-            terms = list(filter(lambda k: 'Pool' not in k, terms))
-
-            #  FIXME: add some try and excepts with better docs.
-            if len(terms) == 1:
-                parens = set(["(", ")", "[", "]"])
-
-                if any([len(parens & set(list(i))) > 0 for i in terms]):
-                    term = terms[0]
-
-                    # Isolate the study factor from it's category.
-                    term = rx.findall(term)
-                else:
-                    term = terms
-
-                if len(term) == 1:
-                    # Make everything lowercase.
-                    term = term[0].lower()
-                    # Replace any whitespace with underscore.
-                    term = re.sub("\s", "_", term)
-
-                    term = re.sub('-', '_', term)
-                    # print(term)
-                    tag_for_fraction = "_".join([tag_for_fraction, term])
-
-        return tag_for_fraction
+        return self.study_design.fraction_tag(fraction_number)
 
 
     @property
     def fraction_number2fraction_tag(self):
         """Returns a dict with fraction numbers as keys and fraction tags as values.
         """
-        result = dict([(i,self.fraction_tag(i)) for i in self.study_factor_table._Fn.unique()])
-        return result
+        return dict(self.study_design.fraction_tags)
 
 
     def _gene_name_extractor(self):
@@ -381,6 +454,19 @@ class PeptideGroups(ProteomeDiscovererRaw):
     Derived from the ProteomeDiscovererRaw class
     """
 
+    _transient_attributes = ProteomeDiscovererRaw._transient_attributes + ("_load_normalized_cache",
+                                                                         "_modification_index",
+                                                                         "_site_indexes")
+
+    # Modifications that are introduced by sample preparation.
+    chemical_modifications = {'Oxidation', 'Carbamidomethyl', 'TMT6plex', 'TMT10plex'}
+
+    # Method of load_normalized, one of AbundanceCube.methods.
+    normalization_method = "sum"
+
+    # master_index columns that identify a peptide group across exports, see omin.core.multiplex.
+    multiplex_key = ["Sequence", "Modifications"]
+
     def __init__(self, filepath_or_buffer=None, *args, **kwargs):
         """Initialize the base class."""
         # filepath_or_buffer = filepath_or_buffer or None
@@ -423,111 +509,181 @@ class PeptideGroups(ProteomeDiscovererRaw):
                 pass
         return
 
-    def _simplify_modifications(self):
-        """Return a series of simplifed modifications.
+    def __getattr__(self, name):
+        """Select the peptides with an in vivo modification e.g. self.acetyl.
+        """
+        modification_attributes = self.__dict__.get("_modification_attributes", None)
+        if modification_attributes is not None and name in modification_attributes:
+            return self.raw.loc[self.modification_mask(modification_attributes[name], regex=False).values]
+        return ProteomeDiscovererRaw.__getattr__(self, name)
 
-        Parameters
-        ----------
-        df : DataFrame
+    @property
+    def modification_index(self):
+        """The parsed Modifications column, see omin.core.modifications.
 
-        Returns
-        -------
-        simplified : Series
+        Built from raw on first access.
         """
-        simplified = None
-        if any(self.raw.columns == "Modifications"):
-            # Compile the regular expression to be used in findall
-            # rx = re.compile("x(\w+)\s")
-            # simplified = dataframe.Modifications.apply(rx.findall)
-            try:
-                simplified = self.raw.Modifications.str.findall("x(\w+)\s")
-                simplified = simplified.apply(lambda x: x if isinstance(x, list) else [])
-                return simplified
-            except Exception as err:
-                print(err)
-                return simplified
-        else:
-            print("No Modifications column found in Peptide Groups data.")
-
+        result = self.__dict__.get("_modification_index", None)
+        if result is None:
+            if "Modifications" in self.raw.columns:
+                modifications = self.raw.Modifications
+            else:
+                print("No Modifications column found in Peptide Groups data.")
+                modifications = pd.Series("", index=self.raw.index)
+            result = ModificationIndex(modifications)
+            self._modification_index = result
+        return result
 
-    def get_all_modifications(self):
-        """Return set of ALL of TYPES of modifications found.
+    def modification_mask(self, modification, regex=True):
+        """Return a boolean Series, aligned with raw, of the peptides with a modification.
 
         Parameters
         ----------
-        df : Dataframe
+        modification: str
+            A modification type e.g. "Acetyl", or a pattern if regex is True.
 
-        Returns
-        -------
+        regex: bool
+            Defaults to True.
+        """
+        return self.modification_index.mask(modification, regex=regex)
 
+    def _modification_mask_for(self, dataframe, modification):
+        """Return a boolean array of the rows of dataframe with a modification.
+
+        Uses the modification index when the rows of dataframe still line up
+        with raw, otherwise the Modifications column of dataframe is searched.
         """
+        mask = self.modification_mask(modification)
+        if dataframe.index.equals(mask.index):
+            return mask.values
+        return dataframe.Modifications.str.contains(modification).values
 
-        found = set(itertools.chain.from_iterable(self._simplify_modifications()))
+    def site_index(self, selected_mod):
+        """Return the SiteIndex of the peptides with a modification.
 
-        return found
+        Sites are located with SequenceAnnotationTools.protein_sites in the
+        master protein of each peptide. The index is kept for later calls.
 
+        Parameters
+        ----------
+        selected_mod: str
+            A modification type e.g. "Acetyl", see modification_mask.
+        """
+        indexes = self.__dict__.setdefault("_site_indexes", dict())
+        if selected_mod not in indexes:
+            sites = SequenceAnnotationTools.protein_sites(self.raw, mod_list=[selected_mod],
+                                                          modification_index=self.modification_index)
+            peptides = self.raw.index.get_indexer(sites.index)
+            indexes[selected_mod] = SiteIndex(peptides, sites.reset_index(drop=True))
+        return indexes[selected_mod]
 
-    def get_in_vivo_modifications(self):
-        """Return list of the in vivo modifications.
+    def roll_up_sites(self, dataframe, selected_mod, how="sum"):
+        """Return the values of dataframe rolled up from peptides to sites.
 
         Parameters
         ----------
-        df : Dataframe
+        dataframe: DataFrame
+            Numeric, with rows indexed like raw e.g. self.Abundance or a
+            fraction of self.load_normalized.
+
+        selected_mod: str
+
+        how: str
+            "sum", "median" or "max_intensity", see SiteIndex.aggregate.
 
         Returns
         -------
-        invivo_modifications : set
+        result: DataFrame
+            Indexed by (Accession, Residue, Position) with the columns of
+            dataframe.
         """
+        index = self.site_index(selected_mod)
+        values = dataframe.reindex(self.raw.index).values
+        return pd.DataFrame(index.aggregate(values, how=how), index=index.keys.index, columns=dataframe.columns)
 
-        present_modifications = self.get_all_modifications()
-        chemical_modifications = {'Oxidation', 'Carbamidomethyl', 'TMT6plex', 'TMT10plex'}
-        invivo_modifications = [modification for modification in present_modifications if modification not in chemical_modifications]
-        return invivo_modifications
+    def site_std_out(self, selected_mod, comparisons, how="sum", n_jobs=None, executor=None):
+        """Return std_out at the site level.
 
-    def _simplify_modifications(self):
-        """Return a series of simplifed modifications.
+        The load normalized abundances of every linked fraction are rolled
+        up to sites and then Log2 normalized and compared like std_out.
 
         Parameters
         ----------
-        df : DataFrame
+        selected_mod: str
+
+        comparisons: list
+            In the format: [[numerator, denominator],...]
+
+        how: str
+            "sum", "median" or "max_intensity", see SiteIndex.aggregate.
+
+        n_jobs: int
+
+        executor: concurrent.futures.Executor
+        """
+        index = self.site_index(selected_mod)
+        sites_metadata = pd.set_super_columns([index.keys.reset_index()], ["Metadata"])
+        sites_metadata.index = index.keys.index
+
+        fractions = list(self._linked_fractions.keys())
+
+        norm_sites = dict((k, self.roll_up_sites(self.load_normalized.__dict__[k], selected_mod, how=how)) for k in fractions)
+        norm_sites_log2 = dict((k, norm_sites[k].log2_normalize()) for k in fractions)
+
+        batches = pd.fold_change_with_ttest_batches([norm_sites_log2[k] for k in fractions],
+                                                    comparisons,
+                                                    missing_values=True,
+                                                    n_jobs=n_jobs,
+                                                    executor=executor)
+
+        results_list = [sites_metadata]
+        for k, relative_abundance_comparisons in zip(fractions, batches):
+            comparison_labels = ["Site_Abundance"+k+"_Stats_{}_vs_{}".format(numerator, denominator)
+                                 for numerator, denominator in comparisons]
+
+            rel_abun = pd.set_super_columns([norm_sites[k], norm_sites_log2[k]],
+                                            ["Load_Normalized"+k, "Load_Normalized_Log2_Normalized"+k,])
+
+            rel_comp = pd.set_super_columns(relative_abundance_comparisons, comparison_labels)
+
+            results_list.append(pd.concat([rel_abun, rel_comp], axis=1))
+
+        return pd.concat(results_list, axis=1)
+
+    def _simplify_modifications(self):
+        """Return a series of simplifed modifications.
 
         Returns
         -------
         simplified : Series
+            The list of modification types of each peptide.
         """
-        simplified = None
-        if any(self.raw.columns == "Modifications"):
-            # Compile the regular expression to be used in findall
-            # rx = re.compile("x(\w+)\s")
-            # simplified = dataframe.Modifications.apply(rx.findall)
-            try:
-                simplified = self.raw.Modifications.str.findall("x(\w+)\s")
-                simplified = simplified.apply(lambda x: x if isinstance(x, list) else [])
-                return simplified
-            except Exception as err:
-                print(err)
-                return simplified
-        else:
-            print("No Modifications column found in Peptide Groups data.")
+        return self.modification_index.per_peptide()
 
 
     def get_all_modifications(self):
         """Return set of ALL of TYPES of modifications found.
 
-        Parameters
-        ----------
-        df : Dataframe
-
         Returns
         -------
-
+        found : set
         """
-
-        found = set(itertools.chain.from_iterable(self._simplify_modifications()))
+        found = set(self.modification_index.types)
 
         return found
 
 
+    def get_in_vivo_modifications(self):
+        """Return list of the in vivo modifications.
+
+        Returns
+        -------
+        invivo_modifications : list
+        """
+        present_modifications = self.modification_index.types
+        invivo_modifications = [modification for modification in present_modifications if modification not in self.chemical_modifications]
+        return invivo_modifications
+
     def _set_in_vivo_modifications(self):
         """FIXME: Add docs.
         """
@@ -543,16 +699,15 @@ class PeptideGroups(ProteomeDiscovererRaw):
             # If the list is greater than zero then set varible.
             if len(in_vivo_mods) > 0:
                 self._in_vivo_modifications = in_vivo_mods
-                # For each modification create a filtered dataframe attribute.
-                # FIXME: This loop complates thing for a nuber of reasons it needs revision.
+                # Each modification is exposed as an attribute e.g. self.acetyl
+                # that selects the rows of raw when accessed, see __getattr__.
+                self._modification_attributes = dict()
+                counts = self.modification_index.counts()
                 for i in in_vivo_mods:
                     mod = StringTools.remove_punctuation(i).lower()
-                    #FIXME: SelectionTools.filter_row will be migrated to pandomics.
-                    # df = SelectionTools.filter_row(self.raw, on="Modifications", term=i)
-                    df = self.raw.filter_rows(on= "Modifications", term=i)
+                    self._modification_attributes[mod] = i
                     # METADATA: Total Peptide Group IDs
-                    self.metadata[mod+"_total_peptide_ids"] = df.shape[0]
-                    self.__dict__[mod] = df
+                    self.metadata[mod+"_total_peptide_ids"] = int(counts[i])
             else:
                 pass
         else:
@@ -560,65 +715,19 @@ class PeptideGroups(ProteomeDiscovererRaw):
 
 
     def _separate_enriched_and_input(self):
-        """Return object with load normalzed pd.DataFrames as attributes.
+        """Return the input and the enriched fraction numbers.
 
-        See Also: omin.core.containers.load_normalized
+        See Also: omin.core.design.StudyDesign.input_fractions
         """
-        # FIXME: NORMALIZE INPUT TO ITS SELF.
-
-        input_mask = self.study_factor_table[self.study_factor_with_input].str.contains("[Ii][Nn][Pp][Uu][Tt]")
-        # FIXME: Replace the bobo method to find input fraction numbers
-        number_input_fractions = len(self.study_factor_table.loc[input_mask]._Fn.unique())
-
-        # isolate the input fractions study factors.
-        inps = self.study_factor_table.loc[input_mask]
-        inps = [inps.filter_rows(on="_Fn", term=i+"\Z") for i in inps._Fn.unique()]
-
-        # isolate the other fractions study factors.
-        frcs = self.study_factor_table.loc[~input_mask]
-        frcs = [frcs.filter_rows(on="_Fn", term=i+"\Z") for i in frcs._Fn.unique()]
-
-        return inps, frcs
+        return list(self.study_design.input_fractions), list(self.study_design.enriched_fractions)
 
 
     def _link_enriched_to_input(self):
-        """Returns list of DataFrames linking enriched fractions to inputs.
+        """Return the table linking enriched fractions to their inputs.
 
-        See Also: omin.core.containers.load_normalized
+        See Also: omin.core.design.StudyDesign.link_enriched_to_input
         """
-        # Create a list of linkage DataFrames.
-        inps, frcs = self._separate_enriched_and_input()
-
-        # Create a list of linkage DataFrames.
-        linked = []
-        for j in frcs:
-            for i in inps:
-                if j.shape == i.shape:
-                    # Isolate the just the columns to compare.
-                    cols_to_compare = list(filter(lambda x: x not in {"_Fn", "Fraction"}, j.columns))
-                    # Create bolean comparison matrix.
-                    comparison_matrix = j[cols_to_compare].values == i[cols_to_compare].values
-                    # Find the number of cells in the matrix.
-                    number_of_cells = comparison_matrix.shape[0]*comparison_matrix.shape[1]
-                    # Calculate similarity 1 being the most simillar 0 being the least.
-                    score = sum(sum(comparison_matrix))/number_of_cells
-                    # Create the link DataFrame
-                    link = pd.DataFrame(i.index, columns=["Link"], index=j.index)
-                    # Create score DataFrame
-                    score_df = pd.DataFrame([i.shape[0]*[score]]).T
-                    score_df.columns = ["Score"]
-                    # Give the score_df the same index as j.
-                    score_df.index = j.index
-                    # Concatenate j, link and score_df
-                    j_prime = pd.concat([j, link, score_df], axis=1)
-                    linked.append(j_prime)
-
-
-        scores = np.array([i.Score.unique()[0] for i in linked])
-        # Isolate the highest scoring linked fractions
-        linked = list(filter(lambda x:x.Score.unique()[0] == scores.max(), linked))
-
-        return linked
+        return self.study_design.fraction_links.copy()
 
 
     @property
@@ -629,41 +738,80 @@ class PeptideGroups(ProteomeDiscovererRaw):
         normalized to themselves are not used to normalize enriched fractions
         non-normalized inputs are.
 
+        The result is computed once and reused until raw is assigned, the
+        study design changes or raw_changed is called after an in place edit. load_normalized_stats counts how often it was computed and
+        how long that took.
+
         See Also:
         omin.core.containers._link_enriched_to_input
         omin.core.containers._separate_enriched_and_input
 
+        """
+        stats = self.__dict__.setdefault("load_normalized_stats", dict(computed=0, cache_hits=0, seconds=0.0))
+        cached = self.__dict__.get("_load_normalized_cache", None)
+
+        if cached is not None and self._same_key(cached[0], self._load_normalized_key()):
+            stats["cache_hits"] += 1
+            return cached[1]
+
+        start = time.perf_counter()
+        result = self._compute_load_normalized()
+        stats["seconds"] += time.perf_counter() - start
+        stats["computed"] += 1
+        # Keyed after computing, the study design is built on the first call.
+        self._load_normalized_cache = (self._load_normalized_key(), result)
+        return result
+
+
+    def _load_normalized_key(self):
+        """Return the key the load_normalized cache is valid for.
+
+        Made from raw_version, the columns of raw and the stored study
+        design, so a cache hit never builds Abundance or parses the headers.
+        The key holds the objects themselves, they are compared by identity.
+        """
+        design = self.__dict__.get("_study_design", None)
+        return (self.raw_version, self.raw.columns, self.raw.shape, design, self.normalization_method)
+
+
+    def invalidate_load_normalized(self):
+        """Drop the cached load_normalized result so the next access recomputes it.
+        """
+        self.__dict__.pop("_load_normalized_cache", None)
+
+
+    def _compute_load_normalized(self):
+        """Return the load normalized fractions as a Normalized object.
+
+        See Also: omin.core.containers.load_normalized
         """
         # Collect the linked fractions.
         linked = self._link_enriched_to_input()
         # Collect the input and enriched fractions.
         inps, frcs = self._separate_enriched_and_input()
 
+        cube = self.abundance_cube
+        # The fraction whose factors normalize each fraction of the cube.
+        link = np.arange(len(cube.fractions))
+        # The fractions to return, in the format: fraction -> fraction tag.
+        names = OrderedDict()
+
         # Normalize the inputs to themselves.
-        normalized = dict()
-        for inp in inps:
-            inp_df = self.Abundance[self.Abundance.columns[inp.index]]
-            inp_df = inp_df.normalize_to(inp_df)
-            inp_label = self.fraction_tag(inp._Fn.unique()[0])
-            normalized[inp_label] = inp_df
+        for inp_fn in inps:
+            names[inp_fn] = self.fraction_tag(inp_fn)
 
         # Create the _linked_fractions dict
         self._linked_fractions = dict()
-        # Normalize the linked fractions.
-        for link in linked:
-            # Get the input label.
-            inp_label = self.fraction_tag(self.study_factor_table.iloc[link.Link]._Fn.unique()[0])
-            # Collect the linked input abundance values.
-            inp = self.Abundance[self.Abundance.columns[link.Link]]
-            # Get the enriched fraction.
-            other_label = self.fraction_tag(link._Fn.unique()[0])
-            # Collect the linked enriched abundance values.
-            other = self.Abundance[self.Abundance.columns[link.index]]
-            # Normalize the enriched fraction to the input
-            load_normalized = other.normalize_to(inp)
-            normalized[other_label] = load_normalized
+        # Normalize the enriched fractions to their linked inputs.
+        for other_fn, inp_fn in zip(linked._Fn, linked.Input):
+            link[cube.position(other_fn)] = cube.position(inp_fn)
+            names[other_fn] = self.fraction_tag(other_fn)
             # Add the link to the dict for use in other functions.
-            self._linked_fractions[other_label] = inp_label
+            self._linked_fractions[names[other_fn]] = self.fraction_tag(inp_fn)
+
+        # Every fraction is normalized in one call, only the ones in names are labeled.
+        values = cube.normalize(self.normalization_method, link=link)
+        normalized = cube.frames(values, names=names, link=link)
 
         # Throwing the normalized dict into the Normalized class
         return Normalized(**normalized)
@@ -671,7 +819,7 @@ class PeptideGroups(ProteomeDiscovererRaw):
 
 
     # FIXME: Define the two following functions at the PeptideGroups and Proteins Level.
-    def std_out(self, selected_mod, comparisons):
+    def std_out(self, selected_mod, comparisons, n_jobs=None, executor=None):
         """
         Parameters
         ----------
@@ -680,65 +828,64 @@ class PeptideGroups(ProteomeDiscovererRaw):
 
         comparisons: list
             In the format: [[numerator, denominator],...]
+
+        n_jobs: int
+            Number of worker processes for the fraction x comparison t-tests.
+            Defaults to None, everything runs in this process. -1 uses every
+            core.
+
+        executor: concurrent.futures.Executor
+            An existing executor to use instead of starting a new pool.
         """
-        mod_mask = self.master_index.Modifications.str.contains(selected_mod)
+        mod_mask = self._modification_mask_for(self.master_index, selected_mod)
 
         peptides_metadata = self.master_index.loc[mod_mask]
 
         peptides_metadata = pd.set_super_columns([peptides_metadata], ["Metadata"])
 
-        results_list = []
-        for k in self._linked_fractions.keys():
-            norm_peptides = self.load_normalized.__dict__[k].loc[mod_mask]
-            norm_peptides_log2 = norm_peptides.log2_normalize()
-
-            comparison_labels = []
-            relative_abundance_comparisons = []
+        fractions = list(self._linked_fractions.keys())
 
-            for i in comparisons:
-                numerator = i[0]
-                denominator = i[1]
+        norm_peptides = dict()
+        norm_peptides_log2 = dict()
+        norm_peptides_occ = dict()
+        for k in fractions:
+            norm_peptides[k] = self.load_normalized.__dict__[k].loc[mod_mask]
+            norm_peptides_log2[k] = norm_peptides[k].log2_normalize()
+            norm_peptides_occ[k] = self.relative_occupancy.__dict__[k].loc[mod_mask]
 
-                comparision_label = "Relative_Abundance"+k+"_Stats_{}_vs_{}".format(numerator, denominator)
+        # Every fraction x comparison t-test is independent so they are run together.
+        batches = pd.fold_change_with_ttest_batches([norm_peptides_log2[k] for k in fractions]
+                                                    + [norm_peptides_occ[k] for k in fractions],
+                                                    comparisons,
+                                                    missing_values=True,
+                                                    n_jobs=n_jobs,
+                                                    executor=executor)
 
-                comparison_labels.append(comparision_label)
+        relative_abundance_comparisons = dict(zip(fractions, batches[:len(fractions)]))
+        relative_occupancy_comparisons = dict(zip(fractions, batches[len(fractions):]))
 
-                relative_abundance_comp = norm_peptides_log2.fold_change_with_ttest(numerator=numerator,
-                                                                                    denominator=denominator,
-                                                                                    missing_values=True)
-                relative_abundance_comparisons.append(relative_abundance_comp)
+        results_list = []
+        for k in fractions:
+            comparison_labels = ["Relative_Abundance"+k+"_Stats_{}_vs_{}".format(numerator, denominator)
+                                 for numerator, denominator in comparisons]
 
-            rel_abun = pd.set_super_columns([norm_peptides, norm_peptides_log2],
+            rel_abun = pd.set_super_columns([norm_peptides[k], norm_peptides_log2[k]],
                                             ["Load_Normalized"+k, "Load_Normalized_Log2_Normalized"+k,])
 
-            rel_comp = pd.set_super_columns(relative_abundance_comparisons, comparison_labels)
+            rel_comp = pd.set_super_columns(relative_abundance_comparisons[k], comparison_labels)
 
             # Collect the related proteins. These are just for the readers that want to check the work.
             related_proteins = self.load_normalized_related_proteins.__dict__[self._linked_fractions[k]].loc[mod_mask]
 
             related_proteins_log2_normalized = related_proteins.log2_normalize()
 
-            norm_peptides_occ = self.relative_occupancy.__dict__[k].loc[mod_mask]
-
-            comparison_labels = []
-            relative_occupancy_comparisons = []
-
-            for i in comparisons:
-                numerator = i[0]
-                denominator = i[1]
-                comparision_label = "Relative_Occupancy"+k+"_Stats_{}_vs_{}".format(numerator, denominator)
-                comparison_labels.append(comparision_label)
+            comparison_labels = ["Relative_Occupancy"+k+"_Stats_{}_vs_{}".format(numerator, denominator)
+                                 for numerator, denominator in comparisons]
 
-                relative_occupancy_comp = norm_peptides_occ.fold_change_with_ttest(numerator=numerator,
-                                                                                   denominator=denominator,
-                                                                                   missing_values=True)
-                relative_occupancy_comparisons.append(relative_occupancy_comp)
-
-            rel_occ = pd.set_super_columns([norm_peptides_occ], ["Relative_Occupancy"+k])
-            rel_occ = pd.set_super_columns([related_proteins, related_proteins_log2_normalized, norm_peptides_occ],
+            rel_occ = pd.set_super_columns([related_proteins, related_proteins_log2_normalized, norm_peptides_occ[k]],
                                            ["Load_Normalized_Related_Protein_Abundances"+self._linked_fractions[k], "Log2_Normalized_Load_Normalized_Related_Protein_Abundances"+self._linked_fractions[k], "Relative_Occupancy"+k])
 
-            rel_occ_comp = pd.set_super_columns(relative_occupancy_comparisons, comparison_labels)
+            rel_occ_comp = pd.set_super_columns(relative_occupancy_comparisons[k], comparison_labels)
             result = pd.concat([rel_abun, rel_comp, rel_occ, rel_occ_comp], axis=1)
             results_list.append(result)
 
@@ -757,7 +904,10 @@ class Proteins(ProteomeDiscovererRaw):
     Derived from the ProteomeDiscovererRaw class
     """
 
-    def __init__(self, filepath_or_buffer=None, rescue_entrez_ids=False, *args, **kwargs):
+    # master_index columns that identify a protein across exports, see omin.core.multiplex.
+    multiplex_key = ["Accession"]
+
+    def __init__(self, filepath_or_buffer=None, rescue_entrez_ids=False, accession_index=None, *args, **kwargs):
         """
 
         Parameters
@@ -767,6 +917,9 @@ class Proteins(ProteomeDiscovererRaw):
         rescue_entrez_ids: Bool
             Defaults to False.
 
+        accession_index: omin.databases.AccessionIndex
+            Used to fill in missing Entrez Gene IDs offline. Defaults to None.
+
         Attributes
         ----------
         metadata: dict
@@ -807,7 +960,7 @@ class Proteins(ProteomeDiscovererRaw):
 
         # self.gene_name_extractor()
         # Attach MitoCarta2 data to the master_index.
-        self.add_database(MitoCartaTwo.essential)
+        self.add_database(MitoCartaTwo.essential_by_entrez, accession_index=accession_index)
 
         # Attach MitoCarta2 data to the master_index.
         # self.add_database(MitoCartaThree.essential)
@@ -925,10 +1078,23 @@ class Proteins(ProteomeDiscovererRaw):
         return
 
 
-    def add_database(self, DataFrame):
+    def add_database(self, DataFrame, accession_index=None):
         """Add databases to master_index.
+
+        Parameters
+        ----------
+        DataFrame: pandas.DataFrame
+            Joined on EntrezGeneID, either a column or the index. An indexed
+            DataFrame (e.g. MitoCartaTwo.essential_by_entrez) is joined
+            without copying or merging the whole table.
+
+        accession_index: omin.databases.AccessionIndex
+            If given, missing Entrez Gene IDs are first looked up by Accession
+            so those proteins are kept. Defaults to None.
         """
         # FIXME: Expose this function to users.
+        if accession_index is not None:
+            self.fill_entrez_ids(accession_index)
         try:
             # -------------------------------------------
             # DROPNA: Lose rows that have missing values.
@@ -936,7 +1102,13 @@ class Proteins(ProteomeDiscovererRaw):
             self._old_master_index = self.master_index.copy()
             self.master_index.dropna(inplace=True)
             self.master_index.EntrezGeneID = self.master_index.EntrezGeneID.first_member().apply(np.int64)
-            result = self.master_index.merge(DataFrame.copy(), on="EntrezGeneID", how="left")
+            if DataFrame.index.name == "EntrezGeneID" and DataFrame.index.is_unique:
+                joined = DataFrame.reindex(self.master_index.EntrezGeneID.values)
+                # Same shape and RangeIndex as a left merge.
+                result = pd.concat([self.master_index.reset_index(drop=True),
+                                    joined.reset_index(drop=True)], axis=1)
+            else:
+                result = self.master_index.merge(DataFrame.copy(), on="EntrezGeneID", how="left")
             self.master_index = result
             self.master_index.fillna(False, inplace=True)
 
@@ -944,10 +1116,21 @@ class Proteins(ProteomeDiscovererRaw):
             print(err)
 
 
+    def fill_entrez_ids(self, accession_index):
+        """Fill in missing Entrez Gene IDs of the master_index from an AccessionIndex.
+
+        Returns
+        -------
+        filled: int
+            The number of Entrez Gene IDs that were filled in.
+        """
+        return accession_index.fill(self.master_index)
+
+
     def filter_abundance(self):
         """Filter the Abundance columns by the the high confidence master proteins.
         """
-        if "Abundance" in self.__dict__:
+        if "Abundance" in self._thermo_categories:
             try:
                 self.Abundance = self.Abundance.loc[self.master_high_confidence.index]
             except Exception as err:
@@ -956,7 +1139,7 @@ class Proteins(ProteomeDiscovererRaw):
             print("Could not filter protein abundance by high confidence master proteins.")
 
 
-    def std_out(self, selected_mod, comparisons):
+    def std_out(self, selected_mod, comparisons, n_jobs=None, executor=None):
         """
         Parameters
         ----------
@@ -964,35 +1147,38 @@ class Proteins(ProteomeDiscovererRaw):
 
         comparisons: list
             In the format: [[numerator, denominator],...]
+
+        n_jobs: int
+            Number of worker processes for the fraction x comparison t-tests.
+            Defaults to None, everything runs in this process. -1 uses every
+            core.
+
+        executor: concurrent.futures.Executor
+            An existing executor to use instead of starting a new pool.
         """
 
         proteins_metadata = self.master_index
 
         proteins_metadata =  pd.set_super_columns([proteins_metadata], ["Metadata"])
 
-        results_list = []
-        for k in self.load_normalized.__dict__.keys():
-
-            norm_proteins = self.load_normalized.__dict__[k]
-            norm_proteins_log2 = norm_proteins.log2_normalize()
-
-            comparison_labels = []
-            relative_abundance_comparisons = []
+        fractions = list(self.load_normalized.__dict__.keys())
 
-            for i in comparisons:
-                numerator = i[0]
-                denominator = i[1]
+        norm_proteins = dict((k, self.load_normalized.__dict__[k]) for k in fractions)
+        norm_proteins_log2 = dict((k, norm_proteins[k].log2_normalize()) for k in fractions)
 
-                comparision_label = "Protein_Expression_Stats"+k+"_{}_vs_{}".format(numerator, denominator)
+        batches = pd.fold_change_with_ttest_batches([norm_proteins_log2[k] for k in fractions],
+                                                    comparisons,
+                                                    missing_values=True,
+                                                    n_jobs=n_jobs,
+                                                    executor=executor)
 
-                comparison_labels.append(comparision_label)
+        results_list = []
+        for k, relative_abundance_comparisons in zip(fractions, batches):
 
-                relative_abundance_comp = norm_proteins_log2.fold_change_with_ttest(numerator=numerator,
-                                                                                    denominator=denominator,
-                                                                                    missing_values=True)
-                relative_abundance_comparisons.append(relative_abundance_comp)
+            comparison_labels = ["Protein_Expression_Stats"+k+"_{}_vs_{}".format(numerator, denominator)
+                                 for numerator, denominator in comparisons]
 
-            rel_abun = pd.set_super_columns([norm_proteins, norm_proteins_log2],
+            rel_abun = pd.set_super_columns([norm_proteins[k], norm_proteins_log2[k]],
                                             ["Load_Normalized"+k, "Load_Normalized_Log2_Normalized"+k,])
 
             rel_comp = pd.set_super_columns(relative_abundance_comparisons, comparison_labels)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.design
+----------------
+
+Provides the StudyDesign class which parses the study factors out of the
+Abundance column headers of a Proteome Discoverer export.
+
+The design is a pure function of the column headers, so it is parsed once
+and reused for as long as the headers do not change. See
+omin.core.containers.ProteomeDiscovererRaw.study_design.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+# ----------------
+# EXTERNAL IMPORTS
+# ----------------
+import re
+import string
+
+from .pandomics import pandas as pd
+
+
+class StudyDesign(object):
+    """Study factors parsed from Abundance column headers.
+
+    Study Factors should be in the format:
+        KO (Genotype), WT (Genotype), Input (Fraction), Phospho (Fraction) ect.
+
+    If study factor cannot be identified then StudyFactor_<ABC...> will be assigned.
+
+    Parameters
+    ----------
+    columns: list-like
+        The Abundance column labels e.g.
+        "Abundance: F1: 126, Sample, KO (Genotype), Input (Fraction)"
+
+    Attributes
+    ----------
+    columns: tuple
+        The column labels the design was parsed from.
+
+    study_factor_table: pandas.DataFrame
+        One row per Abundance column with the fraction number (_Fn), TMT tag
+        (_TMT_tag) and one column per study factor.
+
+    study_factor_dict: dict
+        Study factors as keys and their unique options as values.
+
+    tmt_plex_number: int
+
+    input_number: float
+
+    study_factor_with_input: str or None
+
+    fraction_tags: dict
+        Fraction numbers as keys and fraction tags as values.
+
+    bridge_mask: pandas.Series
+        True for the rows of study_factor_table that are pooled bridge
+        channels i.e. a study factor contains POOL, Pool or Bridge.
+
+    input_fractions: list
+        The fraction numbers of the input fractions.
+
+    enriched_fractions: list
+        The fraction numbers of every other fraction.
+
+    fraction_links: pandas.DataFrame
+        The input each enriched fraction is normalized to, see
+        link_enriched_to_input.
+    """
+
+    input_rx = re.compile("[Ii][Nn][Pp][Uu][Tt]")
+
+    # The same terms fraction tags leave out.
+    bridge_rx = re.compile("POOL|[Pp]ool|BRIDGE|[Bb]ridge")
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.study_factor_table = self._parse_study_factor_table(self.columns)
+        self.study_factor_dict = self._parse_study_factor_dict(self.study_factor_table)
+        self.tmt_plex_number = self.study_factor_table._TMT_tag.unique().shape[0]
+        self.input_number = self._count_inputs(self.columns, self.tmt_plex_number)
+        self.study_factor_with_input = self._find_study_factor_with_input(self.study_factor_dict)
+        self.fraction_tags = dict([(i, self._fraction_tag(self.study_factor_table, i))
+                                   for i in self.study_factor_table._Fn.unique()])
+        self.bridge_mask = self._find_bridge_channels(self.study_factor_table)
+        self.input_fractions, self.enriched_fractions = self._separate_enriched_and_input()
+        self.fraction_links = self.link_enriched_to_input()
+
+    def matches(self, columns):
+        """Return True if the design was parsed from these column labels."""
+        return self.columns == tuple(columns)
+
+    def fraction_tag(self, fraction_number=None):
+        """Return the characteristic string for a fraction or an empty string."""
+        return self.fraction_tags.get(fraction_number, "")
+
+    @staticmethod
+    def _parse_study_factor_table(columns):
+        """Return the study factor table for a list of Abundance column labels."""
+        column_names = [i.split(":")[-1].strip() for i in columns]
+
+        column_names = pd.DataFrame(list(map(lambda x: x.split(','), column_names)))
+
+        # Remove the sample column if present.
+        if len(column_names.iloc[:, 1].unique()) < 2:
+            column_names = pd.concat([column_names.iloc[:, 0], column_names.iloc[:, 2:]], axis=1)
+
+        # Compile the regular expression to catch things in (parenthesis).
+        # FIXME: BIG ASSUMPTION HERE. DOCUMENT OR DIE. #DOD
+        rx = re.compile(r"[\[\(](.+)[\[\)\]]")
+
+        study_factors = []
+        for i in range(1, len(column_names.columns)):
+            try:
+                ucols = column_names.iloc[:, i].apply(lambda x: rx.findall(x)[0])
+                ucols = ucols.unique()
+                study_factor = ucols[0]
+                study_factors.append(study_factor)
+
+            except IndexError as err:
+                # If study factor cannot be identified then StudyFactor_<ABC...> will be assigned.
+                study_factor = "StudyFactor_" + string.ascii_uppercase[i-1]
+                study_factors.append(study_factor)
+
+        column_names.columns = ['_TMT_tag'] + study_factors
+        # Prepend the fraction number.
+        fn = [i.split(":")[1].strip() for i in columns]
+        fn = pd.DataFrame(fn, columns=["_Fn"])
+
+        column_names = pd.concat([fn, column_names], axis=1)
+        return column_names
+
+    @staticmethod
+    def _parse_study_factor_dict(study_factor_table):
+        """Return the study_factor_table as a flattened dict."""
+        study_factor_dict = dict()
+        for i in range(2, study_factor_table.columns.shape[0]):
+            usf = study_factor_table.iloc[:, i].unique()
+            usf = list(map(lambda x: x.strip(), usf))
+            study_factor_dict[study_factor_table.iloc[:, i].name] = usf
+        return study_factor_dict
+
+    @classmethod
+    def _count_inputs(cls, columns, plex_number):
+        """Return the number of input fractions as a float."""
+        # FIXME: Proof this against Inputase ect.
+        input_abundance = len([i for i in columns if cls.input_rx.search(i)])
+        return input_abundance/plex_number
+
+    @classmethod
+    def _find_study_factor_with_input(cls, study_factor_dict):
+        """Return the study factor that contains "Input" or "input"."""
+        study_factor_with_input = None
+        for k,v in study_factor_dict.items():
+            #FIXME: BIG ASSUMPTION HERE -> There will be only one study factor that contains a term including [Ii]nput.
+            li = bool(sum(list(map(lambda x:bool(len(cls.input_rx.findall(x))), v))))
+            if li:
+                study_factor_with_input = k
+        return study_factor_with_input
+
+    @classmethod
+    def _find_bridge_channels(cls, study_factor_table):
+        """Return a boolean Series of the bridge channel rows."""
+        factors = study_factor_table.iloc[:, 2:].astype(str)
+        mask = factors.apply(lambda x: x.str.contains(cls.bridge_rx)).any(axis=1)
+        return mask.rename("Bridge")
+
+    def _separate_enriched_and_input(self):
+        """Return the input and the enriched fraction numbers in table order."""
+        table = self.study_factor_table
+        fractions = list(table._Fn.unique())
+        if self.study_factor_with_input is None:
+            return [], fractions
+        is_input = table[self.study_factor_with_input].str.contains(self.input_rx)
+        inputs = set(table._Fn[is_input])
+        return [i for i in fractions if i in inputs], [i for i in fractions if i not in inputs]
+
+    def fraction_signatures(self):
+        """Return every fraction's study factors as a hashable key.
+
+        A signature is the sorted tuple of the (TMT tag, study factor...)
+        rows of a fraction, leaving out the fraction number and the study
+        factor that marks inputs. Fractions with the same samples in the
+        same channels have the same signature.
+
+        Returns
+        -------
+        signatures : dict
+            In the format: fraction number -> signature.
+        """
+        ignored = {"_Fn", "Fraction", self.study_factor_with_input}
+        columns = [i for i in self.study_factor_table.columns if i not in ignored]
+        table = self.study_factor_table
+        rows = dict()
+        for fn, row in zip(table._Fn.values, table[columns].itertuples(index=False, name=None)):
+            rows.setdefault(fn, []).append(row)
+        return dict((k, tuple(sorted(v))) for k, v in rows.items())
+
+    def link_enriched_to_input(self):
+        """Return the table linking every enriched fraction to its input.
+
+        An enriched fraction links to the inputs with the same signature (see
+        fraction_signatures). If no enriched fraction has an exact match they
+        link to the inputs they share the most channel x study factor cells
+        with, as long as the number of channels is the same.
+
+        Returns
+        -------
+        links : pandas.DataFrame
+            With the columns _Fn (enriched), Input and Score, 1 for an exact
+            match.
+        """
+        signatures = self.fraction_signatures()
+        by_signature = dict()
+        for i in self.input_fractions:
+            by_signature.setdefault(signatures[i], []).append(i)
+
+        links = [(j, i, 1.0) for j in self.enriched_fractions for i in by_signature.get(signatures[j], [])]
+
+        if len(links) == 0:
+            # No exact matches, keep the best scoring pairs.
+            for j in self.enriched_fractions:
+                for i in self.input_fractions:
+                    if len(signatures[j]) == len(signatures[i]):
+                        cells = [a == b for x, y in zip(signatures[j], signatures[i]) for a, b in zip(x, y)]
+                        links.append((j, i, sum(cells) / max(len(cells), 1)))
+            best = max([i[2] for i in links] + [0])
+            links = [i for i in links if i[2] == best]
+
+        return pd.DataFrame(links, columns=["_Fn", "Input", "Score"])
+
+    @staticmethod
+    def _fraction_tag(study_factor_table, fraction_number):
+        """Return a characteristic string for a fraction."""
+        by_fn = study_factor_table.loc[study_factor_table._Fn == fraction_number].iloc[:, 2:]
+
+        # Regex for isolating the study factor from it's category.
+        rx = re.compile(r'(.+)\s[\[\(].+[\]\)]')
+
+        tag_for_fraction = ""
+        for i in by_fn:
+            terms = by_fn[i].unique()
+
+            terms = list(map(lambda x:x.strip(), terms))
+
+            terms = list(filter(lambda k: 'POOL' not in k, terms))
+
+            terms = list(filter(lambda k: 'Pool' not in k, terms))
+
+            #  FIXME: add some try and excepts with better docs.
+            if len(terms) == 1:
+                parens = set(["(", ")", "[", "]"])
+
+                if any([len(parens & set(list(i))) > 0 for i in terms]):
+                    term = terms[0]
+
+                    # Isolate the study factor from it's category.
+                    term = rx.findall(term)
+                else:
+                    term = terms
+
+                if len(term) == 1:
+                    # Make everything lowercase.
+                    term = term[0].lower()
+                    # Replace any whitespace with underscore.
+                    term = re.sub(r"\s", "_", term)
+
+                    term = re.sub('-', '_', term)
+                    tag_for_fraction = "_".join([tag_for_fraction, term])
+
+        return tag_for_fraction
@@ -8,7 +8,6 @@ Provides tools to quickly funnel data in and out of Jupyter Notebooks.
 
 import _io
 import os
-import xlrd
 import inspect
 
 # Try to import pandas from pandomics
@@ -17,28 +16,34 @@ try:
 except ImportError as err:
     import pandas as pd
 
+from ..utils.io_tools import TableCache
+
 # from .cli_tools import CLITools
 # from ..jtkinter import filedialog
 
-# import os
-import tkinter
-from tkinter.filedialog import Open, Directory, SaveAs
+# NOTE: tkinter is imported when a dialog is requested so that importing this
+# module works without a display.
 
 # Find the cureent working directory.
 here = os.getcwd()
 
+# The shared root window, created by the first dialog.
+_root = None
+
 
 def conditional_kwargs(**nkwargs):
     """Returns function with conditionally supplied kwargs.
 
     If a given keyword argument has not been supplied in the function
     definition then the keyword from the decorator will be substituted in.
+    Callable defaults are called when the function is, so that e.g. windows
+    are only created once they are needed.
     """
     def decorator(some_function):
         def wrapper(nkwargs=nkwargs, *args, **kwargs):
             for k, v in nkwargs.items():
                 if k not in kwargs:
-                    kwargs[k] = v
+                    kwargs[k] = v() if callable(v) else v
                 else:
                     pass
             return some_function(*args, **kwargs)
@@ -48,12 +53,24 @@ def conditional_kwargs(**nkwargs):
 
 def root_topmost():
     """Return root as a withdrawn topmost window.
+
+    The window is created on the first call and shared by later dialogs.
     """
-    root = tkinter.Tk()
-    # Hide the main window.
-    root.withdraw()
-    root.call('wm', 'attributes', ".", '-topmost', True)
-    return root
+    global _root
+    if _root is None:
+        import tkinter
+        root = tkinter.Tk()
+        # Hide the main window.
+        root.withdraw()
+        root.call('wm', 'attributes', ".", '-topmost', True)
+        _root = root
+    return _root
+
+
+def _tk_filedialog():
+    """Return the tkinter.filedialog module."""
+    from tkinter import filedialog as tk_filedialog
+    return tk_filedialog
 
 
 class filedialog(object):
@@ -63,39 +80,39 @@ class filedialog(object):
     # https://github.com/python/cpython/blob/3.6/Lib/tkinter/filedialog.py
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def askopenfilename(**options):
         "Ask for a filename to open."
-        return Open(**options).show()
+        return _tk_filedialog().Open(**options).show()
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def asksaveasfilename(**options):
         "Ask for a filename to save as."
-        return SaveAs(**options).show()
+        return _tk_filedialog().SaveAs(**options).show()
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def askopenfilenames(**options):
         """Ask for multiple filenames to open.
         Returns a list of filenames or empty list if
         cancel button selected
         """
         options["multiple"] = 1
-        return Open(**options).show()
+        return _tk_filedialog().Open(**options).show()
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def askopenfile(mode="r", **options):
         "Ask for a filename to open, and returned the opened file"
 
-        filename = Open(**options).show()
+        filename = _tk_filedialog().Open(**options).show()
         if filename:
             return open(filename, mode)
         return None
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def askopenfiles(mode="r", **options):
         """Ask for multiple filenames and return the open file
         objects
@@ -112,34 +129,40 @@ class filedialog(object):
         return files
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def asksaveasfile(mode="w", **options):
         "Ask for a filename to save as, and returned the opened file"
 
-        filename = SaveAs(**options).show()
+        filename = _tk_filedialog().SaveAs(**options).show()
         if filename:
             return open(filename, mode)
         return None
 
     @staticmethod
-    @conditional_kwargs(parent=root_topmost(), initialdir=here)
+    @conditional_kwargs(parent=root_topmost, initialdir=os.getcwd)
     def askdirectory(**options):
         "Ask for a directory, and return the file name"
-        return Directory(**options).show()
+        return _tk_filedialog().Directory(**options).show()
 
 
 
 class DataLoader(object):
     """Multi-purpose dataloading tools.
+
+    Delimited files are cached on disk after their first parse (see
+    omin.utils.io_tools.TableCache) so reloading the same file skips the
+    parser. Pass cache=False to always parse the file, cache_dir to use a
+    cache shared between users.
     """
 
-    def __init__(self, filepath_or_buffer=None, *args, **kwargs):
+    def __init__(self, filepath_or_buffer=None, *args, cache=True, cache_dir=None, **kwargs):
         self.file_name = None
         self.raw = None
         self.filepath_or_buffer = filepath_or_buffer
         self.file_name = ''
         self.file_path = ''
         self.file_ext = ''
+        self.cache_hit = False
 
         # Sort out the parameters.
         read_table_params = inspect.signature(pd.read_table)
@@ -219,13 +242,27 @@ class DataLoader(object):
                 print(e.args[0])
 
         else:
-            try:
-                # This should work with everything else.
-                self.raw = pd.read_table(self.filepath_or_buffer,
-                                         **read_table_params_final)
-
-            except ValueError as e:
-                print(e.args[0])
+            cache_key = None
+            # Only files on disk can be hashed for the cache.
+            if cache and TableCache.available() and os.path.isfile(self.file_path):
+                try:
+                    cache_key = TableCache.cache_key(self.file_path, read_table_params_final)
+                    self.raw = TableCache.load(cache_key, cache_dir=cache_dir)
+                    self.cache_hit = self.raw is not None
+                except Exception as err:
+                    print("Could not use the table cache:", err)
+
+            if self.raw is None:
+                try:
+                    # This should work with everything else.
+                    self.raw = pd.read_table(self.filepath_or_buffer,
+                                             **read_table_params_final)
+
+                except ValueError as e:
+                    print(e.args[0])
+
+                if cache_key is not None and self.raw is not None:
+                    TableCache.dump(cache_key, self.raw, cache_dir=cache_dir)
 
         if isinstance(self.filepath_or_buffer, _io.TextIOWrapper):
             self.filepath_or_buffer.close()
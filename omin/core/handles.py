@@ -27,6 +27,7 @@ from .pandomics import pandas as pd
 # ----------------
 from .base import repr_dec
 from .containers import PeptideGroups, Proteins, Occupancy, Normalized
+from .keys import KeyDictionary
 
 from ..databases import mitocarta
 
@@ -118,6 +119,9 @@ class Process(Project):
     # microprotip: Exceptions are the rule here.
     # PROTIP: TRY NOT TO SET VARS AT THIS LEVEL.
 
+    # Rebuilt on demand, see key_dictionary.
+    _transient_attributes = ("_key_dictionary", "_mitocarta_codes")
+
     def __init__(self, *args, **kwargs):
         """Initalize Process class.
         """
@@ -160,12 +164,82 @@ class Process(Project):
 
         self.proteins._gene_name_extractor()
 
+    @property
+    def key_dictionary(self):
+        """The KeyDictionary the peptide groups, proteins and MitoCarta are joined with.
+
+        The Entrez Gene IDs of MitoCarta are coded once, on first use, the
+        keys of the containers by key_codes.
+        """
+        dictionary = self.__dict__.get("_key_dictionary", None)
+        if dictionary is None:
+            dictionary = KeyDictionary()
+            self._mitocarta_codes = dictionary.encode("EntrezGeneID", mitocarta.MitoCartaTwo.essential.EntrezGeneID.astype(str).values)
+            self._key_dictionary = dictionary
+        return dictionary
+
+    @property
+    def mitocarta_codes(self):
+        """The EntrezGeneID codes of the rows of MitoCartaTwo.essential."""
+        self.key_dictionary
+        return self._mitocarta_codes
+
+    def key_codes(self, container, frame, name):
+        """Return the int32 codes of the name column of a container's frame.
+
+        The codes are encoded once and stored on the container, see
+        set_key_codes. Stored codes are used as long as they were made with
+        this key_dictionary and still have a code per row.
+
+        Parameters
+        ----------
+        container: ProteomeDiscovererRaw
+
+        frame: str
+            The attribute of container, e.g. "master_index" or "raw".
+
+        name: str
+            "Accession" or "EntrezGeneID".
+        """
+        values = getattr(container, frame)[name]
+        stored = self._stored_key_codes(container)
+        codes = stored.get((frame, name), None)
+        if codes is None or len(codes) != len(values):
+            # Entrez Gene IDs are read as numbers or strings, MitoCarta is coded as strings.
+            values = values.astype(str) if name == "EntrezGeneID" else values
+            codes = stored[(frame, name)] = self.key_dictionary.encode(name, values.values)
+        return codes
+
+    def set_key_codes(self, container, frame, name, codes):
+        """Store the codes of a frame that was just built from already coded rows."""
+        self._stored_key_codes(container)[(frame, name)] = codes
+
+    def _stored_key_codes(self, container):
+        """Return the codes stored on container, dropping those of another key_dictionary."""
+        stored = container.__dict__.get("_key_codes", None)
+        if stored is None or stored["dictionary"] is not self.key_dictionary:
+            stored = container._key_codes = dict(dictionary=self.key_dictionary)
+        return stored
+
+    def _merge_on_codes(self, left, left_codes, right, right_codes, on):
+        """Return the left merge of left and right on their codes and the codes of the result."""
+        result = self.key_dictionary.merge(left, right, on, left_codes=left_codes, right_codes=right_codes)
+        if len(result) != len(left):
+            # pandas.merge repeated the rows of duplicated right keys.
+            return result, self.key_dictionary.encode(on, result[on].values)
+        return result, left_codes
+
     def _peptide_groups_master_index_update(self):
         """Merge the proteins.master_index with the peptide_groups.master_index.
         """
         try:
-            updated_master_index = self.peptide_groups.master_index.merge(self.proteins.master_index, on="Accession", how="left")
+            updated_master_index, codes = self._merge_on_codes(self.peptide_groups.master_index,
+                                                               self.key_codes(self.peptide_groups, "master_index", "Accession"),
+                                                               self.proteins.master_index,
+                                                               self.key_codes(self.proteins, "master_index", "Accession"),
+                                                               "Accession")
             self.peptide_groups.master_index = updated_master_index
+            self.set_key_codes(self.peptide_groups, "master_index", "Accession", codes)
 
         except Exception as err:
             if verbose:
@@ -195,7 +269,11 @@ class Process(Project):
         # Retrieve the accession from the old_master_index.
         old_master_index = old_master_index.filter(regex="Accession")
         # Merge the old_master_index with the "new" master_index
-        result = old_master_index.merge(self.proteins.master_index, how="left", on="Accession")
+        result, codes = self._merge_on_codes(old_master_index,
+                                             self.key_codes(self.proteins, "_old_master_index", "Accession"),
+                                             self.proteins.master_index,
+                                             self.key_codes(self.proteins, "master_index", "Accession"),
+                                             "Accession")
         # Set the index.
         result.index = self.proteins._old_master_index.index
         # Fill the missing values in the Mitocarta columns with False.
@@ -204,28 +282,33 @@ class Process(Project):
         result["Matrix"].fillna(False, inplace=True)
         result["IMS"].fillna(False, inplace=True)
         self.proteins.master_index = result
+        self.set_key_codes(self.proteins, "master_index", "Accession", codes)
 
 
     def _reset_peptide_groups_master_index(self):
         """Work-around that fill missing descriptions in the peptide groups master index.
         """
-        ind = self.proteins.raw.copy()[["Accession", "EntrezGeneID", "Description"]]
-
-        ind.EntrezGeneID = ind.EntrezGeneID.astype(str)
-
-        mito = mitocarta.MitoCartaTwo.essential.copy()
+        ind = self.proteins.raw[["Accession", "EntrezGeneID", "Description"]]
 
-        mito.EntrezGeneID = mito.EntrezGeneID.astype(str)
+        mito = mitocarta.MitoCartaTwo.essential
 
-        ind = ind.merge(mito, on="EntrezGeneID", how="left")
+        ind, _ = self._merge_on_codes(ind, self.key_codes(self.proteins, "raw", "EntrezGeneID"),
+                                      mito, self.mitocarta_codes, "EntrezGeneID")
+        # The Accession codes of raw still line up unless MitoCarta repeated rows.
+        if len(ind) == len(self.proteins.raw):
+            ind_codes = self.key_codes(self.proteins, "raw", "Accession")
+        else:
+            ind_codes = self.key_dictionary.encode("Accession", ind.Accession.values)
 
-        trun = self.peptide_groups.master_index.copy().iloc[:, :5]
+        trun = self.peptide_groups.master_index.iloc[:, :5]
 
-        result = trun.merge(ind, on="Accession", how="left")
+        result, codes = self._merge_on_codes(trun, self.key_codes(self.peptide_groups, "master_index", "Accession"),
+                                             ind, ind_codes, "Accession")
 
         result[["MitoCarta2_List", "Matrix", "IMS"]] = result[["MitoCarta2_List", "Matrix", "IMS"]].fillna(False)
 
         self.peptide_groups.master_index = result
+        self.set_key_codes(self.peptide_groups, "master_index", "Accession", codes)
 
 
     def _peptide_groups_entrez_gene_clean_up(self):
@@ -245,12 +328,12 @@ class Process(Project):
         but the index corresponds to the proteins.
         """
 
-        link_to_peptides = self.peptide_groups.master_index.merge(self.proteins.master_index,
-                                                                  on="Accession",
-                                                                  how="left",
-                                                                  left_index=True,
-                                                                  validate="m:1")
-        link_to_peptides = link_to_peptides.Accession
+        peptides_master_index = self.peptide_groups.master_index
+        # The proteins index label of every peptide, a proteins accession must be unique.
+        proteins_index = self.key_dictionary.index_of(peptides_master_index, self.proteins.master_index, "Accession",
+                                                      left_codes=self.key_codes(self.peptide_groups, "master_index", "Accession"),
+                                                      right_codes=self.key_codes(self.proteins, "master_index", "Accession"))
+        link_to_peptides = pd.Series(peptides_master_index.Accession.values, index=pd.Index(proteins_index), name="Accession")
         self.proteins.link_to_peptides = link_to_peptides
 
 
@@ -267,17 +350,26 @@ class Process(Project):
             # isolate the input fractions study factors.
             inps = self.proteins.study_factor_table.loc[input_mask]
             inps = [inps.loc[inps._Fn.str.contains(i)] for i in inps._Fn.unique()]
-            normalized = dict()
+
+            proteins_cube = self.proteins.abundance_cube
+            peptides_cube = self.peptide_groups.abundance_cube
+            # The peptide groups fraction that normalizes each proteins fraction.
+            link = np.zeros(len(proteins_cube.fractions), dtype=np.int64)
+            names = dict()
             for inp in inps:
                 if len(inp._Fn.unique()) == 1:
                     inp_fn = inp._Fn.unique()[0]
                     inp_tag = self.proteins.fraction_tag(inp_fn)
 
-                    if inp_tag in self.peptide_groups.load_normalized.__dict__:
-                        inp_pr_linked = self.proteins.Abundance[self.proteins.Abundance.columns[inp.index]]
-                        inp_pg_linked = self.peptide_groups.Abundance[self.peptide_groups.Abundance.columns[inp.index]]
-                        load_norm = inp_pr_linked.normalize_to(inp_pg_linked)
-                        normalized[inp_tag] = load_norm
+                    if inp_tag in self.peptide_groups.load_normalized.__dict__ and inp_fn in peptides_cube.fractions:
+                        link[proteins_cube.position(inp_fn)] = peptides_cube.position(inp_fn)
+                        names[inp_fn] = inp_tag
+
+            normalized = dict()
+            if len(names) > 0:
+                values = proteins_cube.normalize(self.peptide_groups.normalization_method,
+                                                 reference=peptides_cube, link=link)
+                normalized = proteins_cube.frames(values, names=names, reference=peptides_cube, link=link)
             self.proteins.load_normalized = Normalized(**normalized)
 
 
@@ -305,7 +397,9 @@ class Process(Project):
         For some unknown reason false hits are generated from merging the
         peptides and proteins data.
         """
-        accessions_in_proteins = self.peptide_groups.master_index.Accession.isin(self.proteins.master_index.Accession)
+        accessions_in_proteins = self.key_dictionary.isin("Accession", None, None,
+                                                          left_codes=self.key_codes(self.peptide_groups, "master_index", "Accession"),
+                                                          right_codes=self.key_codes(self.proteins, "master_index", "Accession"))
 
         for k,v in self.peptide_groups.load_normalized_related_proteins.__dict__.items():
             related_proteins_filtered = v.loc[accessions_in_proteins]
@@ -343,7 +437,8 @@ class Process(Project):
         for mod in self.peptide_groups._in_vivo_modifications:
             # Filter for given in vivo modification.
             try:
-                result = self.peptide_groups.master_index.filter_rows(on="Modifications", term=mod)
+                master_index = self.peptide_groups.master_index
+                result = master_index.loc[self.peptide_groups._modification_mask_for(master_index, mod)]
 
                 self.peptide_groups.metadata[mod.lower() + "_mitocarta_total_hits"] = result.MitoCarta2_List.sum()
                 self.peptide_groups.metadata[mod.lower() + "_mitocarta_matrix"] = result.Matrix.sum()
@@ -427,6 +522,39 @@ class Process(Project):
         # FIXME: Consider adding more kwargs like fraction_key for fine tuning.
         result=None
 
+        abun, log2load = self._comparison_source(on=on, where=where, fraction_key=fraction_key, mask=mask)
+
+        ## Create the comparison.
+        ## FIXME: Add kwargs switch for right ect.
+        comp = log2load.fold_change_with_ttest(right=right,
+                                               numerator=numerator,
+                                               denominator=denominator,
+                                               filter_out_numerator=filter_out_numerator,
+                                               filter_out_denominator=filter_out_denominator)
+
+        ## Take the -log10(p-value)
+        comp["negative_log10_pvalue"] = -np.log10(comp.pvalue)
+
+        #truncated_index = self.__getattribute__(on).master_index
+
+        ## Grab the related annotations.
+        truncated_index = self.__getattribute__(on).master_index.loc[comp.index]
+
+        ## Package for export.
+        if where == "load_normalized":
+            result = pd.concat([truncated_index, abun, log2load, comp], axis=1)
+
+        if where == "relative_occupancy":
+            result = pd.concat([truncated_index, log2load, comp], axis=1)
+
+        return result
+
+    def _comparison_source(self, on=None, where=None, fraction_key=None, mask=None):
+        """Return the abundances and their Log2 normalized values for a comparison.
+
+        Rows with only missing values are dropped. Relative occupancies are
+        already Log2 normalized and are returned as both.
+        """
         if mask is not None:
             # Isolate just the masked peptides.
             try:
@@ -449,27 +577,91 @@ class Process(Project):
         else:
             log2load = abun.log2_normalize(prepend_cols="Log2 Normalized: ")
 
-        ## Create the comparison.
-        ## FIXME: Add kwargs switch for right ect.
-        comp = log2load.fold_change_with_ttest(right=right,
-                                               numerator=numerator,
-                                               denominator=denominator,
-                                               filter_out_numerator=filter_out_numerator,
-                                               filter_out_denominator=filter_out_denominator)
+        return abun, log2load
 
-        ## Take the -log10(p-value)
-        comp["negative_log10_pvalue"] = -np.log10(comp.pvalue)
+    def site_std_out(self, selected_mod, comparisons, how="sum", n_jobs=None, executor=None):
+        """Return the site level std_out of the peptide groups with protein metadata.
 
-        #truncated_index = self.__getattribute__(on).master_index
+        See PeptideGroups.site_std_out for the parameters. The metadata of
+        proteins.master_index (Gene Name, EntrezGeneID ect.) is added to the
+        Metadata columns of every site by accession.
+        """
+        result = self.peptide_groups.site_std_out(selected_mod, comparisons, how=how, n_jobs=n_jobs, executor=executor)
 
-        ## Grab the related annotations.
-        truncated_index = self.__getattribute__(on).master_index.loc[comp.index]
+        proteins_metadata = self.proteins.master_index.drop_duplicates("Accession").set_index("Accession")
+        proteins_metadata = proteins_metadata.reindex(result.index.get_level_values("Accession"))
+        proteins_metadata.index = result.index
+        proteins_metadata = pd.set_super_columns([proteins_metadata], ["Metadata"])
 
-        ## Package for export.
-        if where == "load_normalized":
-            result = pd.concat([truncated_index, abun, log2load, comp], axis=1)
+        metadata = result.columns.get_level_values(0) == "Metadata"
+        return pd.concat([result.loc[:, metadata], proteins_metadata, result.loc[:, ~metadata]], axis=1)
 
-        if where == "relative_occupancy":
-            result = pd.concat([truncated_index, log2load, comp], axis=1)
+    def comparisions(self, specs, mask=None, filter_out_numerator=False, filter_out_denominator=False,
+                     fdr_alpha=None, fdr_method="fdr_bh", annotate=False):
+        """Creates one long format comparision dataframe for many comparisions.
 
-        return result
+        Specs that share the same source frame (on, where, fraction_key) are
+        Log2 normalized once and tested together, see
+        pandas.DataFrame.fold_change_with_ttest_batch. The statistics match
+        those of calling comparision once per spec.
+
+        Parameters
+        ----------
+        specs: list
+            In the format: [(on, where, fraction_key, numerator, denominator),...]
+            Dicts with those keys are also accepted.
+
+        mask: pd.Index
+            Uses this index to select for in every source frame.
+
+        filter_out_numerator: bool
+            Defaults to False.
+
+        filter_out_denominator: bool
+            Defaults to False.
+
+        annotate: bool
+            If True the master_index annotations are added to every row.
+            Defaults to False.
+
+        Returns
+        ------
+        result: pd.DataFrame
+            One row per comparision and peptide or protein, indexed like the
+            source frames, with the columns: on, where, fraction_key,
+            numerator, denominator, Log2FC, pvalue, p_adjusted and
+            negative_log10_pvalue.
+        """
+        spec_columns = ["on", "where", "fraction_key", "numerator", "denominator"]
+
+        specs = [tuple(i[k] for k in spec_columns) if isinstance(i, dict) else tuple(i) for i in specs]
+
+        # Group the specs by source frame keeping their order.
+        grouped = dict()
+        for position, spec in enumerate(specs):
+            grouped.setdefault(spec[:3], []).append((position, spec))
+
+        results = [None] * len(specs)
+        for (on, where, fraction_key), members in grouped.items():
+            _, log2load = self._comparison_source(on=on, where=where, fraction_key=fraction_key, mask=mask)
+
+            comps = log2load.fold_change_with_ttest_batch([spec[3:] for _, spec in members],
+                                                          filter_out_numerator=filter_out_numerator,
+                                                          filter_out_denominator=filter_out_denominator,
+                                                          fdr_alpha=fdr_alpha,
+                                                          fdr_method=fdr_method)
+
+            for (position, spec), comp in zip(members, comps):
+                ## Take the -log10(p-value)
+                comp["negative_log10_pvalue"] = -np.log10(comp.pvalue)
+
+                if annotate:
+                    comp = pd.concat([self.__getattribute__(on).master_index.loc[comp.index], comp], axis=1)
+
+                labels = pd.DataFrame([spec] * comp.shape[0], index=comp.index, columns=spec_columns)
+                results[position] = pd.concat([labels, comp], axis=1)
+
+        if len(results) == 0:
+            return pd.DataFrame(columns=spec_columns + ["Log2FC", "pvalue", "p_adjusted", "negative_log10_pvalue"])
+
+        return pd.concat(results, axis=0, sort=False)
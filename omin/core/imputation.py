@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.imputation
+--------------------
+
+Provides Imputation, a registry of missing value imputations that work on a
+whole rows x samples matrix at once.
+
+Available methods:
+    min_prob
+        A left-censored normal draw: missing values are drawn below the
+        detection limit of their sample.
+    knn
+        The mean of the k nearest rows that have the value. The distances
+        are computed chunk by chunk, so memory stays bounded for 100k+ rows.
+    group_mean
+        The mean of the row within the same group of samples e.g. KO or WT.
+
+Methods work on Log2 values by default and the result is returned on the
+scale of the input. New methods are added with Imputation.register.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from .pandomics import pandas as pd
+
+
+class Imputation(object):
+    """Missing value imputation of rows x samples matrices."""
+
+    # In the format: name -> function(values, groups, **kwargs) -> values.
+    methods = OrderedDict()
+
+    @classmethod
+    def register(cls, name):
+        """Decorator that adds a function to methods.
+
+        The function is called with a float array where NaNs are missing, the
+        group code of every column (-1 for columns in no group) and the
+        keyword arguments given to impute. It must return an array of the
+        same shape.
+        """
+        def decorator(function):
+            cls.methods[name] = function
+            return function
+        return decorator
+
+    @staticmethod
+    def group_codes(columns, groups=None):
+        """Return the group code of every column.
+
+        Parameters
+        ----------
+        columns : list-like
+
+        groups : list
+            Terms found in the column names, e.g. ["KO", "WT"], in the same
+            way as the numerator and denominator of a comparison. A column
+            belongs to the first term it contains, -1 if none.
+        """
+        codes = np.full(len(columns), -1, dtype=np.int64)
+        for n, term in reversed(list(enumerate(groups or []))):
+            codes[np.array([term in str(i) for i in columns], dtype=bool)] = n
+        return codes
+
+    @classmethod
+    def impute(cls, dataframe, method="min_prob", groups=None, log=True, **kwargs):
+        """Return dataframe with its missing values imputed.
+
+        Parameters
+        ----------
+        dataframe : DataFrame
+
+        method : str
+            One of methods.
+
+        groups : list
+            See group_codes.
+
+        log : bool
+            Impute the Log2 of the values. Values that are not positive are
+            treated as missing.
+
+        kwargs
+            Passed on to the method.
+        """
+        if method not in cls.methods:
+            raise ValueError("method must be one of: {}".format(", ".join(cls.methods)))
+
+        values = dataframe.values.astype(np.float64)
+        if log:
+            with np.errstate(all="ignore"):
+                values = np.log2(np.where(values > 0, values, np.nan))
+
+        present = ~np.isnan(values)
+        codes = cls.group_codes(dataframe.columns, groups)
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            result = cls.methods[method](values, codes, **kwargs)
+
+        if log:
+            result = np.exp2(result)
+        # Present values are never changed.
+        result = np.where(present, dataframe.values, result)
+        return pd.DataFrame(result, index=dataframe.index, columns=dataframe.columns)
+
+
+@Imputation.register("min_prob")
+def min_prob(values, groups, downshift=1.8, width=.3, random_state=None):
+    """Draw missing values from a normal shifted below each sample.
+
+    Every sample's draws have a mean downshift standard deviations below
+    the sample's mean and a standard deviation of width times the sample's.
+    """
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    rng = np.random.RandomState(random_state)
+    draws = rng.standard_normal(values.shape) * (std * width) + (mean - downshift * std)
+    return np.where(np.isnan(values), draws, values)
+
+
+@Imputation.register("group_mean")
+def group_mean(values, groups):
+    """Fill missing values with the row's mean in the same group of samples.
+
+    Columns in no group are filled with the row's mean over those columns.
+    A value stays missing if its group has no values in the row.
+    """
+    if values.shape[1] == 0:
+        return values
+    present = ~np.isnan(values)
+    # One hot (columns, groups), columns in no group get a group of their own.
+    codes = np.where(groups < 0, groups.max() + 1, groups)
+    one_hot = np.zeros((len(codes), codes.max() + 1))
+    one_hot[np.arange(len(codes)), codes] = 1.
+
+    sums = np.where(present, values, 0.).dot(one_hot)
+    counts = present.astype(np.float64).dot(one_hot)
+    means = np.where(counts > 0, sums / counts, np.nan)
+    return np.where(present, values, means[:, codes])
+
+
+@Imputation.register("knn")
+def knn(values, groups, k=5, chunk_size=None, max_bytes=2 ** 27, max_donors=None, random_state=None):
+    """Fill missing values with the mean of the k nearest rows that have them.
+
+    Distances are Euclidean over the samples both rows have, scaled up to all
+    samples (like sklearn's nan_euclidean_distances). Values with no donor
+    row are filled with the sample mean.
+
+    Parameters
+    ----------
+    k : int
+
+    chunk_size : int
+        Rows whose distances are computed at once. Defaults to what fits in
+        max_bytes.
+
+    max_bytes : int
+        Memory for the distances of a chunk, 128 MB by default.
+
+    max_donors : int
+        Search at most this many rows, drawn at random, for neighbours.
+        Bounds the time for very large tables. Defaults to every row.
+
+    random_state : int
+        Seed of the max_donors draw.
+    """
+    present = ~np.isnan(values)
+    rows, samples = values.shape
+    targets = np.flatnonzero(~present.all(axis=1))
+    if len(targets) == 0 or rows == 0 or k < 1:
+        return values
+
+    donors = np.arange(rows)
+    if max_donors is not None and max_donors < rows:
+        donors = np.sort(np.random.RandomState(random_state).choice(rows, max_donors, replace=False))
+
+    # The squared distance of a to b is a^2.w_b + w_a.b^2 - 2a.b over the
+    # samples both have (w = 1 if present), so it is one product per chunk.
+    filled = np.where(present, values, 0.)
+    weights = present.astype(np.float64)
+    right = np.hstack([weights, filled ** 2, -2 * filled])[donors].T.copy()
+    left = np.hstack([filled ** 2, weights, filled])
+    donor_values = values[donors]
+    donor_present = present[donors]
+
+    result = values.copy()
+    column_mean = np.nanmean(values, axis=0)
+    # Neighbours kept per row, enough to find k donors for most samples.
+    width = min(len(donors), 4 * k + 4)
+
+    chunk_size = chunk_size or max(1, int(max_bytes // (8 * 3 * len(donors))))
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start + chunk_size]
+        common = weights[chunk].dot(right[:samples])
+        distance = left[chunk].dot(right)
+        np.maximum(distance, 0, out=distance)
+        distance *= samples
+        with np.errstate(all="ignore"):
+            distance /= common
+        distance[common == 0] = np.inf
+        # A row is never its own donor.
+        own = np.searchsorted(donors, chunk)
+        own_row = (own < len(donors)) & (donors[np.minimum(own, len(donors) - 1)] == chunk)
+        distance[np.flatnonzero(own_row), own[own_row]] = np.inf
+
+        # The nearest width donors of every row, in order.
+        nearest = np.argpartition(distance, width - 1, axis=1)[:, :width]
+        nearest_distance = np.take_along_axis(distance, nearest, axis=1)
+        order = np.argsort(nearest_distance, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distance = np.take_along_axis(nearest_distance, order, axis=1)
+        # Beyond the last kept neighbour there may be more donors.
+        exhausted = ~np.isfinite(nearest_distance[:, -1]) | (width == len(donors))
+
+        for column in np.flatnonzero(~present[chunk].all(axis=0)):
+            missing = np.flatnonzero(~present[chunk, column])
+            usable = donor_present[nearest[missing], column] & np.isfinite(nearest_distance[missing])
+            usable &= np.cumsum(usable, axis=1) <= k
+            found = usable.sum(axis=1)
+            with np.errstate(all="ignore"):
+                fill = np.where(usable, donor_values[nearest[missing], column], 0.).sum(axis=1) / found
+
+            # Rows with fewer than k donors among their nearest search every donor.
+            short = np.flatnonzero((found < k) & ~exhausted[missing])
+            if len(short) > 0:
+                candidates = np.where(donor_present[:, column][None, :], distance[missing[short]], np.inf)
+                n = min(k, len(donors))
+                full = np.argpartition(candidates, n - 1, axis=1)[:, :n]
+                valid = np.isfinite(np.take_along_axis(candidates, full, axis=1))
+                found[short] = valid.sum(axis=1)
+                with np.errstate(all="ignore"):
+                    fill[short] = np.where(valid, donor_values[full, column], 0.).sum(axis=1) / found[short]
+
+            result[chunk[missing], column] = np.where(found > 0, fill, column_mean[column])
+
+    return result
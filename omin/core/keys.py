@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.keys
+--------------
+
+Provides KeyDictionary, integer codes for the string keys (Accession,
+EntrezGeneID) that the peptide groups, proteins and annotation tables are
+joined on.
+
+The keys of every table are coded against one shared vocabulary, so a join
+is a lookup table from codes to row positions followed by a take, rather
+than a hash join of object strings that builds a merged frame.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import numpy as np
+
+from .pandomics import pandas as pd
+
+
+class KeyDictionary(object):
+    """Shared int32 codes of join keys.
+
+    Parameters
+    ----------
+    **keys
+        In the format: key name -> values seen at load, e.g.
+        Accession=proteins.raw.Accession.
+
+    Attributes
+    ----------
+    vocabularies : dict
+        In the format: key name -> pandas.Index of the known values. The
+        position of a value is its code. NaN is a value like any other, the
+        same as pandas.merge matches NaN keys.
+    """
+
+    def __init__(self, **keys):
+        self.vocabularies = dict()
+        for name, values in keys.items():
+            self.encode(name, values)
+
+    def encode(self, name, values):
+        """Return the int32 codes of values, adding unknown values to the vocabulary."""
+        values = np.asarray(values, dtype=object)
+        vocabulary = self.vocabularies.get(name, pd.Index([], dtype=object))
+        codes = vocabulary.get_indexer(values) if len(vocabulary) > 0 else np.full(len(values), -1)
+
+        unknown = codes < 0
+        if unknown.any():
+            # factorize codes None, NaN and NaT as -1, they are one missing key like in pandas.merge.
+            new_codes, new_values = pd.factorize(values[unknown])
+            new_values = list(new_values)
+            if (new_codes < 0).any():
+                missing = vocabulary.get_indexer([np.nan])[0] if len(vocabulary) > 0 else -1
+                if missing < 0:
+                    missing = len(vocabulary) + len(new_values)
+                    new_values.append(np.nan)
+                new_codes = np.where(new_codes < 0, missing - len(vocabulary), new_codes)
+            codes[unknown] = new_codes + len(vocabulary)
+            if len(new_values) > 0:
+                vocabulary = vocabulary.append(pd.Index(new_values, dtype=object))
+                self.vocabularies[name] = vocabulary
+        return codes.astype(np.int32)
+
+    def positions(self, name, left, right, left_codes=None, right_codes=None):
+        """Return the row of right for every row of left, -1 where there is none.
+
+        Parameters
+        ----------
+        name : str
+
+        left, right : array-like
+            Key values, the values of right must be unique.
+
+        left_codes, right_codes : numpy.ndarray
+            The codes of left and right if they were already encoded, e.g.
+            code columns stored when a table was built. The values are then
+            not encoded again.
+
+        Raises
+        ------
+        ValueError
+            If right has duplicated keys.
+        """
+        left_codes = self.encode(name, left) if left_codes is None else left_codes
+        right_codes = self.encode(name, right) if right_codes is None else right_codes
+        table = np.full(len(self.vocabularies[name]), -1, dtype=np.int64)
+        table[right_codes] = np.arange(len(right_codes))
+        if (table >= 0).sum() != len(right_codes):
+            raise ValueError("The {} keys of the right table are not unique.".format(name))
+        return table[left_codes]
+
+    def isin(self, name, left, right, left_codes=None, right_codes=None):
+        """Return a boolean array of the values of left that are in right."""
+        left_codes = self.encode(name, left) if left_codes is None else left_codes
+        right_codes = self.encode(name, right) if right_codes is None else right_codes
+        found = np.zeros(len(self.vocabularies[name]), dtype=bool)
+        found[right_codes] = True
+        return found[left_codes]
+
+    def merge(self, left, right, on, suffixes=("_x", "_y"), left_codes=None, right_codes=None):
+        """Return left.merge(right, on=on, how="left") as a take on codes.
+
+        Falls back to pandas.merge if right has duplicated keys.
+        """
+        try:
+            positions = self.positions(on, left[on].values, right[on].values,
+                                       left_codes=left_codes, right_codes=right_codes)
+        except ValueError:
+            return left.merge(right, on=on, how="left", suffixes=suffixes)
+
+        # Shallow copies, the columns of left are not copied.
+        left = left.copy(deep=False)
+        left.index = pd.RangeIndex(len(left))
+        right = right.drop(on, axis=1)
+        overlap = set(left.columns) & set(right.columns)
+        left.columns = [i + suffixes[0] if i in overlap else i for i in left.columns]
+        right.columns = [i + suffixes[1] if i in overlap else i for i in right.columns]
+
+        # Rows without a match read a missing label, i.e. NaN like pandas.merge.
+        right.index = pd.RangeIndex(len(right))
+        taken = right.reindex(positions)
+        for i in taken.columns:
+            left[i] = taken[i].values
+        return left
+
+    def index_of(self, left, right, on, left_codes=None, right_codes=None):
+        """Return the index label of the row of right for every row of left.
+
+        NaN where left has no match.
+        """
+        positions = self.positions(on, left[on].values, right[on].values,
+                                   left_codes=left_codes, right_codes=right_codes)
+        return pd.Series(right.index).reindex(positions).values
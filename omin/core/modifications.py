@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.modifications
+-----------------------
+
+Provides ModificationIndex, a parsed form of Proteome Discoverer's free text
+Modifications column e.g. "1xTMT6plex [N-Term]; 1xAcetyl [K18(92.7)]".
+
+The column is parsed once into a sparse peptide x modification type matrix
+and a table of modified sites, so selecting peptides by modification is a
+column lookup instead of a regex over every row.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import re
+
+import numpy as np
+from scipy import sparse
+
+from .pandomics import pandas as pd
+
+
+class ModificationIndex(object):
+    """Parsed modifications of a peptide table.
+
+    Parameters
+    ----------
+    modifications : pandas.Series
+        The Modifications column, NaNs are read as no modifications.
+
+    Attributes
+    ----------
+    index : pandas.Index
+        The index of modifications.
+
+    types : list
+        The modification types in the order they are first found.
+
+    incidence : scipy.sparse.csr_matrix
+        Peptides x types, the number of times each type is on a peptide.
+
+    sites : pandas.DataFrame
+        One row per modified site with the columns: peptide (row position),
+        modification, residue, position (in the peptide, -1 if unknown) and
+        probability (NaN if not given).
+    """
+
+    # Same type names as the "x(\w+)\s" used before, plus the site list.
+    modification_rx = re.compile(r"(\d*)x(\w+)\s(?:\[([^\]]*)\])?")
+    site_rx = re.compile(r"(N-Term|C-Term|[A-Z])(\d*)(?:\(([\d.]+)\))?")
+
+    def __init__(self, modifications):
+        modifications = pd.Series(modifications)
+        self.index = modifications.index
+        values = modifications.where(modifications.notnull(), "").astype(str).values
+
+        # Identical strings are parsed once.
+        codes, uniques = pd.factorize(values)
+        unique_incidence, unique_sites = self._parse(uniques)
+
+        self.incidence = unique_incidence[codes] if len(codes) > 0 else unique_incidence
+        self.sites = self._expand_sites(codes, len(uniques), *unique_sites)
+
+    def _parse(self, uniques):
+        """Return the incidence matrix and site arrays of the unique strings."""
+        type_codes = dict()
+        rows, cols, counts = [], [], []
+        site_rows, site_types, residues, positions, probabilities = [], [], [], [], []
+
+        for n, text in enumerate(uniques):
+            for count, name, site_list in self.modification_rx.findall(text):
+                code = type_codes.setdefault(name, len(type_codes))
+                rows.append(n)
+                cols.append(code)
+                counts.append(int(count) if count else 1)
+                for residue, position, probability in self.site_rx.findall(site_list):
+                    site_rows.append(n)
+                    site_types.append(code)
+                    residues.append(residue)
+                    positions.append(int(position) if position else -1)
+                    probabilities.append(float(probability) if probability else np.nan)
+
+        self.types = list(type_codes.keys())
+        incidence = sparse.coo_matrix((np.array(counts, dtype=np.int32), (rows, cols)),
+                                      shape=(len(uniques), len(self.types))).tocsr()
+        sites = (np.array(site_rows, dtype=np.int64), np.array(site_types, dtype=np.int64),
+                 np.array(residues, dtype=object), np.array(positions, dtype=np.int64),
+                 np.array(probabilities, dtype=np.float64))
+        return incidence, sites
+
+    def _expand_sites(self, codes, n_uniques, site_rows, site_types, residues, positions, probabilities):
+        """Return the site table of every peptide from the sites of the unique strings."""
+        # Sites are already grouped by unique string, starts[u] is the first site of u.
+        per_unique = np.bincount(site_rows, minlength=n_uniques)
+        starts = np.concatenate([[0], np.cumsum(per_unique)[:-1]]).astype(np.int64)
+
+        per_peptide = per_unique[codes] if len(codes) > 0 else np.zeros(0, dtype=np.int64)
+        peptide = np.repeat(np.arange(len(codes)), per_peptide)
+        offset = np.arange(len(peptide)) - np.repeat(np.cumsum(per_peptide) - per_peptide, per_peptide)
+        take = starts[codes[peptide]] + offset if len(peptide) > 0 else np.zeros(0, dtype=np.int64)
+
+        return pd.DataFrame({"peptide": peptide,
+                             "modification": pd.Categorical.from_codes(site_types[take], categories=self.types),
+                             "residue": residues[take],
+                             "position": positions[take],
+                             "probability": probabilities[take]})
+
+    def __len__(self):
+        return len(self.index)
+
+    def type_positions(self, modification, regex=True):
+        """Return the columns of incidence for a modification.
+
+        Parameters
+        ----------
+        modification : str
+            A modification type e.g. "Acetyl". If regex is True every type
+            that the pattern is found in is included.
+
+        regex : bool
+        """
+        if regex:
+            rx = re.compile(modification)
+            return [n for n, i in enumerate(self.types) if rx.search(i)]
+        return [n for n, i in enumerate(self.types) if i == modification]
+
+    def mask(self, modification, regex=True):
+        """Return a boolean Series of the peptides with a modification.
+
+        See type_positions for the parameters.
+        """
+        positions = self.type_positions(modification, regex=regex)
+        result = np.zeros(len(self), dtype=bool)
+        if len(positions) > 0:
+            result = self.incidence[:, positions].getnnz(axis=1) > 0
+        return pd.Series(result, index=self.index)
+
+    def counts(self):
+        """Return the number of peptides with each modification type."""
+        return pd.Series(self.incidence.getnnz(axis=0), index=pd.Index(self.types, name="modification"))
+
+    def per_peptide(self):
+        """Return a list of the modification types of every peptide."""
+        indptr, indices = self.incidence.indptr, self.incidence.indices
+        return pd.Series([[self.types[j] for j in indices[indptr[i]:indptr[i + 1]]] for i in range(len(self))],
+                         index=self.index)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.multiplex
+-------------------
+
+Provides MultiPlex, several TMT plexes merged into one abundance matrix with
+internal reference scaling (IRS).
+
+Every fraction of every export is a plex. Each plex carries one or more
+pooled bridge channels, found in the study factor table (see
+omin.core.design.StudyDesign.bridge_mask). IRS first applies sample loading
+normalization across all channels. It then scales every row of every plex
+so that its bridge matches the geometric mean of the bridges of all plexes.
+This makes the channels of different plexes comparable.
+
+Rows are matched across exports on the container's multiplex_key, e.g. the
+Accession of Proteins. A row missing from a plex is NaN in that plex's
+channels.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import re
+import warnings
+
+import numpy as np
+
+from .pandomics import pandas as pd
+from .normalization import AbundanceCube
+
+
+class MultiPlex(object):
+    """TMT plexes merged on their rows.
+
+    Parameters
+    ----------
+    containers : list
+        ProteomeDiscovererRaw containers e.g. Proteins, one per export.
+
+    fraction : str
+        Regular expression matched against the fraction tags (e.g. "input")
+        to choose the plexes. Defaults to every fraction.
+
+    names : list
+        A name per container. Defaults to the file names.
+
+    on : str or list
+        The master_index columns rows are matched on. Defaults to the
+        multiplex_key of the first container.
+
+    Attributes
+    ----------
+    cube : AbundanceCube
+        One fraction per plex. The rows are the union of the rows of all
+        plexes, indexed by the on columns.
+
+    plexes : DataFrame
+        One row per plex with the columns Name, _Fn and Tag.
+
+    bridge : numpy.ndarray
+        (plexes, channels) True for the bridge channels.
+
+    study_factor_table : DataFrame
+        The study factor table of every plex with a _Plex column, indexed by
+        the merged column names.
+    """
+
+    def __init__(self, containers, fraction=None, names=None, on=None):
+        if len(containers) == 0:
+            raise ValueError("MultiPlex needs at least one container.")
+
+        names = names or self._default_names(containers)
+        on = on or containers[0].multiplex_key
+        on = [on] if isinstance(on, str) else list(on)
+
+        plexes, keys, blocks, bridges, columns, tables = [], [], [], [], [], []
+        for name, container in zip(names, containers):
+            cube = container.abundance_cube
+            selected = [k for k in cube.fractions
+                        if fraction is None or re.search(fraction, container.fraction_tag(k))]
+            if len(selected) == 0:
+                continue
+
+            positions = [cube.position(k) for k in selected]
+            # Rows the container filtered out of master_index (e.g. by q-value) have no key.
+            key = container.master_index.reindex(cube.index)[on]
+            if key[key.notnull().all(axis=1)].duplicated().any():
+                raise ValueError("{} has rows with the same {}.".format(name, ", ".join(on)))
+
+            table = container.study_factor_table
+            bridge = cube.channel_mask(container.study_design.bridge_mask.values)
+            for n, k in zip(positions, selected):
+                label = name if len(selected) == 1 else "{} {}".format(name, k)
+                plexes.append((label, k, container.fraction_tag(k)))
+                columns.append(["{}: {}".format(label, c) if c is not None else None for c in cube.columns[n]])
+                rows = [i for i in cube.positions[n] if i >= 0]
+                tables.append(table.loc[rows].assign(_Plex=label))
+
+            keys.append(key)
+            blocks.append(cube.values[positions])
+            bridges.append(bridge[positions])
+
+        if len(plexes) == 0:
+            raise ValueError("No fractions match {}.".format(fraction))
+
+        self.plexes = pd.DataFrame(plexes, columns=["Name", "_Fn", "Tag"])
+        self.cube, self.bridge = self._merge(keys, blocks, bridges, self.plexes.Name, columns, on)
+        self.study_factor_table = pd.concat(tables)
+        self.study_factor_table.index = [c for i in self.cube.columns for c in i if c is not None]
+
+        missing = self.plexes.Name[~self.bridge.any(axis=1)]
+        if len(missing) > 0:
+            raise ValueError("No bridge channels found in: {}".format(", ".join(missing)))
+
+    @classmethod
+    def from_files(cls, filepaths, container=None, fraction=None, names=None, on=None, **kwargs):
+        """Return the MultiPlex of many exports.
+
+        Parameters
+        ----------
+        filepaths : list
+
+        container : class
+            The container every file is read with. Defaults to Proteins.
+
+        kwargs
+            Passed on to the container.
+        """
+        if container is None:
+            from .containers import Proteins as container
+        containers = [container(i, **kwargs) for i in filepaths]
+        return cls(containers, fraction=fraction, names=names, on=on)
+
+    @staticmethod
+    def _default_names(containers):
+        names = [str(i.file_name or "") for i in containers]
+        if len(set(names)) != len(names) or "" in names:
+            names = ["plex_{}".format(n + 1) for n in range(len(containers))]
+        return names
+
+    @staticmethod
+    def _merge(keys, blocks, bridges, names, columns, on):
+        """Return the cube of every plex over the union of the rows and the bridge mask."""
+        key = pd.concat(keys)
+        if len(on) == 1:
+            codes, uniques = pd.factorize(key[on[0]].values)
+            index = pd.Index(uniques, name=on[0])
+        else:
+            # Only complete keys are factorized, the rest are coded -1 like a missing single key.
+            complete = key.notnull().all(axis=1).values
+            codes = np.full(len(key), -1, dtype=np.int64)
+            codes[complete], uniques = pd.factorize(pd.MultiIndex.from_frame(key[complete]))
+            index = pd.MultiIndex.from_tuples(list(uniques), names=on)
+
+        width = max(i.shape[2] for i in blocks)
+        values = np.full((sum(len(i) for i in blocks), len(index), width), np.nan)
+        bridge = np.zeros(values.shape[::2], dtype=bool)
+
+        # Place every export's block on the union rows, rows without a key are dropped.
+        plex, start = 0, 0
+        for block, mask in zip(blocks, bridges):
+            rows = codes[start:start + block.shape[1]]
+            known = rows >= 0
+            values[plex:plex + len(block), rows[known], :block.shape[2]] = block[:, known]
+            bridge[plex:plex + len(block), :block.shape[2]] = mask
+            plex += len(block)
+            start += block.shape[1]
+
+        columns = [i + [None] * (width - len(i)) for i in columns]
+        return AbundanceCube.from_values(values, index, names, columns), bridge
+
+    # ---
+    # IRS
+    # ---
+    def loading_factors(self, method="sum", trim=.1):
+        """Return the (plexes, channels) sample loading factors.
+
+        A channel's factor is its statistic, e.g. its sum, divided by the
+        mean statistic of all channels in all plexes.
+        """
+        statistic = np.where(self.cube.padding, np.nan, self.cube._column_statistic(method, trim=trim))
+        with np.errstate(all="ignore"):
+            return statistic / np.nanmean(statistic)
+
+    def irs_factors(self, values):
+        """Return the (plexes, rows) factors that scale each plex's bridge to the reference.
+
+        A plex's bridge is the mean of its bridge channels. The reference is
+        the geometric mean of the bridges of the plexes that have the row.
+        """
+        bridge = np.where(self.bridge[:, None, :], values, np.nan)
+        # Rows missing from a plex have no bridge, nanmean warns about those.
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            bridge = np.nanmean(bridge, axis=2)
+            log_bridge = np.log(np.where(bridge > 0, bridge, np.nan))
+            reference = np.exp(np.nanmean(log_bridge, axis=0))
+            return reference[None, :] / np.exp(log_bridge)
+
+    def normalize(self, loading="sum", irs=True, trim=.1):
+        """Return the normalized (plexes, rows, channels) values.
+
+        Parameters
+        ----------
+        loading : str
+            A method of AbundanceCube.factors for sample loading
+            normalization, or None to skip it.
+
+        irs : bool
+            Scale the plexes to their bridges.
+
+        trim : float
+            Used by loading="trimmed_mean".
+        """
+        values = self.cube.values
+        if loading is not None:
+            if loading not in AbundanceCube.methods or loading == "quantile":
+                raise ValueError("loading must be one of: sum, median, trimmed_mean")
+            values = values / self.loading_factors(loading, trim=trim)[:, None, :]
+        if irs:
+            values = values * self.irs_factors(values)[:, :, None]
+        return values
+
+    def merged(self, values=None, drop_bridge=False):
+        """Return the plexes as one rows x channels DataFrame.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            As returned by normalize. Defaults to normalize().
+
+        drop_bridge : bool
+            Leave out the bridge channels, after IRS they are the same in
+            every plex.
+        """
+        values = self.normalize() if values is None else values
+        keep = ~self.cube.padding
+        if drop_bridge:
+            keep = keep & ~self.bridge
+        columns = [c for i, k in zip(self.cube.columns, keep) for c, j in zip(i, k) if j]
+        # (plexes, rows, channels) -> rows x (plexes * channels) in plex order.
+        block = values.transpose(1, 0, 2)[:, keep]
+        return pd.DataFrame(block, index=self.cube.index, columns=columns)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.normalization
+-----------------------
+
+Provides AbundanceCube, the Abundance columns of a container held as one
+contiguous (fraction x row x channel) float array, and the normalizations
+that are applied to every fraction of the cube at once.
+
+Channels are ordered by column name within each fraction, the same order
+pandomics.normalize_to pairs the channels of two fractions in. Fractions
+with fewer channels than the others are padded with NaN channels.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import warnings
+
+import numpy as np
+
+from .pandomics import pandas as pd
+
+
+class AbundanceCube(object):
+    """Abundance values as a fractions x rows x channels array.
+
+    Parameters
+    ----------
+    dataframe : DataFrame
+        The Abundance columns of a container.
+
+    fractions : dict
+        In the format: fraction -> column positions in dataframe, e.g. built
+        from the _Fn column of the study factor table.
+
+    Attributes
+    ----------
+    values : numpy.ndarray
+        float64 of shape (fractions, rows, channels).
+
+    fractions : list
+        The fraction names in the order of values.
+
+    columns : list
+        The column names of each fraction in channel order, None for padding.
+
+    index : pandas.Index
+        The row index of dataframe.
+
+    positions : numpy.ndarray
+        The dataframe column position of every channel, -1 for padding.
+    """
+
+    # Methods of normalize.
+    methods = ("sum", "median", "trimmed_mean", "quantile")
+
+    def __init__(self, dataframe, fractions):
+        self.index = dataframe.index
+        self.fractions = list(fractions.keys())
+        width = max([len(i) for i in fractions.values()] + [0])
+
+        self.columns = []
+        positions = np.full((len(self.fractions), width), -1, dtype=np.int64)
+        for n, k in enumerate(self.fractions):
+            names = [str(dataframe.columns[i]) for i in fractions[k]]
+            order = sorted(range(len(names)), key=names.__getitem__)
+            positions[n, :len(order)] = np.asarray(fractions[k])[order]
+            self.columns.append([names[i] for i in order] + [None] * (width - len(order)))
+
+        # Gather every fraction with one take, the padding reads a NaN column.
+        data = np.column_stack([dataframe.values.astype(np.float64), np.full(len(dataframe), np.nan)])
+        self.values = np.ascontiguousarray(data[:, positions].transpose(1, 0, 2))
+        self.positions = positions
+        self.padding = positions < 0
+
+    @classmethod
+    def from_values(cls, values, index, fractions, columns):
+        """Return a cube of an existing (fractions, rows, channels) array.
+
+        columns gives the column names of every fraction with None for
+        padding, the positions are counted across the fractions.
+        """
+        cube = cls.__new__(cls)
+        cube.values = values
+        cube.index = index
+        cube.fractions = list(fractions)
+        cube.columns = [list(i) for i in columns]
+        cube.padding = np.array([[c is None for c in i] for i in cube.columns], dtype=bool).reshape(values.shape[::2])
+        cube.positions = np.full(cube.padding.shape, -1, dtype=np.int64)
+        cube.positions[~cube.padding] = np.arange((~cube.padding).sum())
+        return cube
+
+    @classmethod
+    def from_study_factor_table(cls, dataframe, study_factor_table):
+        """Return the cube of the Abundance columns grouped by the _Fn column."""
+        groups = study_factor_table.groupby("_Fn", sort=False).indices
+        return cls(dataframe, dict((k, list(study_factor_table.index[v])) for k, v in groups.items()))
+
+    def position(self, fraction):
+        return self.fractions.index(fraction)
+
+    def channel_mask(self, column_mask):
+        """Return a (fractions, channels) mask from a mask of the dataframe columns."""
+        column_mask = np.append(np.asarray(column_mask, dtype=bool), False)
+        return column_mask[self.positions]
+
+    # -------
+    # FACTORS
+    # -------
+    def _column_statistic(self, method, trim=.1):
+        """Return a (fractions, channels) statistic of every channel."""
+        values = self.values
+        if method == "sum":
+            return np.add.reduce(values, axis=1, where=~np.isnan(values))
+
+        if method == "median":
+            # Padded channels are all NaN, nanmedian warns about those.
+            with np.errstate(all="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                return np.nanmedian(values, axis=1) if values.shape[1] > 0 else np.full(values.shape[::2], np.nan)
+
+        if method == "trimmed_mean":
+            # NaNs sort to the end, cut `trim` of the present values off each end.
+            ordered = np.sort(values, axis=1)
+            n = (~np.isnan(values)).sum(axis=1)
+            lower = np.floor(n * trim).astype(np.int64)
+            upper = n - lower
+            cumulative = np.concatenate([np.zeros(values.shape[::2])[:, None, :],
+                                         np.cumsum(np.nan_to_num(ordered), axis=1)], axis=1)
+            total = (np.take_along_axis(cumulative, upper[:, None, :], axis=1)
+                     - np.take_along_axis(cumulative, lower[:, None, :], axis=1))[:, 0, :]
+            with np.errstate(all="ignore"):
+                return np.where(upper > lower, total / (upper - lower), np.nan)
+
+        raise ValueError("No column statistic for {}".format(method))
+
+    def factors(self, method="sum", trim=.1):
+        """Return the (fractions, channels) normalization factors.
+
+        A channel's factor is its statistic over the rows divided by the
+        mean statistic of the channels of its fraction, e.g. for "sum" the
+        column sums over the mean of the column sums like
+        pandomics.normalization_factors.
+        """
+        statistic = self._column_statistic(method, trim=trim)
+        statistic = np.where(self.padding, np.nan, statistic)
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return statistic / np.nanmean(statistic, axis=1)[:, None]
+
+    # --------
+    # QUANTILE
+    # --------
+    def _quantile_functions(self, grid):
+        """Return every channel's quantiles at grid, shape (fractions, channels, len(grid))."""
+        ordered = np.sort(self.values, axis=1).transpose(0, 2, 1)
+        if ordered.shape[2] == 0:
+            return np.full(ordered.shape[:2] + (len(grid),), np.nan)
+        n = (~np.isnan(ordered)).sum(axis=2)
+        position = grid[None, None, :] * np.maximum(n - 1, 0)[:, :, None]
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(n - 1, 0)[:, :, None])
+        weight = position - lower
+        result = ((1 - weight) * np.take_along_axis(ordered, lower, axis=2)
+                  + weight * np.take_along_axis(ordered, upper, axis=2))
+        return np.where((n > 0)[:, :, None], result, np.nan)
+
+    def _quantile_normalize(self, reference, link):
+        """Map every value to the mean distribution of the linked reference fraction."""
+        rows = self.values.shape[1]
+        grid = np.linspace(0, 1, max(rows, 2))
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            target = np.nanmean(reference._quantile_functions(grid), axis=1)[link]
+
+        # The rank of every present value within its channel, as a quantile.
+        present = ~np.isnan(self.values)
+        ranks = np.argsort(np.argsort(np.where(present, self.values, np.inf), axis=1, kind="mergesort"), axis=1)
+        n = present.sum(axis=1)[:, None, :]
+        with np.errstate(all="ignore"):
+            quantile = np.where(n > 1, ranks / (n - 1), 0.)
+
+        position = quantile * (len(grid) - 1)
+        lower = np.clip(np.floor(position).astype(np.int64), 0, len(grid) - 1)
+        upper = np.minimum(lower + 1, len(grid) - 1)
+        weight = position - lower
+        fraction = np.arange(len(link))[:, None, None]
+        result = (1 - weight) * target[fraction, lower] + weight * target[fraction, upper]
+        return np.where(present, result, np.nan)
+
+    # ---------
+    # NORMALIZE
+    # ---------
+    def normalize(self, method="sum", reference=None, link=None, trim=.1):
+        """Return the normalized values of every fraction in one call.
+
+        Parameters
+        ----------
+        method : str
+            "sum", "median" or "trimmed_mean" divide every channel by its
+            factor (see factors). "quantile" gives every channel the mean
+            distribution of the channels of the reference fraction.
+
+        reference : AbundanceCube
+            The cube the factors (or distributions) come from. Defaults to
+            self.
+
+        link : array-like
+            The reference fraction position for each fraction of self.
+            Defaults to each fraction itself.
+
+        trim : float
+            Proportion cut from each end by "trimmed_mean".
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Of the same shape as self.values.
+        """
+        if method not in self.methods:
+            raise ValueError("method must be one of: {}".format(", ".join(self.methods)))
+        reference = self if reference is None else reference
+        link = np.arange(len(self.fractions)) if link is None else np.asarray(link, dtype=np.int64)
+        if reference.values.shape[2] != self.values.shape[2]:
+            raise ValueError("The reference has {} channels per fraction, not {}.".format(reference.values.shape[2],
+                                                                                      self.values.shape[2]))
+
+        if method == "quantile":
+            return self._quantile_normalize(reference, link)
+
+        factors = reference.factors(method, trim=trim)[link]
+        return self.values / factors[:, None, :]
+
+    def frames(self, values, names=None, reference=None, link=None):
+        """Return labeled DataFrames of normalized values, only the fractions in names.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            As returned by normalize.
+
+        names : dict
+            In the format: fraction -> label, e.g. the fraction tags, in the
+            order of the result. Defaults to every fraction by its name.
+
+        reference, link
+            As given to normalize, used to label the columns like
+            pandomics.normalize_to e.g. "<column>: Normalized to: <column>".
+
+        Returns
+        -------
+        result : dict
+            In the format: label -> DataFrame.
+        """
+        reference = self if reference is None else reference
+        link = np.arange(len(self.fractions)) if link is None else np.asarray(link, dtype=np.int64)
+        names = names or dict((k, k) for k in self.fractions)
+
+        result = dict()
+        for k, label in names.items():
+            n = self.position(k)
+            keep = [i for i, c in enumerate(self.columns[n]) if c is not None]
+            columns = [self.columns[n][i] + ": Normalized to: " + reference.columns[link[n]][i] for i in keep]
+            # Without padding the frame is a view of values.
+            block = values[n] if len(keep) == values.shape[2] else values[n][:, keep]
+            result[label] = pd.DataFrame(block, index=self.index, columns=columns, copy=False)
+        return result
@@ -19,21 +19,39 @@ from glob import glob
 # INTERNAL IMPORTS
 # ----------------
 from .handles import Process
+from .store import ProjectStore
 
 # -------------
 # UTILS IMPORTS
 # -------------
-from ..utils import IOTools
+from ..utils import IOTools, UserProfile
 
 class Operate(object):
 
     @staticmethod
-    def load_process(process_path):
-        """Load an omin process file.
+    def load_process(process_path, strict=False):
+        """Load an omin process.
+
+        Project stores (see omin.core.store.ProjectStore) are opened lazily,
+        DataFrames are only read from disk when they are first accessed.
+        Process files pickled by older versions of omin can still be loaded.
+
+        Parameters
+        ----------
+        process_path: str
+
+        strict: bool
+            Refuse to open stores written by a different version of omin.
+            Defaults to False.
         """
         proc = None
-        if os.path.exists(process_path):
-            proc = pickle.load(open(process_path, "rb"))
+        if ProjectStore.is_store(process_path):
+            proc = ProjectStore.load(process_path, strict=strict)
+            print("Loaded", process_path)
+        elif os.path.isfile(process_path):
+            print("Loading pickled process", process_path, "save it again to convert it to a project store.")
+            with open(process_path, "rb") as f:
+                proc = pickle.load(f)
             print("Loaded", process_path)
         else:
             print(process_path, "does not exist.")
@@ -41,18 +59,21 @@ class Operate(object):
 
 
     @staticmethod
-    def _dump_into_pickle_file(process_obj, process_path):
-        """Dump a process obj into a pickle file.
+    def _dump_into_store(process_obj, process_path):
+        """Dump a process obj into a project store.
 
         WARNING: Will overwrite existing files.
         """
-        pickle.dump(process_obj, open(process_path, "wb"))
+        # Replace old pickled process files.
+        if os.path.isfile(process_path):
+            os.remove(process_path)
+        ProjectStore.dump(process_obj, process_path)
         print("Process has been saved at:", process_path)
 
 
     @classmethod
     def create_process(cls, process_obj, process_path, usr_inp=None, **kwargs):
-        """Dump a process obj into a pickle file.
+        """Dump a process obj into a project store.
 
         Gives options on overwrite.
         """
@@ -62,12 +83,12 @@ class Operate(object):
 
             if usr_inp == "Y" or usr_inp == "y":
                 print("Process file", process_path, "is being overwritten...")
-                cls._dump_into_pickle_file(process_obj, process_path)
+                cls._dump_into_store(process_obj, process_path)
 
             else:
                 print("Process file", process_path, "was not overwritten.")
         else:
-            cls._dump_into_pickle_file(process_obj, process_path)
+            cls._dump_into_store(process_obj, process_path)
 
 
     @classmethod
@@ -104,6 +125,7 @@ class Operate(object):
 
     @classmethod
     def start(cls, file_list=None, rescue_entrez_ids=True, *args, **kwargs):
+        UserProfile.setup()
         if file_list is None:
             # FIXME: Open this very narrow edge case up.
             # FIXME: Add error messages.
@@ -39,16 +39,35 @@ from pandas.core.indexes.base import Index
 from pandas.core.dtypes.common import is_integer, is_hashable
 import numpy as np
 
-
+# pyarrow is optional, without it first_member splits every distinct value in Python.
 try:
-    from scipy.stats import ttest_ind
-except ImportError as err:
-    print(err)
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
 
-try:
-    from statsmodels.sandbox.stats.multicomp import multipletests
-except ImportError as err:
-    print(err)
+# NOTE: scipy.stats and statsmodels are imported in the functions that use
+# them so that importing pandomics stays cheap.
+
+
+def _first_members(values, delim):
+    """Return an object array of the first member of every value split on delim.
+
+    Uses Arrow's string kernels when pyarrow is available and every value is
+    a string, otherwise each distinct value is split once.
+    """
+    if pyarrow is not None:
+        try:
+            array = pyarrow.array(values, type=pyarrow.string(), from_pandas=True)
+            split = pyarrow.compute.split_pattern(array, pattern=delim, max_splits=1)
+            return pyarrow.compute.list_element(split, 0).to_numpy(zero_copy_only=False)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Not every value is a string.
+            pass
+
+    codes, uniques = pandas.factorize(values)
+    members = np.array([str(i).partition(delim)[0] for i in uniques], dtype=object)
+    return members.take(codes)
 
 
 def first_member(self, delim=';'):
@@ -57,8 +76,8 @@ def first_member(self, delim=';'):
     Intended for pandas.Series that has lists in the form of strings
     with a foreign delimiter.
 
-    WARNING: NaNs are cast as strings and cast back to floats. So if
-    your first member happens to be 'nan' it will be cast as a float.
+    Missing values stay missing and everything else is returned as a string,
+    so a literal 'nan' is kept as is.
 
     Parameters
     ----------
@@ -70,11 +89,17 @@ def first_member(self, delim=';'):
     results : pandas.Series
         A Series of the first members of the list.
     """
-    result = self.astype(str).apply(lambda x: x.split(delim)[0])
+    missing = self.isna().values
 
-    result = result.replace('nan', float('nan'))
+    if self.dtype == object:
+        values = self.values
+    else:
+        values = self.astype(str).values
 
-    return result
+    result = np.asarray(_first_members(values, delim), dtype=object)
+    result[missing] = float('nan')
+
+    return pandas.Series(result, index=self.index, name=self.name)
 
 
 setattr(pandas.Series, 'first_member', first_member)
@@ -142,6 +167,18 @@ def normalize_to(self, normal):
 setattr(pandas.DataFrame, "normalize_to", normalize_to)
 
 
+def impute(self, method="min_prob", groups=None, log=True, **kwargs):
+    """Return a DataFrame with its missing values imputed.
+
+    See omin.core.imputation.Imputation.impute.
+    """
+    from .imputation import Imputation
+    return Imputation.impute(self, method=method, groups=groups, log=log, **kwargs)
+
+
+setattr(pandas.DataFrame, "impute", impute)
+
+
 def _comparator(self, item=None, filter_out_item=False):
     """Returns filtered DataFrame.
     """
@@ -212,8 +249,17 @@ def fold_change(self, right=None, numerator=None, denominator=None, filter_out_n
 setattr(pandas.DataFrame, "fold_change", fold_change)
 
 
+def _kernels():
+    """Return omin.stats.kernels.
+
+    Imported on demand because omin.stats imports this module.
+    """
+    from ..stats import kernels
+    return kernels
+
+
 def ttest(self, right=None, numerator=None, denominator=None, filter_out_numerator=False,
-          filter_out_denominator=False, column_name="pvalue", axis=1):
+          filter_out_denominator=False, column_name="pvalue", axis=1, equal_var=True, min_n=None):
 
     """Return the p-value of two groups in this DataFrame or this DataFrame and another(right).
 
@@ -236,6 +282,13 @@ def ttest(self, right=None, numerator=None, denominator=None, filter_out_numerat
 
     axis: int
 
+    equal_var: bool
+        Student's t-test if True (the default) otherwise Welch's t-test.
+
+    min_n: int
+        Minimum number of observations per group. Defaults to None, rows with
+        any missing values get a NaN p-value.
+
     Returns
     -------
     result: pandas.DataFrame
@@ -251,13 +304,18 @@ def ttest(self, right=None, numerator=None, denominator=None, filter_out_numerat
         if denominator is not None:
             right = _comparator(self, item=denominator, filter_out_item=filter_out_denominator)
 
-    # The loop below suppresses an irrelevent error message.
-    # For more details on this see:
-    # http://stackoverflow.com/questions/40452765/invalid-value-in-less-when-comparing-np-nan-in-an-array
-    with np.errstate(invalid='ignore'):
-        np.less([np.nan, 0], 1)
-        # ttest_ind implemented
-        result = ttest_ind(left, right, axis=axis).pvalue
+    if axis == 1:
+        _, result = _kernels().ttest_two_sample(left.values, right.values, equal_var=equal_var, min_n=min_n)
+
+    else:
+        # The loop below suppresses an irrelevent error message.
+        # For more details on this see:
+        # http://stackoverflow.com/questions/40452765/invalid-value-in-less-when-comparing-np-nan-in-an-array
+        with np.errstate(invalid='ignore'):
+            np.less([np.nan, 0], 1)
+            # ttest_ind implemented
+            from scipy.stats import ttest_ind
+            result = ttest_ind(left, right, axis=axis, equal_var=equal_var).pvalue
 
     result = pandas.DataFrame(result, columns=[column_name], index=self.index)
 
@@ -267,31 +325,36 @@ def ttest(self, right=None, numerator=None, denominator=None, filter_out_numerat
 setattr(pandas.DataFrame, "ttest", ttest)
 
 
+def _p_adjusted(pvalues, alpha=None, method="fdr_bh"):
+    """Return the multiple test corrected p-values of an array, NaNs are kept in place."""
+    alpha = alpha or .05
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    result = np.full(pvalues.shape, np.nan)
+    present = ~np.isnan(pvalues)
+    if present.any():
+        from statsmodels.sandbox.stats.multicomp import multipletests
+        result[present] = multipletests(pvals=pvalues[present], method=method, alpha=alpha)[1]
+    return result
+
+
 def ttest_fdr(self, numerator=None, denominator=None, filter_out_numerator=False,
               filter_out_denominator=False, right=None, column_name="pvalue",
-              alpha=None, method="fdr_bh", axis=1):
+              alpha=None, method="fdr_bh", axis=1, equal_var=True, min_n=None):
     """Return the p-value and p-adjusted of this dataframe and another or two groups inside of this dataframe.
     """
-    alpha = alpha or .05
     result = self.ttest(right=right,
                         numerator=numerator,
                         denominator=denominator,
                         filter_out_numerator=filter_out_numerator,
                         filter_out_denominator=filter_out_denominator,
                         column_name=column_name,
-                        axis=axis)
-
-    fdr_funct = functools.partial(multipletests, method=method, alpha=alpha)
-
-    p_adj = fdr_funct(pvals=result.dropna().values.T[0])
-
-    p_adj = pandas.DataFrame(p_adj[1])
+                        axis=axis,
+                        equal_var=equal_var,
+                        min_n=min_n)
 
-    p_adj.index = result.dropna().index
-
-    p_adj = p_adj.reindex(index=result.index)
-
-    p_adj.columns = ["p_adjusted"]
+    p_adj = pandas.DataFrame(_p_adjusted(result.iloc[:, 0].values, alpha=alpha, method=method),
+                             index=result.index,
+                             columns=["p_adjusted"])
 
     result = pandas.concat([result, p_adj], axis=axis)
 
@@ -304,7 +367,8 @@ setattr(pandas.DataFrame, "ttest_fdr", ttest_fdr)
 def fold_change_with_ttest(self, numerator=None, denominator=None, right=None,
                            filter_out_numerator=False, filter_out_denominator=False,
                            fdr_alpha=None, fdr_method="fdr_bh",
-                           metadata=None, missing_values=False, axis=1):
+                           metadata=None, missing_values=False, axis=1,
+                           equal_var=True, min_n=None):
 
     """Return the fold change, p-values, and p-adjusted for a comparison.
     """
@@ -323,7 +387,9 @@ def fold_change_with_ttest(self, numerator=None, denominator=None, right=None,
                             right=right,
                             alpha=fdr_alpha,
                             method=fdr_method,
-                            axis=axis)
+                            axis=axis,
+                            equal_var=equal_var,
+                            min_n=min_n)
 
     result = pandas.concat([fold_change, pvalue], axis=axis)
 
@@ -347,6 +413,168 @@ def fold_change_with_ttest(self, numerator=None, denominator=None, right=None,
 setattr(pandas.DataFrame, "fold_change_with_ttest", fold_change_with_ttest)
 
 
+def _comparison_positions(self, comparisons, filter_out_numerator=False, filter_out_denominator=False):
+    """Return the column positions for a list of [numerator, denominator] comparisons."""
+    positions = []
+    for numerator, denominator in comparisons:
+        left = _comparator(self, item=numerator, filter_out_item=filter_out_numerator)
+        right = _comparator(self, item=denominator, filter_out_item=filter_out_denominator)
+        positions.append([self.columns.get_indexer(left.columns), self.columns.get_indexer(right.columns)])
+    return positions
+
+
+def fold_change_with_ttest_batch(self, comparisons, filter_out_numerator=False, filter_out_denominator=False,
+                                 fdr_alpha=None, fdr_method="fdr_bh", missing_values=False,
+                                 equal_var=True, min_n=None):
+    """Return fold_change_with_ttest results for many comparisons at once.
+
+    The group means and variances are computed once for every distinct group
+    of columns, see omin.stats.kernels.ttest_batch.
+
+    Parameters
+    ----------
+    comparisons: list
+        In the format: [[numerator, denominator],...]
+
+    equal_var: bool
+        Student's t-test if True (the default) otherwise Welch's t-test.
+
+    min_n: int
+        Minimum number of observations per group. Defaults to None, rows with
+        any missing values get a NaN p-value.
+
+    Returns
+    -------
+    results: list
+        One DataFrame per comparison with the columns Log2FC, pvalue and
+        p_adjusted.
+    """
+    positions = _comparison_positions(self, comparisons,
+                                      filter_out_numerator=filter_out_numerator,
+                                      filter_out_denominator=filter_out_denominator)
+
+    batch = _kernels().ttest_batch(self.values, positions, equal_var=equal_var, min_n=min_n)
+
+    return _batch_frames(self, batch, fdr_alpha=fdr_alpha, fdr_method=fdr_method, missing_values=missing_values)
+
+
+setattr(pandas.DataFrame, "fold_change_with_ttest_batch", fold_change_with_ttest_batch)
+
+
+def _batch_frames(self, batch, fdr_alpha=None, fdr_method="fdr_bh", missing_values=False):
+    """Return one Log2FC, pvalue, p_adjusted DataFrame per comparison of a ttest_batch result."""
+    results = []
+    for j in range(batch["pvalue"].shape[1]):
+        result = pandas.DataFrame({"Log2FC": batch["fold_change"][:, j],
+                                   "pvalue": batch["pvalue"][:, j],
+                                   "p_adjusted": _p_adjusted(batch["pvalue"][:, j], alpha=fdr_alpha, method=fdr_method)},
+                                  index=self.index,
+                                  columns=["Log2FC", "pvalue", "p_adjusted"])
+        if missing_values is not True:
+            result.dropna(subset=["Log2FC", "pvalue"], inplace=True)
+        results.append(result)
+    return results
+
+
+def fold_change_with_ttest_batches(dataframes, comparisons, filter_out_numerator=False, filter_out_denominator=False,
+                                   fdr_alpha=None, fdr_method="fdr_bh", missing_values=False,
+                                   equal_var=True, min_n=None, n_jobs=None, executor=None):
+    """Return fold_change_with_ttest_batch results for several DataFrames.
+
+    Every DataFrame x comparison pair is an independent task that can be run
+    on a pool of worker processes, see omin.stats.parallel.ttest_batches.
+
+    Parameters
+    ----------
+    dataframes: list
+        DataFrames, e.g. one per fraction.
+
+    comparisons: list
+        In the format: [[numerator, denominator],...] applied to every DataFrame.
+
+    n_jobs: int
+        Number of worker processes. Defaults to None, everything runs in this
+        process. -1 uses every core.
+
+    executor: concurrent.futures.Executor
+        An existing executor to use instead of starting a new pool.
+
+    Returns
+    -------
+    results: list
+        One list of DataFrames per DataFrame, see fold_change_with_ttest_batch.
+    """
+    from ..stats import parallel
+
+    jobs = [(i.values, _comparison_positions(i, comparisons,
+                                             filter_out_numerator=filter_out_numerator,
+                                             filter_out_denominator=filter_out_denominator))
+            for i in dataframes]
+
+    batches = parallel.ttest_batches(jobs, n_jobs=n_jobs, executor=executor, equal_var=equal_var, min_n=min_n)
+
+    return [_batch_frames(i, batch, fdr_alpha=fdr_alpha, fdr_method=fdr_method, missing_values=missing_values)
+            for i, batch in zip(dataframes, batches)]
+
+
+setattr(pandas, "fold_change_with_ttest_batches", fold_change_with_ttest_batches)
+
+
+def fold_change_with_moderated_ttest(self, numerator=None, denominator=None,
+                                     filter_out_numerator=False, filter_out_denominator=False,
+                                     fdr_alpha=None, fdr_method="fdr_bh",
+                                     metadata=None, missing_values=False, min_n=None):
+
+    """Return the fold change, moderated t-test p-values, and p-adjusted for a comparison.
+
+    A drop in alternative to fold_change_with_ttest that uses limma style
+    empirical Bayes moderated t-statistics. The variance of every row is
+    shrunk towards a prior fitted across all rows, which gives more power
+    for designs with only a few replicates per group. See
+    omin.stats.kernels.moderated_ttest_batch.
+
+    Parameters
+    ----------
+    numerator: str
+
+    denominator: str
+
+    min_n: int
+        Minimum number of observations per group. Defaults to None, only rows
+        without missing values are tested.
+
+    Returns
+    -------
+    result: pandas.DataFrame
+        With the columns Log2FC, t, pvalue and p_adjusted.
+    """
+    positions = _comparison_positions(self, [[numerator, denominator]],
+                                      filter_out_numerator=filter_out_numerator,
+                                      filter_out_denominator=filter_out_denominator)
+
+    batch = _kernels().moderated_ttest_batch(self.values, positions, min_n=min_n)
+
+    result = pandas.DataFrame({"Log2FC": batch["fold_change"][:, 0],
+                               "t": batch["t"][:, 0],
+                               "pvalue": batch["pvalue"][:, 0],
+                               "p_adjusted": _p_adjusted(batch["pvalue"][:, 0], alpha=fdr_alpha, method=fdr_method)},
+                              index=self.index,
+                              columns=["Log2FC", "t", "pvalue", "p_adjusted"])
+
+    if metadata is not None:
+        metadata_truncated = metadata.loc[result.index]
+        result = pandas.concat([metadata_truncated, result], axis=1)
+
+    # If missing_values is False rows will be droped if they any NaNs present.
+    if missing_values is not True:
+        result.dropna(subset=["Log2FC", "pvalue"], inplace=True)
+
+    return result
+
+
+setattr(pandas.DataFrame, "fold_change_with_moderated_ttest", fold_change_with_moderated_ttest)
+
+
 @property
 def label_pos(self):
     """Return a dict with column labels as keys and positions as values."""
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.sites
+---------------
+
+Provides SiteIndex, the map of peptide groups to the protein sites they
+cover, and the grouped reductions that roll peptide values up to sites.
+
+A site is an (Accession, Residue, Position) key in protein coordinates. A
+peptide with two modified sites counts towards both, and a site covered by
+several peptide groups (missed cleavages, co-modifications) gets one row.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import numpy as np
+
+from .pandomics import pandas as pd
+
+
+class SiteIndex(object):
+    """Integer coded map of peptide rows to sites.
+
+    Parameters
+    ----------
+    peptides : array-like
+        The row position of the peptide of every peptide x site pair.
+
+    sites : DataFrame
+        Aligned with peptides, with the columns Accession, Residue,
+        ProteinPosition and Modification. Pairs with an unknown accession or
+        position are dropped.
+
+    Attributes
+    ----------
+    keys : DataFrame
+        One row per site, sorted by Accession and Position and indexed by
+        (Accession, Residue, Position), with the columns Modification and
+        Peptides (the number of peptide groups).
+
+    peptide, site : numpy.ndarray
+        The row position of the peptide and the site code of every pair,
+        sorted by site code.
+    """
+
+    # Reductions of roll_up, see aggregate.
+    methods = ("sum", "median", "max_intensity")
+
+    def __init__(self, peptides, sites):
+        peptides = np.asarray(peptides, dtype=np.int64)
+        known = (sites.Accession.notnull() & sites.ProteinPosition.notnull()).values
+        peptides = peptides[known]
+        sites = sites.loc[known]
+
+        keys = pd.MultiIndex.from_arrays([sites.Accession.values,
+                                          sites.Residue.values,
+                                          sites.ProteinPosition.values.astype(np.int64)],
+                                         names=["Accession", "Residue", "Position"])
+        codes, uniques = pd.factorize(keys, sort=True)
+
+        order = np.argsort(codes, kind="mergesort")
+        self.peptide = peptides[order]
+        self.site = codes[order]
+
+        first = np.unique(self.site, return_index=True)[1]
+        modifications = np.asarray(sites.Modification.values, dtype=object)[order][first]
+        counts = np.diff(np.append(first, len(self.site)))
+        self.keys = pd.DataFrame({"Modification": modifications, "Peptides": counts},
+                                 index=pd.MultiIndex.from_tuples(list(uniques), names=keys.names))
+        self._starts = first
+
+    def __len__(self):
+        return len(self.keys)
+
+    def aggregate(self, values, how="sum"):
+        """Return values (peptides x samples) reduced to sites x samples.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Rows aligned with the peptide positions of the index.
+
+        how : str
+            "sum" adds the peptides, NaNs are skipped and sites with no
+            values are NaN. "median" takes the median of the peptides.
+            "max_intensity" takes the peptide with the largest summed
+            intensity across the samples.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if how not in self.methods:
+            raise ValueError("how must be one of: {}".format(", ".join(self.methods)))
+
+        if len(self) == 0:
+            return np.zeros((0, values.shape[1]))
+
+        rows = values[self.peptide]
+
+        if how == "sum":
+            present = ~np.isnan(rows)
+            total = np.add.reduceat(np.where(present, rows, 0), self._starts, axis=0)
+            n = np.add.reduceat(present.astype(np.int64), self._starts, axis=0)
+            return np.where(n > 0, total, np.nan)
+
+        if how == "median":
+            return pd.DataFrame(rows).groupby(self.site, sort=True).median().values
+
+        # max_intensity: order by site, then by descending peptide intensity.
+        intensity = np.nansum(rows, axis=1)
+        order = np.lexsort((-intensity, self.site))
+        return rows[order][self._starts]
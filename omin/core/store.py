@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+omin.core.store
+---------------
+
+Provides the ProjectStore, a directory based replacement for pickling whole
+Process objects.
+
+Each object is written as a directory. DataFrames and Series are written one
+file per attribute (Parquet when pyarrow is available, otherwise pandas
+pickles), nested omin objects get their own sub directory and everything
+else is collected in a small state.p file. A manifest.json at the top of the
+store records the store layout version and the omin version that wrote it.
+
+Layout::
+
+    project.omin/
+        manifest.json
+        index.json
+        state.p
+        peptide_groups/
+            index.json
+            state.p
+            raw.parquet
+            relative_occupancy/
+                index.json
+                state.p
+                _acetyl.parquet
+        proteins/
+            ...
+
+When a store is opened only the manifest and the state files are read.
+Attributes of Handle objects are left on disk and loaded on first access.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+# ----------------
+# EXTERNAL IMPORTS
+# ----------------
+import os
+import json
+import pickle
+import shutil
+import warnings
+import importlib
+
+from .pandomics import pandas as pd
+
+# ----------------
+# INTERNAL IMPORTS
+# ----------------
+from .base import Handle
+from .handles import omin_version
+from ..utils.io_tools import IOTools, TableCache
+
+try:
+    import pyarrow
+    PARQUET = True
+except ImportError:
+    PARQUET = False
+
+
+class _LazyLoader(object):
+    """Picklable callable that loads one stored attribute."""
+
+    def __init__(self, path, entry):
+        self.path = path
+        self.entry = entry
+
+    def __call__(self):
+        return ProjectStore._load_entry(self.path, self.entry)
+
+
+class ProjectStore(object):
+    """Write and read omin objects as versioned, lazily loaded directories.
+    """
+    # Bump this when the layout changes in a way old readers cannot handle.
+    store_version = 1
+    manifest_name = "manifest.json"
+
+    @classmethod
+    def is_store(cls, path):
+        """Return True if path is a project store."""
+        return os.path.isfile(os.path.join(path, cls.manifest_name))
+
+    @classmethod
+    def dump(cls, obj, path):
+        """Write obj to a project store at path.
+
+        WARNING: Will overwrite an existing store at path.
+
+        Parameters
+        ----------
+        obj : omin.core.handles.Process
+            Any object with a __dict__ will work.
+
+        path : str
+        """
+        path = os.path.abspath(path)
+        if os.path.exists(path) and not cls.is_store(path):
+            raise ValueError("{} exists and is not an omin project store.".format(path))
+
+        # Write everything next door and swap it in at the end.
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        cls._dump_object(obj, tmp_path)
+
+        version_info = getattr(obj, "_version_info", None) or {"omin": omin_version}
+        manifest = {"store_version": cls.store_version,
+                    "version_info": version_info,
+                    "class": cls._class_name(type(obj))}
+
+        with open(os.path.join(tmp_path, cls.manifest_name), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, strict=False):
+        """Open a project store.
+
+        Parameters
+        ----------
+        path : str
+
+        strict : bool
+            If True a store written by a different version of omin raises a
+            ValueError. Otherwise a warning is issued and the store is loaded.
+            Defaults to False.
+
+        Returns
+        -------
+        obj : omin.core.handles.Process
+        """
+        path = os.path.abspath(path)
+        manifest = cls.read_manifest(path)
+
+        if manifest.get("store_version") != cls.store_version:
+            raise ValueError("{} uses store version {}, this version of omin reads version {}."
+                             .format(path, manifest.get("store_version"), cls.store_version))
+
+        stored_omin = manifest.get("version_info", {}).get("omin")
+        if stored_omin != omin_version:
+            message = "{} was written by omin {}, this is omin {}.".format(path, stored_omin, omin_version)
+            if strict:
+                raise ValueError(message)
+            warnings.warn(message + " Results should be regenerated if anything looks off.")
+
+        return cls._load_object(path, manifest["class"])
+
+    @classmethod
+    def read_manifest(cls, path):
+        """Return the manifest of the store at path as a dict."""
+        if not cls.is_store(path):
+            raise ValueError("{} is not an omin project store.".format(path))
+        with open(os.path.join(path, cls.manifest_name)) as f:
+            return json.load(f)
+
+    # ---------------
+    # PRIVATE METHODS
+    # ---------------
+    @staticmethod
+    def _class_name(klass):
+        return ".".join([klass.__module__, klass.__name__])
+
+    @staticmethod
+    def _import_class(class_name):
+        module_name, _, name = class_name.rpartition(".")
+        return getattr(importlib.import_module(module_name), name)
+
+    @staticmethod
+    def _is_group(value):
+        """Return True if value is an omin object that gets its own directory."""
+        return (not isinstance(value, type)
+                and hasattr(value, "__dict__")
+                and type(value).__module__.startswith("omin."))
+
+    @staticmethod
+    def _file_stem(name, path):
+        """Return a file system safe stem for an attribute name that is not taken in path."""
+        stem = IOTools.sanitize_file_path(str(name)) or "attribute"
+        taken = set(os.path.splitext(os.path.splitext(i)[0])[0] for i in os.listdir(path))
+        result = stem
+        n = 1
+        while result in taken:
+            result = "{}_{}".format(stem, n)
+            n += 1
+        return result
+
+    @classmethod
+    def _dump_frame(cls, frame, path, name):
+        """Write a DataFrame returning the file name used."""
+        name = cls._file_stem(name, path)
+        if PARQUET:
+            file_name = name + ".parquet"
+            try:
+                frame.to_parquet(os.path.join(path, file_name))
+                return file_name
+            except Exception:
+                # Mixed type object columns, non-string labels ect.
+                pass
+        file_name = name + ".pd.p"
+        frame.to_pickle(os.path.join(path, file_name))
+        return file_name
+
+    @classmethod
+    def _dump_object(cls, obj, path):
+        """Write the attributes of obj into the directory path."""
+        index = dict()
+        state = dict()
+        transient = set(getattr(type(obj), "_transient_attributes", ()))
+        for k, v in obj.__dict__.items():
+            if k in transient:
+                continue
+            # Attributes that were never loaded are copied over as is.
+            if k == "_lazy_attributes":
+                for lazy_name, loader in v.items():
+                    cls._dump_attribute(lazy_name, loader(), path, index, state)
+                continue
+            cls._dump_attribute(k, v, path, index, state)
+
+        with open(os.path.join(path, "state.p"), "wb") as f:
+            pickle.dump(state, f)
+
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"class": cls._class_name(type(obj)), "attributes": index}, f, indent=2)
+
+    @classmethod
+    def _dump_attribute(cls, name, value, path, index, state):
+        if isinstance(value, pd.DataFrame):
+            index[name] = {"kind": "frame", "file": cls._dump_frame(value, path, name)}
+
+        elif isinstance(value, pd.Series):
+            frame = value.to_frame(name="values")
+            index[name] = {"kind": "series",
+                           "name": value.name,
+                           "file": cls._dump_frame(frame, path, name)}
+
+        elif cls._is_group(value):
+            dir_name = cls._file_stem(name, path)
+            os.makedirs(os.path.join(path, dir_name))
+            cls._dump_object(value, os.path.join(path, dir_name))
+            index[name] = {"kind": "group", "dir": dir_name, "class": cls._class_name(type(value))}
+
+        else:
+            try:
+                pickle.dumps(value)
+                state[name] = value
+            except Exception as err:
+                # Open file handles ect. are not worth keeping.
+                print("Could not store attribute", name, err)
+
+    @classmethod
+    def _load_frame(cls, path):
+        if path.endswith(".parquet"):
+            return TableCache.restore_nans(pd.read_parquet(path))
+        return pd.read_pickle(path)
+
+    @classmethod
+    def _load_entry(cls, path, entry):
+        """Load one attribute described by an index.json entry."""
+        if entry["kind"] == "frame":
+            return cls._load_frame(os.path.join(path, entry["file"]))
+
+        if entry["kind"] == "series":
+            result = cls._load_frame(os.path.join(path, entry["file"]))["values"]
+            result.name = entry["name"]
+            return result
+
+        if entry["kind"] == "group":
+            return cls._load_object(os.path.join(path, entry["dir"]), entry["class"])
+
+    @classmethod
+    def _load_object(cls, path, class_name):
+        """Rebuild an object from the directory path.
+
+        Handles get their DataFrames and nested objects as lazy attributes,
+        everything else is loaded right away.
+        """
+        klass = cls._import_class(class_name)
+        obj = klass.__new__(klass)
+
+        with open(os.path.join(path, "state.p"), "rb") as f:
+            obj.__dict__.update(pickle.load(f))
+
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)["attributes"]
+
+        if isinstance(obj, Handle):
+            obj.__dict__["_lazy_attributes"] = {k: _LazyLoader(path, v) for k, v in index.items()}
+        else:
+            for k, v in index.items():
+                obj.__dict__[k] = cls._load_entry(path, v)
+
+        return obj
@@ -10,3 +10,4 @@
 # from . import mitoCartaCall
 # from .mitocarta_call import MitoCarta
 from .mitocarta import MitoCartaTwo
+from .idmapping import AccessionIndex
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the built-in databases."""
+
+# LICENSE
+# -------
+
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+
+class LazyClassAttribute(object):
+    """Class attribute computed on first access and then stored on the class.
+
+    Used so that importing omin does not read the database files.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        value = self.func(owner)
+        setattr(owner, self.name, value)
+        return value
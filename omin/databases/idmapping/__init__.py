@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""Offline accession to gene ID mapping."""
+
+# LICENSE
+# -------
+
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach,
+# Blair Chesnut, and Elizabeth Hauser.
+
+from .index import AccessionIndex
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped accession to gene ID index built from UniProt idmapping files."""
+
+# LICENSE
+# -------
+
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import os
+import json
+import shutil
+
+import numpy as np
+
+from ...core.pandomics import pandas as pd
+from ...utils.io_tools import UserProfile
+
+
+class AccessionIndex(object):
+    """Sorted accession keys and integer gene IDs stored as .npy files.
+
+    The index is built once from a UniProt idmapping file, e.g.
+    MOUSE_10090_idmapping.dat.gz from
+    ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/by_organism/
+    and opened memory-mapped, so lookups need neither the network nor
+    loading the whole index into memory.
+
+    Accessions that map to more than one gene ID are stored as ambiguous and
+    look up as missing, like IntermineTools.mousemine_accession_lookup_reduce.
+
+    Layout::
+
+        accession_index/
+            info.json
+            keys.npy     sorted fixed width byte strings
+            values.npy   int64 gene IDs, -1 for ambiguous
+
+    Parameters
+    ----------
+    path: str
+        Directory of a built index. Defaults to default_path.
+    """
+    # Bump this if the on-disk layout changes.
+    index_version = 1
+    default_path = os.path.join(UserProfile.omin_database_profile_dir, "accession_index")
+    ambiguous = -1
+
+    def __init__(self, path=None):
+        self.path = path or self.default_path
+        with open(os.path.join(self.path, "info.json")) as f:
+            self.info = json.load(f)
+        if self.info.get("index_version") != self.index_version:
+            raise ValueError("{} uses index version {}, this version of omin reads version {}."
+                             .format(self.path, self.info.get("index_version"), self.index_version))
+        self.keys = np.load(os.path.join(self.path, "keys.npy"), mmap_mode="r")
+        self.values = np.load(os.path.join(self.path, "values.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    @classmethod
+    def exists(cls, path=None):
+        """Return True if an index has been built at path."""
+        return os.path.isfile(os.path.join(path or cls.default_path, "info.json"))
+
+    @classmethod
+    def default(cls):
+        """Return the index at default_path or None if it has not been built."""
+        if cls.exists():
+            try:
+                return cls()
+            except Exception as err:
+                print("Could not open the accession index:", err)
+        return None
+
+    @classmethod
+    def build(cls, source, path=None, id_type="GeneID", chunksize=1000000):
+        """Build an index from a UniProt idmapping file.
+
+        Parameters
+        ----------
+        source: str
+            A three column (accession, id type, id) tab separated idmapping
+            file, optionally gzipped.
+
+        path: str
+            Directory to write the index to. Defaults to default_path.
+            WARNING: An existing index at path is replaced.
+
+        id_type: str
+            The id type to keep. Defaults to "GeneID" (Entrez Gene ID).
+
+        chunksize: int
+            Rows of source read at once.
+
+        Returns
+        -------
+        result: AccessionIndex
+        """
+        path = path or cls.default_path
+
+        chunks = []
+        reader = pd.read_csv(source, sep="\t", header=None, names=["accession", "id_type", "id"],
+                             dtype=str, chunksize=chunksize)
+        for chunk in reader:
+            chunk = chunk.loc[chunk.id_type == id_type, ["accession", "id"]]
+            chunks.append(chunk[pd.to_numeric(chunk.id, errors="coerce").notnull()])
+
+        if len(chunks) > 0:
+            pairs = pd.concat(chunks).drop_duplicates()
+        else:
+            pairs = pd.DataFrame(columns=["accession", "id"])
+
+        ids = pairs.id.astype(np.int64)
+        # Accessions with more than one gene ID are ambiguous.
+        counts = pairs.accession.map(pairs.accession.value_counts())
+        ids = ids.where(counts == 1, cls.ambiguous)
+        mapping = pd.Series(ids.values, index=pairs.accession.values).groupby(level=0).first()
+
+        width = max(int(mapping.index.str.len().max()), 1) if mapping.shape[0] > 0 else 1
+        keys = mapping.index.values.astype("S{}".format(width))
+        order = np.argsort(keys)
+
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, "keys.npy"), keys[order])
+        np.save(os.path.join(tmp_path, "values.npy"), mapping.values.astype(np.int64)[order])
+        with open(os.path.join(tmp_path, "info.json"), "w") as f:
+            json.dump({"index_version": cls.index_version,
+                       "source": os.path.basename(str(source)),
+                       "id_type": id_type,
+                       "size": int(keys.shape[0])}, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        return cls(path)
+
+    def _search(self, accessions):
+        """Return the gene IDs of an array of accessions, -1 where missing."""
+        result = np.full(accessions.shape[0], self.ambiguous, dtype=np.int64)
+        if len(self) == 0 or accessions.shape[0] == 0:
+            return result
+
+        width = self.keys.dtype.itemsize
+        try:
+            # One byte wider than the keys to tell which accessions are too long.
+            encoded = accessions.astype("U").astype("S{}".format(width + 1))
+        except UnicodeEncodeError:
+            encoded = np.char.encode(accessions.astype("U"), "ascii", "replace").astype("S{}".format(width + 1))
+        # Accessions longer than the index keys can not be in it.
+        fits = encoded.view(np.uint8).reshape(-1, width + 1)[:, width] == 0
+        encoded = encoded.astype("S{}".format(width))
+
+        positions = np.searchsorted(self.keys, encoded)
+        positions = np.minimum(positions, len(self) - 1)
+        found = fits & (self.keys[positions] == encoded)
+        result[found] = self.values[positions[found]]
+        return result
+
+    def lookup(self, accessions, strip_isoforms=True):
+        """Return the gene IDs for many accessions.
+
+        Parameters
+        ----------
+        accessions: list-like
+            Missing values are allowed.
+
+        strip_isoforms: bool
+            If True accessions in the form XXXXXX-N that are not in the index
+            are looked up again as XXXXXX. Defaults to True.
+
+        Returns
+        -------
+        result: pandas.Series
+            Float gene IDs, NaN where the accession is missing or ambiguous.
+            Indexed like accessions if it is a Series.
+        """
+        index = accessions.index if isinstance(accessions, pd.Series) else None
+        accessions = pd.Series(np.asarray(accessions, dtype=object), index=index)
+
+        # Every distinct accession is searched once.
+        codes, values = pd.factorize(accessions)
+        values = np.asarray(values).astype("U")
+
+        ids = self._search(values)
+        if strip_isoforms:
+            retry = np.flatnonzero(ids == self.ambiguous)
+            retry = retry[np.char.find(values[retry], "-") > 0]
+            if retry.shape[0] > 0:
+                ids[retry] = self._search(np.char.partition(values[retry], "-")[:, 0])
+
+        ids = np.where(ids == self.ambiguous, np.nan, ids)
+        result = np.full(accessions.shape[0], np.nan)
+        present = codes >= 0
+        result[present] = ids[codes[present]]
+        return pd.Series(result, index=accessions.index)
+
+    def fill(self, master_index, accession_column="Accession", gene_column="EntrezGeneID"):
+        """Fill in the missing gene IDs of a master index in place.
+
+        Filled gene IDs are strings like the ones rescued from intermine.
+
+        Returns
+        -------
+        filled: int
+            The number of gene IDs that were filled in.
+        """
+        missing = master_index[gene_column].isnull()
+        found = self.lookup(master_index.loc[missing, accession_column]).dropna()
+        master_index.loc[found.index, gene_column] = found.astype(np.int64).astype(str)
+        return found.shape[0]
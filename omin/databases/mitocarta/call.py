@@ -11,9 +11,14 @@ import os
 
 from ...core.pandomics import pandas as pd
 
+from ..base import LazyClassAttribute
+
 
 class MitoCartaTwo(object):
-    """MitoCarta2 database calls."""
+    """MitoCarta2 database calls.
+
+    The database is read on first use, not when omin is imported.
+    """
 
     # Load the string for the mitocarta database.
     db_name = 'complete_mitocarta_2.p'
@@ -21,21 +26,74 @@ class MitoCartaTwo(object):
     this_dir, _ = os.path.split(__file__)
     # Create the path string.
     carta_file_path = os.path.join(this_dir, db_name)
-    # load the MitoCarta 2.0 database
-    data = pd.read_pickle(carta_file_path)
-    # Change the incorrectly labeled column from MouseGeneID to EntrezGeneID
-    data.rename(columns={"MouseGeneID": "EntrezGeneID"}, inplace=True)
-    # Collect the essential columns.
-    essential = data[["EntrezGeneID", "MitoCarta2_List", "Matrix", "IMS"]]
     # Load the modified mitocarta2.0 database.
     # ukb = 'uniprotkb_mitocarta2.p.gz'
     # ukb_file_path = os.path.join(this_dir, ukb)
     # ukb2mito = pd.read_pickle(ukb_file_path, compression='gzip')
 
+    @LazyClassAttribute
+    def data(cls):
+        """The MitoCarta 2.0 database."""
+        data = pd.read_pickle(cls.carta_file_path)
+        # Change the incorrectly labeled column from MouseGeneID to EntrezGeneID
+        data.rename(columns={"MouseGeneID": "EntrezGeneID"}, inplace=True)
+        return data
+
+    @LazyClassAttribute
+    def essential(cls):
+        """The essential columns."""
+        return cls.data[["EntrezGeneID", "MitoCarta2_List", "Matrix", "IMS"]]
+
+    @LazyClassAttribute
+    def essential_by_entrez(cls):
+        """The essential columns indexed by EntrezGeneID, ready to be joined on."""
+        return cls.essential.set_index("EntrezGeneID")
+
+    @LazyClassAttribute
+    def synonym_index(cls):
+        """Dict of synonym -> row positions in data."""
+        index = dict()
+        for position, synonyms in enumerate(cls.data.Synonyms.values):
+            for synonym in str(synonyms).split("|"):
+                index.setdefault(synonym, []).append(position)
+        return index
+
     @classmethod
-    def look_up(cls, syn_list):
-        """Look-up a given accession number in MitoCarta 2.0."""
-        return cls.data[cls.data.Synonyms.str.contains('|'.join(syn_list))]
+    def look_up(cls, syn_list, exact=True):
+        """Look-up a given accession number in MitoCarta 2.0.
+
+        Parameters
+        ----------
+        syn_list: list
+            Accession numbers, gene symbols or other synonyms.
+
+        exact: bool
+            If True synonyms are matched whole using the synonym_index.
+            Otherwise any row with a synonym containing one of the terms
+            is returned. Defaults to True.
+
+        Returns
+        -------
+        result: pandas.DataFrame
+            The matching rows of data.
+        """
+        if not exact:
+            return cls.data[cls.data.Synonyms.str.contains('|'.join(syn_list))]
+
+        positions = set()
+        for synonym in syn_list:
+            positions.update(cls.synonym_index.get(synonym, ()))
+        return cls.data.iloc[sorted(positions)]
+
+    @classmethod
+    def join(cls, entrez_gene_ids):
+        """Return the essential columns for a list of Entrez Gene IDs.
+
+        Rows are aligned with entrez_gene_ids, missing IDs get NaNs.
+        """
+        result = cls.essential_by_entrez.reindex(entrez_gene_ids)
+        result.index.name = "EntrezGeneID"
+        return result
 
 
 # class MitoCartaThree(object):
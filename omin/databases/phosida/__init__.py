@@ -0,0 +1,2 @@
+
+from .call import Phosida
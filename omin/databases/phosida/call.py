@@ -4,11 +4,23 @@
 # Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
 
 import os
+import re
 import json
 
+import numpy as np
+
+from ...core.pandomics import pandas as pd
+
+from ..base import LazyClassAttribute
+
 
 class Phosida(object):
     """Load phosphorylation motifs from phosida.
+
+    The motifs are read on first use and compiled once into the motifs
+    table. Modified sites are annotated in bulk with annotate_sites, which
+    returns a table indexed by (Accession, Position) so that lookups by
+    accession or by site are index lookups.
     """
     # Load the string for the phosida database.
     db_name = 'phosida/phosida_annotated.json'
@@ -16,5 +28,131 @@ class Phosida(object):
     this_dir, _ = os.path.split(__file__)
     # Create the path string.
     file_path = os.path.join(this_dir, db_name)
-    # Load the JSON database.
-    data = json.load(open(file_path, "r"))
+
+    # Character that pads the sequences, '.' in a motif does not match it.
+    pad = "\n"
+
+    @LazyClassAttribute
+    def data(cls):
+        """The JSON database as a dict of kinase -> motifs."""
+        with open(cls.file_path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _parse_motif(motif):
+        """Return the regex, the offset of the modified residue and its residues for a motif.
+
+        The modified residue is marked in bold e.g. "R.<b>[ST]</b>".
+        """
+        tokens = re.findall(r"<b>|</b>|\[[^\]]*\]?|[^\[<]", motif)
+        regex = []
+        offset = None
+        residues = None
+        for token in tokens:
+            if token == "<b>":
+                offset = len(regex)
+            elif token == "</b>":
+                continue
+            else:
+                token = token.replace("</b>", "")
+                if token.startswith("[") and not token.endswith("]"):
+                    token = token + "]"
+                if offset == len(regex):
+                    residues = token.strip("[]")
+                regex.append(token)
+        return "".join(regex), offset, residues
+
+    @LazyClassAttribute
+    def motifs(cls):
+        """DataFrame of kinase, motif, regex, offset and residues, one row per motif."""
+        rows = []
+        for kinase, motifs in cls.data.items():
+            for motif in motifs:
+                regex, offset, residues = cls._parse_motif(motif)
+                rows.append([kinase, motif, regex, offset, residues])
+        return pd.DataFrame(rows, columns=["kinase", "motif", "regex", "offset", "residues"])
+
+    @classmethod
+    def kinases(cls):
+        """Return the kinase names in the order of the database."""
+        return list(cls.data.keys())
+
+    @classmethod
+    def by_kinase(cls, kinase):
+        """Return the motifs of a kinase."""
+        return cls.motifs.loc[cls.motifs.kinase == kinase]
+
+    @classmethod
+    def by_residue(cls, residue):
+        """Return the motifs that can be modified on a residue e.g. "S"."""
+        return cls.motifs.loc[cls.motifs.residues.str.contains(residue, regex=False)]
+
+    @classmethod
+    def _windows(cls, sequences, sites):
+        """Return the sequence windows around every site as a numpy array of strings.
+
+        The site is at position width of every window.
+        """
+        width = int(max(len(re.findall(r"\[[^\]]*\]|.", i)) for i in cls.motifs.regex))
+        pad = cls.pad * width
+
+        accessions = pd.Index(sites.Accession.unique())
+        # One padded string with every protein, and the start of each protein in it.
+        known = [i in sequences for i in accessions]
+        proteins = [pad + (sequences[i] if k else "") for i, k in zip(accessions, known)]
+        starts = np.cumsum([0] + [len(i) for i in proteins[:-1]]) + width
+        joined = np.frombuffer(("".join(proteins) + pad).encode(), dtype=np.uint8)
+
+        lengths = np.array([len(sequences[i]) if k else 0 for i, k in zip(accessions, known)])
+        codes = accessions.get_indexer(sites.Accession)
+        positions = sites.Position.values.astype(np.int64) - 1
+        valid = (positions >= 0) & (positions < lengths[codes])
+
+        # Invalid sites read the leading pad and are blanked below.
+        centers = np.where(valid, starts[codes] + positions, width)
+        windows = joined[centers[:, None] + np.arange(-width, width + 1)]
+        windows[~valid] = ord(cls.pad)
+        windows = np.ascontiguousarray(windows).view("S{}".format(2 * width + 1)).ravel()
+        return np.char.decode(windows), width, valid
+
+    @classmethod
+    def annotate_sites(cls, sequences, sites):
+        """Return which kinase motifs match each modified site.
+
+        Every motif is matched against all of the site windows at once.
+
+        Parameters
+        ----------
+        sequences: dict or pandas.Series
+            Accession -> protein sequence.
+
+        sites: pandas.DataFrame
+            With the columns Accession and Position (1 based, as in the
+            Positions in Proteins column of Proteome Discoverer).
+
+        Returns
+        -------
+        result: pandas.DataFrame
+            Indexed by (Accession, Position) with a Residue column and one
+            boolean column per kinase. Sites whose accession or position is
+            not in sequences have an empty Residue and no matches.
+            Use result.loc[accession] or result.loc[(accession, position)]
+            to look sites up.
+        """
+        sites = sites[["Accession", "Position"]].reset_index(drop=True)
+        windows, width, valid = cls._windows(sequences, sites)
+        windows = pd.Series(windows, dtype=object)
+
+        residues = windows.str[width].where(valid, "")
+        result = pd.DataFrame(False, index=sites.index, columns=cls.kinases())
+        for motif in cls.motifs.itertuples():
+            candidates = valid & residues.str.contains("[{}]".format(motif.residues)).values
+            if not candidates.any():
+                continue
+            # Align the modified residue of the motif with the site.
+            matches = windows[candidates].str.slice(width - motif.offset).str.match(motif.regex)
+            result.loc[candidates, motif.kinase] |= matches.values.astype(bool)
+
+        result.insert(0, "Residue", residues.values)
+        result.index = pd.MultiIndex.from_frame(sites)
+        return result
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""omin.stats.kernels
+
+Provides
+--------
+Vectorized NumPy kernels for the statistics used throughout omin.
+
+The kernels work on plain 2-D float arrays (rows x samples) where missing
+values are NaNs. Comparisons are given as pairs of column positions so that
+many comparisons over the same sample matrix share their per group means and
+variances.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import numpy as np
+from scipy import special
+
+
+def group_moments(matrix, columns):
+    """Return the per row count, mean and variance of a group of columns.
+
+    Missing values (NaNs) are ignored. Rows with fewer than two observations
+    get a NaN variance, rows without observations get a NaN mean.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        2-D array of rows x samples.
+
+    columns : list-like
+        Column positions of the group.
+
+    Returns
+    -------
+    n : numpy.ndarray
+        Number of observations per row.
+
+    mean : numpy.ndarray
+
+    var : numpy.ndarray
+        Unbiased (ddof=1) variance.
+    """
+    values = matrix[:, np.asarray(columns, dtype=np.intp)]
+    present = ~np.isnan(values)
+    n = present.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(present, values, 0).sum(axis=1) / n
+        deviation = np.where(present, values - mean[:, None], 0)
+        var = (deviation ** 2).sum(axis=1) / (n - 1)
+    var[n < 2] = np.nan
+    return n, mean, var
+
+
+def ttest_from_moments(n1, mean1, var1, n2, mean2, var2, equal_var=True):
+    """Return the t statistic, degrees of freedom and two sided p-value.
+
+    Parameters
+    ----------
+    n1, mean1, var1 : numpy.ndarray
+        Moments of the numerator group, see group_moments.
+
+    n2, mean2, var2 : numpy.ndarray
+        Moments of the denominator group.
+
+    equal_var : bool
+        If True use Student's pooled variance t-test, otherwise Welch's
+        t-test. Defaults to True like scipy.stats.ttest_ind.
+
+    Returns
+    -------
+    t : numpy.ndarray
+
+    df : numpy.ndarray
+
+    pvalue : numpy.ndarray
+    """
+    n1 = n1.astype(np.float64)
+    n2 = n2.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if equal_var:
+            df = n1 + n2 - 2
+            pooled = ((n1 - 1) * var1 + (n2 - 1) * var2) / df
+            se = np.sqrt(pooled * (1 / n1 + 1 / n2))
+        else:
+            v1 = var1 / n1
+            v2 = var2 / n2
+            df = (v1 + v2) ** 2 / (v1 ** 2 / (n1 - 1) + v2 ** 2 / (n2 - 1))
+            se = np.sqrt(v1 + v2)
+        t = (mean1 - mean2) / se
+        pvalue = 2 * special.stdtr(df, -np.abs(t))
+    return t, df, pvalue
+
+
+def ttest_batch(matrix, comparisons, equal_var=True, min_n=None):
+    """Return fold changes and t-tests for many comparisons in one pass.
+
+    The moments of every distinct group of columns are computed once and
+    shared by all the comparisons that use that group.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        2-D array of rows x samples, usually Log2 normalized abundances.
+
+    comparisons : list
+        In the format: [[numerator_columns, denominator_columns],...] where
+        the columns are positions in matrix.
+
+    equal_var : bool
+        Student's t-test if True (the default) otherwise Welch's t-test.
+
+    min_n : int or None
+        If None a row with any missing value in either group gets a NaN
+        p-value, like scipy.stats.ttest_ind. Otherwise the available values
+        are used as long as both groups have at least min_n observations.
+
+    Returns
+    -------
+    result : dict
+        With the keys "fold_change", "t", "df", "pvalue", "n_numerator" and
+        "n_denominator". Each value is a rows x comparisons array. Fold
+        changes are the difference of the group means over the available
+        values.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim != 2:
+        raise ValueError("matrix must be 2-D, got {} dimensions.".format(matrix.ndim))
+
+    shape = (matrix.shape[0], len(comparisons))
+    result = dict((k, np.full(shape, np.nan)) for k in ["fold_change", "t", "df", "pvalue"])
+    result["n_numerator"] = np.zeros(shape, dtype=np.int64)
+    result["n_denominator"] = np.zeros(shape, dtype=np.int64)
+
+    moments = dict()
+
+    def get_moments(columns):
+        key = tuple(int(i) for i in columns)
+        if key not in moments:
+            moments[key] = group_moments(matrix, key)
+        return key, moments[key]
+
+    for j, (numerator, denominator) in enumerate(comparisons):
+        key1, (n1, mean1, var1) = get_moments(numerator)
+        key2, (n2, mean2, var2) = get_moments(denominator)
+
+        t, df, pvalue = ttest_from_moments(n1, mean1, var1, n2, mean2, var2, equal_var=equal_var)
+
+        if min_n is None:
+            valid = (n1 == len(key1)) & (n2 == len(key2))
+        else:
+            valid = (n1 >= min_n) & (n2 >= min_n)
+
+        result["fold_change"][:, j] = mean1 - mean2
+        result["t"][:, j] = np.where(valid, t, np.nan)
+        result["df"][:, j] = np.where(valid, df, np.nan)
+        result["pvalue"][:, j] = np.where(valid, pvalue, np.nan)
+        result["n_numerator"][:, j] = n1
+        result["n_denominator"][:, j] = n2
+
+    return result
+
+
+def ttest_two_sample(left, right, equal_var=True, min_n=None):
+    """Return the t statistic and p-value of two row aligned 2-D arrays.
+
+    Parameters
+    ----------
+    left : numpy.ndarray
+
+    right : numpy.ndarray
+
+    equal_var : bool
+
+    min_n : int or None
+        See ttest_batch.
+
+    Returns
+    -------
+    t : numpy.ndarray
+
+    pvalue : numpy.ndarray
+    """
+    left = np.asarray(left, dtype=np.float64)
+    right = np.asarray(right, dtype=np.float64)
+    matrix = np.concatenate([left, right], axis=1)
+    numerator = np.arange(left.shape[1])
+    denominator = np.arange(left.shape[1], matrix.shape[1])
+    result = ttest_batch(matrix, [[numerator, denominator]], equal_var=equal_var, min_n=min_n)
+    return result["t"][:, 0], result["pvalue"][:, 0]
+
+
+def trigamma_inverse(x):
+    """Return y such that trigamma(y) == x, solved by Newton iteration.
+
+    Port of limma's trigammaInverse.
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+    y = np.full(x.shape, np.nan)
+    large = x > 1e7
+    small = x < 1e-6
+    middle = ~large & ~small & np.isfinite(x) & (x > 0)
+    y[large] = 1 / np.sqrt(x[large])
+    y[small] = 1 / x[small]
+
+    if middle.any():
+        target = x[middle]
+        y0 = 0.5 + 1 / target
+        for _ in range(50):
+            tri = special.polygamma(1, y0)
+            dif = tri * (1 - tri / target) / special.polygamma(2, y0)
+            y0 = y0 + dif
+            if np.max(-dif / y0) < 1e-8:
+                break
+        y[middle] = y0
+    return y
+
+
+def fit_f_dist(var, df):
+    """Return the prior variance and degrees of freedom of a scaled F distribution.
+
+    Moment estimates of the empirical Bayes prior used by squeeze_var. Port
+    of limma's fitFDist without covariates.
+
+    Parameters
+    ----------
+    var : numpy.ndarray
+        Per row residual variances.
+
+    df : numpy.ndarray
+        Per row residual degrees of freedom.
+
+    Returns
+    -------
+    var_prior : float
+
+    df_prior : float
+        numpy.inf when the variances show no more spread than expected by
+        chance, in which case every row is shrunk to var_prior.
+    """
+    var = np.asarray(var, dtype=np.float64)
+    df = np.broadcast_to(np.asarray(df, dtype=np.float64), var.shape)
+    ok = np.isfinite(df) & (df > 1e-15) & np.isfinite(var) & (var > -1e-15)
+    var = var[ok]
+    df = df[ok]
+
+    if var.size == 0:
+        return np.nan, np.nan
+    if var.size == 1:
+        return float(var[0]), 0.
+
+    var = np.maximum(var, 0)
+    median = np.median(var)
+    if median == 0:
+        median = 1.
+    var = np.maximum(var, 1e-5 * median)
+
+    e = np.log(var) - special.digamma(df / 2) + np.log(df / 2)
+    e_mean = e.mean()
+    e_var = ((e - e_mean) ** 2).sum() / (e.size - 1) - special.polygamma(1, df / 2).mean()
+
+    if e_var > 0:
+        df_prior = 2 * trigamma_inverse(e_var)[0]
+        var_prior = np.exp(e_mean + special.digamma(df_prior / 2) - np.log(df_prior / 2))
+    else:
+        df_prior = np.inf
+        var_prior = np.exp(e_mean)
+    return float(var_prior), float(df_prior)
+
+
+def squeeze_var(var, df):
+    """Return the posterior variances and the prior used to compute them.
+
+    Each variance is shrunk towards a common prior fitted to all rows, see
+    fit_f_dist. Rows without residual degrees of freedom get the prior.
+
+    Returns
+    -------
+    var_post : numpy.ndarray
+
+    var_prior : float
+
+    df_prior : float
+    """
+    var = np.asarray(var, dtype=np.float64)
+    df = np.broadcast_to(np.asarray(df, dtype=np.float64), var.shape)
+    var_prior, df_prior = fit_f_dist(var, df)
+
+    var = np.where(df == 0, 0, var)
+    if np.isinf(df_prior):
+        var_post = np.full(var.shape, var_prior)
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var_post = (df * var + df_prior * var_prior) / (df + df_prior)
+    return var_post, var_prior, df_prior
+
+
+def moderated_ttest_batch(matrix, comparisons, min_n=None):
+    """Return fold changes and moderated t-tests for many comparisons in one pass.
+
+    Every comparison is fitted as a two group linear model over all rows at
+    once. The residual variances are shrunk towards a prior fitted across the
+    rows (limma's eBayes), which gives more stable statistics when there are
+    only a few replicates per group.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray
+        2-D array of rows x samples, usually Log2 normalized abundances.
+
+    comparisons : list
+        In the format: [[numerator_columns, denominator_columns],...] where
+        the columns are positions in matrix.
+
+    min_n : int or None
+        If None only rows without missing values are tested. Otherwise the
+        available values are used as long as both groups have at least min_n
+        observations. With min_n=1 rows without replicates still get a
+        p-value from the prior variance.
+
+    Returns
+    -------
+    result : dict
+        With the keys "fold_change", "t", "df", "pvalue", "var_post",
+        "n_numerator" and "n_denominator", each a rows x comparisons array,
+        and "var_prior" and "df_prior", each an array of one value per
+        comparison.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.ndim != 2:
+        raise ValueError("matrix must be 2-D, got {} dimensions.".format(matrix.ndim))
+
+    shape = (matrix.shape[0], len(comparisons))
+    result = dict((k, np.full(shape, np.nan)) for k in ["fold_change", "t", "df", "pvalue", "var_post"])
+    result["n_numerator"] = np.zeros(shape, dtype=np.int64)
+    result["n_denominator"] = np.zeros(shape, dtype=np.int64)
+    result["var_prior"] = np.full(len(comparisons), np.nan)
+    result["df_prior"] = np.full(len(comparisons), np.nan)
+
+    moments = dict()
+
+    def get_moments(columns):
+        key = tuple(int(i) for i in columns)
+        if key not in moments:
+            moments[key] = group_moments(matrix, key)
+        return key, moments[key]
+
+    for j, (numerator, denominator) in enumerate(comparisons):
+        key1, (n1, mean1, var1) = get_moments(numerator)
+        key2, (n2, mean2, var2) = get_moments(denominator)
+
+        if min_n is None:
+            valid = (n1 == len(key1)) & (n2 == len(key2))
+        else:
+            valid = (n1 >= max(min_n, 1)) & (n2 >= max(min_n, 1))
+
+        # Residual variance and degrees of freedom of the two group model.
+        df_residual = (n1 + n2 - 2).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            residual = (np.where(n1 > 1, (n1 - 1) * var1, 0) + np.where(n2 > 1, (n2 - 1) * var2, 0)) / df_residual
+        residual[df_residual < 1] = np.nan
+        df_residual[~valid] = np.nan
+
+        var_post, var_prior, df_prior = squeeze_var(np.where(valid, residual, np.nan),
+                                                    np.where(valid, np.maximum(df_residual, 0), np.nan))
+
+        # The total degrees of freedom can not exceed the pooled residual degrees of freedom.
+        df_total = np.minimum(df_residual + df_prior, np.nansum(df_residual))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = (mean1 - mean2) / np.sqrt(var_post * (1. / n1 + 1. / n2))
+            pvalue = 2 * special.stdtr(df_total, -np.abs(t))
+
+        result["fold_change"][:, j] = mean1 - mean2
+        result["t"][:, j] = np.where(valid, t, np.nan)
+        result["df"][:, j] = np.where(valid, df_total, np.nan)
+        result["pvalue"][:, j] = np.where(valid, pvalue, np.nan)
+        result["var_post"][:, j] = np.where(valid, var_post, np.nan)
+        result["n_numerator"][:, j] = n1
+        result["n_denominator"][:, j] = n2
+        result["var_prior"][j] = var_prior
+        result["df_prior"][j] = df_prior
+
+    return result
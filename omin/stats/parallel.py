@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""omin.stats.parallel
+
+Provides
+--------
+Fan out of independent t-test batches over a pool of workers.
+
+Each job is a 2-D sample matrix and a list of comparisons (see
+omin.stats.kernels.ttest_batch). Matrices are copied once into shared memory
+and every worker attaches to them by name, so only the comparison column
+positions and the results travel between processes. On Pythons without
+multiprocessing.shared_memory (< 3.8) the matrices are pickled instead.
+"""
+# Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import kernels
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class _SharedMatrix(object):
+    """Picklable reference to a float64 matrix held in shared memory."""
+
+    def __init__(self, matrix):
+        matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        self.shape = matrix.shape
+        self._shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        self.name = self._shm.name
+        np.ndarray(self.shape, dtype=np.float64, buffer=self._shm.buf)[:] = matrix
+
+    def __getstate__(self):
+        return {"shape": self.shape, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+
+    def release(self):
+        """Free the shared memory block, only called by the creating process."""
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _ttest_job(matrix, comparisons, equal_var, min_n):
+    """Run one ttest_batch, attaching to the matrix if it is shared."""
+    if not isinstance(matrix, _SharedMatrix):
+        return kernels.ttest_batch(matrix, comparisons, equal_var=equal_var, min_n=min_n)
+
+    shm = shared_memory.SharedMemory(name=matrix.name)
+    values = None
+    try:
+        values = np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)
+        return kernels.ttest_batch(values, comparisons, equal_var=equal_var, min_n=min_n)
+    finally:
+        del values
+        shm.close()
+
+
+def _chunks(comparisons, n):
+    """Split comparisons into at most n contiguous, non empty runs."""
+    if len(comparisons) == 0:
+        return []
+    n = max(1, min(n, len(comparisons)))
+    bounds = np.linspace(0, len(comparisons), n + 1).astype(int)
+    return [comparisons[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _concat_results(parts):
+    """Join the per comparison results of one job back together."""
+    return dict((k, np.concatenate([i[k] for i in parts], axis=1)) for k in parts[0])
+
+
+def ttest_batches(jobs, n_jobs=None, executor=None, equal_var=True, min_n=None):
+    """Return ttest_batch results for many (matrix, comparisons) jobs.
+
+    Every job is one task, so its comparisons share the group moments
+    computed by ttest_batch. If there are fewer jobs than workers the
+    comparisons of a job are split into contiguous chunks, one per spare
+    worker.
+
+    Parameters
+    ----------
+    jobs : list
+        In the format: [(matrix, comparisons),...] see kernels.ttest_batch.
+
+    n_jobs : int or None
+        Number of worker processes. None or 1 runs serially in this process,
+        -1 uses every core. With an executor it is the number of its workers
+        the comparisons are split over, None submits one task per job.
+
+    executor : concurrent.futures.Executor
+        An existing executor to submit the tasks to. It is not shut down.
+
+    equal_var : bool
+
+    min_n : int or None
+
+    Returns
+    -------
+    results : list
+        One ttest_batch result dict per job.
+    """
+    if executor is None and (n_jobs is None or n_jobs == 1):
+        return [kernels.ttest_batch(m, c, equal_var=equal_var, min_n=min_n) for m, c in jobs]
+
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    shared = []
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+    # Without n_jobs the size of a given executor is unknown, every job is then one task.
+    per_job = -(-(n_jobs or 1) // max(len(jobs), 1))
+
+    try:
+        futures = []
+        for matrix, comparisons in jobs:
+            matrix = np.asarray(matrix, dtype=np.float64)
+            if shared_memory is not None:
+                matrix = _SharedMatrix(matrix)
+                shared.append(matrix)
+            futures.append([executor.submit(_ttest_job, matrix, chunk, equal_var, min_n)
+                            for chunk in _chunks(list(comparisons), per_job)])
+
+        results = []
+        for (matrix, comparisons), parts in zip(jobs, futures):
+            if len(parts) == 0:
+                results.append(kernels.ttest_batch(matrix, [], equal_var=equal_var, min_n=min_n))
+            else:
+                results.append(_concat_results([i.result() for i in parts]))
+        return results
+
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+        for matrix in shared:
+            matrix.release()
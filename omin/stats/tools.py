@@ -11,11 +11,12 @@ import numpy as np
 # from pandomics import pandas as pd
 from ..core.pandomics import pandas as pd
 
-from scipy.stats import ttest_ind
 from scipy.stats import f_oneway
 import functools
 from statsmodels.sandbox.stats.multicomp import multipletests
 
+from . import kernels
+
 
 class Compare(object):
     """Tools for comparisons."""
@@ -74,13 +75,7 @@ class Compare(object):
         """
         if len(new_column_name) > 0:
             new_column_name = " "+new_column_name
-        # The loop below suppresses an irrelevent error message.
-        # For more details on this see:
-        # http://stackoverflow.com/questions/40452765/invalid-value-in-less-when-comparing-np-nan-in-an-array
-        with np.errstate(invalid='ignore'):
-            np.less([np.nan, 0], 1)
-            # ttest_ind implemented
-            pvals = ttest_ind(numer, denom, axis=1).pvalue
+        _, pvals = kernels.ttest_two_sample(numer.values, denom.values)
         pvals = pd.DataFrame(pvals,
                              columns=["pval"+new_column_name],
                              index=numer.index)
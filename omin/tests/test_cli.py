@@ -0,0 +1,57 @@
+import os
+import json
+import tempfile
+
+from ..cli.batch import Manifest, BatchRun
+
+
+class StubRun(BatchRun):
+    """Writes the outputs without running Process."""
+    processed = []
+
+    @classmethod
+    def _process(cls, job):
+        cls.processed.append(job["name"])
+        os.makedirs(job["output"], exist_ok=True)
+        for path in cls.output_files(job).values():
+            with open(path, "w") as f:
+                f.write("stub")
+
+
+def test_batch_run_skips_unchanged_jobs():
+    tmp = tempfile.mkdtemp()
+    for name in ["peptides.txt", "proteins.txt"]:
+        with open(os.path.join(tmp, name), "w") as f:
+            f.write(name)
+
+    manifest = {"defaults": {"peptides_file": "peptides.txt", "proteins_file": "proteins.txt",
+                             "comparisons": [["KO", "WT"]]},
+                "jobs": [{"output": "out/a"}, {"output": "out/b", "selected_mod": "Acetyl"}]}
+    manifest_path = os.path.join(tmp, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    jobs = Manifest.load(manifest_path)
+    assert [i["name"] for i in jobs] == ["a", "b"]
+    assert jobs[0]["peptides_file"] == os.path.join(tmp, "peptides.txt")
+
+    log = []
+    results = StubRun.run(jobs, log=log.append)
+    assert [i["status"] for i in results] == ["done", "done"]
+    assert os.path.exists(os.path.join(tmp, "out", "b", "peptide_groups.csv"))
+    assert len(log) == 3
+
+    results = StubRun.run(jobs, log=log.append)
+    assert [i["status"] for i in results] == ["skipped", "skipped"]
+
+    # Changing an input or a setting reruns the job.
+    with open(os.path.join(tmp, "proteins.txt"), "w") as f:
+        f.write("changed")
+    jobs[1]["comparisons"] = [["WT", "KO"]]
+    StubRun.processed = []
+    results = StubRun.run(jobs[:1], log=log.append) + StubRun.run(jobs[1:], force=True, log=log.append)
+    assert [i["status"] for i in results] == ["done", "done"]
+    assert StubRun.processed == ["a", "b"]
+
+    jobs[0]["peptides_file"] = os.path.join(tmp, "missing.txt")
+    assert StubRun.run(jobs[:1], log=log.append)[0]["status"] == "failed"
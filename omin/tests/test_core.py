@@ -2,6 +2,8 @@
 import os
 from glob import glob
 
+import pandas
+
 from ..core import containers
 from ..core import handles
 
@@ -29,3 +31,574 @@ def test_containers_proteins():
 def test_handles_process():
     process = handles.Process(file_list=mcd_def_malonylation_file_list)
     assert type(process) != None
+
+
+def _write_exports(tmpdir):
+    """Return the paths of a small Peptide Groups and Proteins export pair.
+
+    Two fractions (Input and Acetyl) of four channels, KO KO WT WT. P2 is the
+    master protein of the last two peptides but comes second in their
+    Positions in Proteins.
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(0)
+    columns = ["Abundance: {}: {}, Sample, {} (Genotype), {} (Fraction)".format(fn, tag, genotype, fraction)
+               for fn, fraction in [("F1", "Input"), ("F2", "Acetyl")]
+               for tag, genotype in zip(["126", "127", "128", "129"], ["KO", "KO", "WT", "WT"])]
+
+    proteins = pandas.DataFrame(rng.lognormal(10, 1, (3, 8)), columns=columns)
+    proteins.insert(0, "Master", "IsMasterProtein")
+    proteins.insert(1, "Accession", ["P1", "P2", "P3"])
+    proteins.insert(2, "Description", ["Protein {0} OS=Mus musculus GN=Gene{0} PE=1".format(i) for i in range(3)])
+    proteins.insert(3, "Entrez Gene ID", ["66445", "18597", "900000"])
+    proteins.insert(4, "Exp. q-value", [.001, .002, .003])
+    proteins.insert(5, "# Peptides", [2, 2, 1])
+
+    peptides = pandas.DataFrame(rng.lognormal(10, 1, (5, 8)), columns=columns)
+    peptides.insert(0, "Master Protein Accessions", ["P1", "P1", "P3", "P2; P1", "P2; P1"])
+    peptides.insert(1, "Sequence", ["AKR", "GAKR", "MSKAR", "PEKTK", "PEKTK"])
+    peptides.insert(2, "Modifications", ["1xTMT6plex [N-Term]; 1xAcetyl [K2(99.0)]",
+                                         "1xTMT6plex [N-Term]; 1xAcetyl [K3(98.0)]",
+                                         "1xTMT6plex [N-Term]; 1xOxidation [M1]",
+                                         "1xTMT6plex [N-Term]; 1xAcetyl [K3(97.0)]",
+                                         "1xTMT6plex [N-Term]; 2xAcetyl [K3(95.0); K5(90.0)]"])
+    peptides.insert(3, "Modifications in Proteins", np.nan)
+    peptides.insert(4, "Positions in Proteins", ["P1 [10-12]", "P1 [9-12]", "P3 [1-5]",
+                                                 "P1 [40-44]; P2 [20-24]", "P1 [40-44]; P2 [20-24]"])
+
+    paths = [str(tmpdir.join("Test_PeptideGroups.txt")), str(tmpdir.join("Test_Proteins.txt"))]
+    peptides.to_csv(paths[0], sep="\t", index=False)
+    proteins.to_csv(paths[1], sep="\t", index=False)
+    return paths
+
+
+def test_store_round_trip():
+    import tempfile
+    from ..core.base import Handle
+    from ..core.containers import Normalized
+    from ..core.store import ProjectStore
+
+    handle = Handle()
+    handle.raw = pandas.DataFrame({"Accession": ["P12345", "Q67890"], "Abundance: F1: 126": [1.0, 2.0]})
+    handle.load_normalized = Normalized(_input=handle.raw[["Abundance: F1: 126"]])
+    handle.metadata["total_ids"] = 2
+
+    path = os.path.join(tempfile.mkdtemp(), "project.omin")
+    ProjectStore.dump(handle, path)
+    loaded = ProjectStore.load(path)
+
+    assert "raw" not in loaded.__dict__
+    assert loaded.metadata["total_ids"] == 2
+    pandas.testing.assert_frame_equal(loaded.raw, handle.raw)
+    pandas.testing.assert_frame_equal(loaded.load_normalized._input, handle.load_normalized._input)
+
+
+def test_study_design():
+    from ..core.design import StudyDesign
+
+    columns = ["Abundance: {}: {}, Sample, {} (Genotype), {} (Fraction)".format(fn, tag, genotype, fraction)
+               for fn, fraction in [("F1", "Input"), ("F2", "Acetyl")]
+               for tag, genotype in [("126", "KO"), ("127", "KO"), ("128", "WT"), ("129", "WT")]]
+    design = StudyDesign(columns)
+
+    assert design.matches(columns)
+    assert design.tmt_plex_number == 4
+    assert design.input_number == 1
+    assert design.study_factor_with_input == "Fraction"
+    assert design.fraction_tags == {"F1": "_input", "F2": "_acetyl"}
+    assert design.study_factor_dict["Genotype"] == ["KO (Genotype)", "WT (Genotype)"]
+
+
+def test_first_member():
+    series = pandas.Series(["P1; P2", "nan", float("nan"), "P3"], index=list("abcd"), name="Accession")
+    result = series.first_member()
+    assert result.tolist()[:2] == ["P1", "nan"]
+    assert pandas.isna(result["c"]) and result["d"] == "P3"
+    assert result.name == "Accession"
+
+    # Non string values are returned as strings.
+    assert pandas.Series(["1; 2", 3.0]).first_member().tolist() == ["1", "3.0"]
+
+
+def test_first_member_without_pyarrow():
+    import sys
+    import subprocess
+
+    # A fresh interpreter where importing pyarrow fails.
+    script = ("import sys; sys.modules['pyarrow'] = None; "
+              "from omin.core.pandomics import pandas, pyarrow; "
+              "print(pyarrow, pandas.Series(['P1; P2', float('nan'), 'P3']).first_member().tolist())")
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, "-c", script], env=env).decode().split("\n")
+    assert "None ['P1', nan, 'P3']" in output
+
+
+def test_mitocarta_look_up():
+    from ..databases import MitoCartaTwo
+
+    first = MitoCartaTwo.data.iloc[0]
+    synonym = first.Synonyms.split("|")[0]
+
+    result = MitoCartaTwo.look_up([synonym, "not a synonym"])
+    assert first.EntrezGeneID in result.EntrezGeneID.values
+    assert result.shape[0] <= MitoCartaTwo.look_up([synonym], exact=False).shape[0]
+
+    joined = MitoCartaTwo.join([first.EntrezGeneID, -1])
+    assert joined.MitoCarta2_List.iloc[0] == first.MitoCarta2_List
+    assert joined.iloc[1].isnull().all()
+
+
+def test_phosida_annotate_sites():
+    from ..databases.phosida import Phosida
+
+    sequences = {"X1": "AARAASPAAKRTAAEYAAL", "X2": "MSPEK"}
+    sites = pandas.DataFrame({"Accession": ["X1", "X1", "X2", "X3"], "Position": [6, 16, 2, 4]})
+
+    result = Phosida.annotate_sites(sequences, sites)
+    # R..[ST] and Y..[ILVM]
+    assert result.loc[("X1", 6), "CAMK2"] and result.loc[("X1", 16), "ALK"]
+    assert result.loc[("X2", 2), "CDK1"] and not result.loc[("X2", 2), "PKA"]
+    assert result.loc["X1"].Residue.tolist() == ["S", "Y"]
+    # Unknown proteins have no matches.
+    assert not result.loc[("X3", 4)].iloc[1:].any()
+
+
+def test_modification_index():
+    from ..core.modifications import ModificationIndex
+
+    modifications = pandas.Series(["1xTMT6plex [N-Term]; 1xAcetyl [K18(92.7)]", None, "",
+                                   "1xTMT6plex [N-Term]; 2xOxidation [M3; M8]",
+                                   "1xTMT6plex [N-Term]; 1xAcetyl [K18(92.7)]"], index=list("abcde"))
+    index = ModificationIndex(modifications)
+    assert index.types == ["TMT6plex", "Acetyl", "Oxidation"]
+    assert index.incidence.toarray().tolist() == [[1, 1, 0], [0, 0, 0], [0, 0, 0], [1, 0, 2], [1, 1, 0]]
+    assert index.mask("Acetyl").tolist() == modifications.fillna("").str.contains("Acetyl").tolist()
+    assert list(index.mask("Acetyl").index) == list("abcde")
+    assert index.counts().to_dict() == {"TMT6plex": 3, "Acetyl": 2, "Oxidation": 1}
+
+    sites = index.sites
+    assert sites.peptide.tolist() == [0, 0, 3, 3, 3, 4, 4]
+    assert sites.residue.tolist() == ["N-Term", "K", "N-Term", "M", "M", "N-Term", "K"]
+    assert sites.position.tolist() == [-1, 18, -1, 3, 8, -1, 18]
+    assert sites.probability[1] == 92.7
+
+
+def test_site_index_aggregate():
+    import numpy as np
+    from ..core.sites import SiteIndex
+
+    # Peptide 1 covers two sites, site (P1, K, 5) is covered by peptides 0 and 1.
+    sites = pandas.DataFrame({"Accession": ["P1", "P1", "P1", "P2", None],
+                              "Residue": ["K", "K", "K", "S", "K"],
+                              "ProteinPosition": [5, 5, 9, 3, 1],
+                              "Modification": ["Acetyl"] * 4 + [None]})
+    index = SiteIndex([0, 1, 1, 2, 3], sites)
+    assert index.keys.index.tolist() == [("P1", "K", 5), ("P1", "K", 9), ("P2", "S", 3)]
+    assert index.keys.Peptides.tolist() == [2, 1, 1]
+
+    values = np.array([[1., np.nan], [3., 4.], [np.nan, np.nan], [7., 8.]])
+    np.testing.assert_array_equal(index.aggregate(values, "sum"), [[4., 4.], [3., 4.], [np.nan, np.nan]])
+    np.testing.assert_array_equal(index.aggregate(values, "median"), [[2., 4.], [3., 4.], [np.nan, np.nan]])
+    np.testing.assert_array_equal(index.aggregate(values, "max_intensity"), [[3., 4.], [3., 4.], [np.nan, np.nan]])
+
+
+def test_abundance_cube_normalize():
+    import numpy as np
+    from ..core.normalization import AbundanceCube
+
+    rng = np.random.RandomState(0)
+    abundance = pandas.DataFrame(rng.lognormal(10, 1, (40, 5)),
+                                 columns=["F1: 127", "F1: 126", "F2: 127", "F2: 126", "F3: 126"])
+    abundance.iloc[3, 1] = np.nan
+    cube = AbundanceCube(abundance, {"F1": [0, 1], "F2": [2, 3], "F3": [4]})
+    assert cube.values.shape == (3, 40, 2)
+    assert cube.columns[0] == ["F1: 126", "F1: 127"] and cube.columns[2] == ["F3: 126", None]
+
+    # F2 is normalized to F1 and F1 to itself like pandomics.normalize_to.
+    link = [0, 0, 2]
+    frames = cube.frames(cube.normalize("sum", link=link), names={"F1": "_f1", "F2": "_f2"}, link=link)
+    assert list(frames) == ["_f1", "_f2"]
+    pandas.testing.assert_frame_equal(frames["_f2"], abundance.iloc[:, 2:4].normalize_to(abundance.iloc[:, :2]))
+    pandas.testing.assert_frame_equal(frames["_f1"], abundance.iloc[:, :2].normalize_to(abundance.iloc[:, :2]))
+
+    # The padded channel is ignored, F3 has a single channel.
+    np.testing.assert_allclose(cube.normalize("median")[2, :, 0], abundance["F3: 126"] / 1.)
+    medians = np.nanmedian(cube.normalize("median")[:2], axis=1)
+    np.testing.assert_allclose(medians, medians[:, :1].repeat(2, axis=1))
+
+    from scipy.stats import trim_mean
+    statistic = cube._column_statistic("trimmed_mean", trim=.1)
+    np.testing.assert_allclose(statistic[1], trim_mean(cube.values[1], .1, axis=0))
+
+    quantile = cube.normalize("quantile")
+    np.testing.assert_allclose(np.sort(quantile[1, :, 0]), np.sort(quantile[1, :, 1]))
+    assert np.isnan(quantile[0, 3, 0]) and np.isnan(quantile[2, :, 1]).all()
+
+    # The all NaN padded channel does not warn.
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        for method in AbundanceCube.methods:
+            cube.normalize(method)
+
+
+def test_multiplex_irs(tmpdir):
+    import numpy as np
+    from ..core.multiplex import MultiPlex
+
+    def plex(accessions, scale, seed):
+        rng = np.random.RandomState(seed)
+        columns = ["Abundance: F1: {}, Sample, {} (Genotype)".format(tag, genotype)
+                   for tag, genotype in [("126", "Pool"), ("127", "KO"), ("128", "WT")]]
+        abundance = pandas.DataFrame(rng.lognormal(10, 1, (len(accessions), 3)) * scale, columns=columns)
+        abundance.insert(0, "Accession", accessions)
+        path = str(tmpdir.join("plex_{}.txt".format(seed)))
+        abundance.to_csv(path, sep="\t", index=False)
+        container = containers.ProteomeDiscovererRaw(filepath_or_buffer=path, cache=False)
+        container.master_index = container.raw[["Accession"]]
+        container.multiplex_key = ["Accession"]
+        return container
+
+    first, second = plex(list("ABCD"), 1., 0), plex(list("BCDE"), 3., 1)
+    assert first.bridge_channels == ["Abundance: F1: 126, Sample, Pool (Genotype)"]
+
+    multiplex = MultiPlex([first, second], names=["p1", "p2"])
+    assert multiplex.plexes.Name.tolist() == ["p1", "p2"]
+    assert multiplex.bridge.tolist() == [[True, False, False], [True, False, False]]
+    assert multiplex.study_factor_table._Plex.tolist() == ["p1"] * 3 + ["p2"] * 3
+
+    # After IRS the bridges of the shared rows are the same in both plexes.
+    merged = multiplex.merged()
+    assert merged.index.tolist() == list("ABCDE")
+    bridges = merged.filter(regex="Pool")
+    np.testing.assert_allclose(bridges.iloc[1:4, 0], bridges.iloc[1:4, 1])
+    assert np.isnan(merged.iloc[4, 0]) and np.isnan(merged.iloc[0, 3])
+
+    # The within plex ratios are kept.
+    values = multiplex.normalize(loading=None)
+    np.testing.assert_allclose(values[1, 1:4, 1] / values[1, 1:4, 2],
+                               second.Abundance.values[:3, 1] / second.Abundance.values[:3, 2])
+    assert multiplex.merged(drop_bridge=True).shape == (5, 4)
+
+
+def test_multiplex_from_proteins_files(tmpdir):
+    import numpy as np
+    from ..core.multiplex import MultiPlex
+
+    rng = np.random.RandomState(0)
+    columns = ["Abundance: F1: {}, Sample, {} (Genotype)".format(tag, genotype)
+               for tag, genotype in [("126", "Pool"), ("127", "KO"), ("128", "WT")]]
+    paths = []
+    for n, accessions in enumerate([["P1", "P2", "P3", "P4", "P5"], ["P2", "P3", "P4", "P5", "P6"]]):
+        proteins = pandas.DataFrame(rng.lognormal(10, 1, (5, 3)), columns=columns)
+        proteins.insert(0, "Master", "IsMasterProtein")
+        proteins.insert(1, "Accession", accessions)
+        proteins.insert(2, "Description", ["Protein OS=Mus musculus GN=Gene{} PE=1".format(i) for i in accessions])
+        # Rows without an Entrez Gene ID are dropped from master_index, the last fails the q-value filter.
+        proteins.insert(3, "Entrez Gene ID", ["66445", "18597", np.nan, np.nan, "900001"])
+        proteins.insert(4, "Exp. q-value", [.001, .001, .001, .001, .5])
+        proteins.insert(5, "# Peptides", 1)
+        paths.append(str(tmpdir.join("plex{}.txt".format(n))))
+        proteins.to_csv(paths[-1], sep="\t", index=False)
+
+    multiplex = MultiPlex.from_files(paths, cache=False, rescue_entrez_ids=False)
+    # Filtered rows have no Accession in master_index and are left out.
+    assert multiplex.cube.index.tolist() == ["P1", "P2", "P3"]
+    merged = multiplex.merged()
+    assert merged.shape == (3, 6)
+    assert merged.iloc[0, 3:].isnull().all() and merged.iloc[2, :3].isnull().all()
+
+
+def test_imputation():
+    import numpy as np
+    from ..core.containers import Normalized
+
+    rng = np.random.RandomState(0)
+    values = rng.lognormal(10, 1, (60, 6))
+    values[rng.rand(*values.shape) < .2] = np.nan
+    values[0, :3] = np.nan
+    frame = pandas.DataFrame(values, columns=["KO 1", "KO 2", "KO 3", "WT 1", "WT 2", "WT 3"])
+    present = frame.notnull().values
+
+    # Present values are kept, the draws sit below every sample.
+    drawn = frame.impute("min_prob", random_state=0)
+    assert drawn.notnull().all().all()
+    np.testing.assert_array_equal(drawn.values[present], values[present])
+    assert (np.log2(drawn.values[~present]) < np.nanmean(np.log2(values))).mean() > .9
+
+    grouped = frame.impute("group_mean", groups=["KO", "WT"], log=False)
+    row = np.flatnonzero(np.isnan(values[:, 3]) & ~np.isnan(values[:, 4:]).all(axis=1))[0]
+    assert grouped.iloc[row, 3] == np.nanmean(values[row, 4:])
+    assert grouped.iloc[0, :3].isnull().all()
+
+    # Chunking does not change the neighbours.
+    nearest = frame.impute("knn", k=3)
+    assert nearest.notnull().all().all()
+    pandas.testing.assert_frame_equal(nearest, frame.impute("knn", k=3, chunk_size=7))
+
+    normalized = Normalized(_input=frame).impute("knn")
+    assert normalized._input.notnull().all().all()
+
+    # knn matches a brute force search, also when only some rows are donors.
+    def brute_force_knn(values, k, donors):
+        result = values.copy()
+        for i, c in zip(*np.nonzero(np.isnan(values))):
+            distances = []
+            for j in donors:
+                common = ~np.isnan(values[i]) & ~np.isnan(values[j])
+                if j != i and not np.isnan(values[j, c]) and common.any():
+                    distance = np.sum((values[i, common] - values[j, common]) ** 2) * values.shape[1] / common.sum()
+                    distances.append((distance, j))
+            nearest = [values[j, c] for _, j in sorted(distances)[:k]]
+            result[i, c] = np.mean(nearest) if nearest else np.nanmean(values[:, c])
+        return result
+
+    small = rng.normal(10, 1, (40, 5))
+    small[rng.rand(*small.shape) < .3] = np.nan
+    # A sparse column, most rows find their donors beyond the nearest few.
+    small[rng.rand(40) < .85, 0] = np.nan
+    small = pandas.DataFrame(small)
+    np.testing.assert_allclose(small.impute("knn", log=False, k=3).values,
+                               brute_force_knn(small.values, 3, range(40)))
+    donors = np.sort(np.random.RandomState(1).choice(40, 15, replace=False))
+    np.testing.assert_allclose(small.impute("knn", log=False, k=3, max_donors=15, random_state=1).values,
+                               brute_force_knn(small.values, 3, donors))
+
+
+def test_fraction_links():
+    from ..core.design import StudyDesign
+
+    # Two plexes of samples, each with an input and two enrichments.
+    columns = ["Abundance: F{}: {}, Sample, {} (Genotype), {} (Fraction)".format(3 * plex + n + 1, tag, genotype, fraction)
+               for plex, genotypes in enumerate([("KO", "WT"), ("WT", "KO")])
+               for n, fraction in enumerate(["Input", "Acetyl", "Phospho"])
+               for tag, genotype in zip(["126", "127"], genotypes)]
+    design = StudyDesign(columns)
+
+    assert design.input_fractions == ["F1", "F4"]
+    assert design.enriched_fractions == ["F2", "F3", "F5", "F6"]
+    links = design.fraction_links
+    assert list(zip(links._Fn, links.Input)) == [("F2", "F1"), ("F3", "F1"), ("F5", "F4"), ("F6", "F4")]
+    assert (links.Score == 1).all()
+
+    # Without exact matches the best scoring inputs are linked.
+    columns = [i.replace("127, Sample, WT (Genotype), Acetyl", "127, Sample, HET (Genotype), Acetyl") for i in columns]
+    links = StudyDesign(columns[:4]).fraction_links
+    assert list(zip(links._Fn, links.Input)) == [("F2", "F1")]
+    assert links.Score.tolist() == [.75]
+
+
+def test_key_dictionary_merge():
+    import numpy as np
+    from ..core.keys import KeyDictionary
+
+    left = pandas.DataFrame({"Accession": ["P1", "P3", np.nan, "P1", None], "Description": list("vwxyz")},
+                            index=[5, 6, 7, 8, 9])
+    right = pandas.DataFrame({"Accession": ["P1", np.nan, "P2"], "Description": ["d1", "dn", "d2"],
+                              "MitoCarta2_List": [True, False, True], "n": [1, 2, 3]}, index=[10, 11, 12])
+    dictionary = KeyDictionary(Accession=right.Accession.values)
+
+    assert dictionary.encode("Accession", ["P2", None, np.nan]).tolist() == [1, 2, 2]
+    pandas.testing.assert_frame_equal(dictionary.merge(left, right, "Accession"),
+                                      left.merge(right, on="Accession", how="left"))
+    assert dictionary.isin("Accession", left.Accession, right.Accession).tolist() == [True, False, True, True, True]
+    np.testing.assert_array_equal(dictionary.index_of(left, right, "Accession"), [10, np.nan, 11, 10, 11])
+
+    # Duplicated right keys fall back to pandas.merge.
+    twice = pandas.concat([right, right])
+    pandas.testing.assert_frame_equal(dictionary.merge(left, twice, "Accession"),
+                                      left.merge(twice, on="Accession", how="left"))
+
+    # Stored codes are joined on without looking at the key values.
+    left_codes = dictionary.encode("Accession", left.Accession)
+    right_codes = dictionary.encode("Accession", right.Accession)
+    pandas.testing.assert_frame_equal(dictionary.merge(left.drop("Accession", axis=1).assign(Accession=None), right, "Accession",
+                                                       left_codes=left_codes, right_codes=right_codes).drop("Accession", axis=1),
+                                      left.merge(right, on="Accession", how="left").drop("Accession", axis=1))
+
+
+def test_process_key_codes(tmpdir):
+    import numpy as np
+
+    process = handles.Process(file_list=_write_exports(tmpdir), rescue_entrez_ids=False)
+    dictionary = process.key_dictionary
+    vocabulary = dictionary.vocabularies["Accession"]
+
+    # The codes stored while the master indexes were built still match their accessions.
+    for container in [process.peptide_groups, process.proteins]:
+        codes = process.key_codes(container, "master_index", "Accession")
+        assert codes.dtype == np.int32
+        assert vocabulary[codes].tolist() == container.master_index.Accession.tolist()
+        assert process.key_codes(container, "master_index", "Accession") is codes
+
+    mitocarta_ids = dictionary.vocabularies["EntrezGeneID"][process.mitocarta_codes]
+    assert mitocarta_ids.tolist() == handles.mitocarta.MitoCartaTwo.essential.EntrezGeneID.astype(str).tolist()
+    assert process.peptide_groups.master_index.MitoCarta2_List.tolist() == [True, True, False, True, True]
+
+
+def test_site_std_out(tmpdir):
+    import numpy as np
+
+    peptides_file, proteins_file = _write_exports(tmpdir)
+    process = handles.Process(file_list=[peptides_file, proteins_file], rescue_entrez_ids=False)
+    peptide_groups = process.peptide_groups
+
+    # Both P1 K11 peptides are rolled up, the P2 sites come from its own position.
+    sites = peptide_groups.roll_up_sites(peptide_groups.Abundance, "Acetyl")
+    assert sites.index.tolist() == [("P1", "K", 11), ("P2", "K", 22), ("P2", "K", 24)]
+    abundance = peptide_groups.Abundance
+    np.testing.assert_allclose(sites.values[0], abundance.values[0] + abundance.values[1])
+    np.testing.assert_allclose(sites.values[1], abundance.values[3] + abundance.values[4])
+
+    # Rows are aligned on raw, not on their order in dataframe.
+    pandas.testing.assert_frame_equal(peptide_groups.roll_up_sites(abundance.iloc[::-1], "Acetyl"), sites)
+
+    result = peptide_groups.site_std_out("Acetyl", [["KO", "WT"]])
+    assert result.index.equals(sites.index)
+    assert result.columns.get_level_values(0).unique().tolist() == [
+        "Metadata", "Load_Normalized_acetyl", "Load_Normalized_Log2_Normalized_acetyl",
+        "Site_Abundance_acetyl_Stats_KO_vs_WT"]
+    assert result["Metadata"].Accession.tolist() == ["P1", "P2", "P2"]
+
+    # The protein metadata is joined into the Metadata columns by accession.
+    joined = process.site_std_out("Acetyl", [["KO", "WT"]])
+    assert joined.shape[1] > result.shape[1]
+    assert joined.columns.get_level_values(0).tolist()[:joined["Metadata"].shape[1]] == ["Metadata"] * joined["Metadata"].shape[1]
+    assert joined["Metadata"].EntrezGeneID.tolist() == process.proteins.master_index.set_index("Accession").EntrezGeneID[["P1", "P2", "P2"]].tolist()
+    pandas.testing.assert_frame_equal(joined.drop("Metadata", axis=1, level=0), result.drop("Metadata", axis=1, level=0))
+
+
+def test_process_comparisions(tmpdir):
+    import numpy as np
+    from statsmodels.stats.multitest import multipletests
+
+    process = handles.Process(file_list=_write_exports(tmpdir), rescue_entrez_ids=False)
+    specs = [("peptide_groups", "load_normalized", "_acetyl", "KO", "WT"),
+             dict(on="proteins", where="load_normalized", fraction_key="_input", numerator="KO", denominator="WT"),
+             ("peptide_groups", "load_normalized", "_acetyl", "WT", "KO")]
+    result = process.comparisions(specs)
+
+    assert result.columns.tolist() == ["on", "where", "fraction_key", "numerator", "denominator",
+                                       "Log2FC", "pvalue", "p_adjusted", "negative_log10_pvalue"]
+    # The specs keep their order, each matches a single comparision.
+    assert result.drop_duplicates(["on", "numerator"]).on.tolist() == ["peptide_groups", "proteins", "peptide_groups"]
+    for n, spec in enumerate(specs):
+        spec = tuple(spec[k] for k in ["on", "where", "fraction_key", "numerator", "denominator"]) if isinstance(spec, dict) else spec
+        rows = result.loc[(result[["on", "numerator"]].values == [spec[0], spec[3]]).all(axis=1)]
+        single = process.comparision(on=spec[0], where=spec[1], fraction_key=spec[2], numerator=spec[3], denominator=spec[4])
+        np.testing.assert_allclose(rows.Log2FC.values, single.Log2FC.values)
+        np.testing.assert_allclose(rows.pvalue.values, single.pvalue.values)
+        np.testing.assert_allclose(rows.negative_log10_pvalue.values, -np.log10(single.pvalue.values))
+        # The FDR is corrected within each comparison.
+        np.testing.assert_allclose(rows.p_adjusted.values, multipletests(rows.pvalue.values, method="fdr_bh")[1])
+
+    # Masked rows only, by position in every source frame.
+    masked = process.comparisions(specs[:1], mask=[0, 3])
+    assert masked.index.tolist() == process.peptide_groups.load_normalized._acetyl.index[[0, 3]].tolist()
+
+    # Filtering out WT as the numerator compares KO with WT.
+    flipped = process.comparisions([("peptide_groups", "load_normalized", "_acetyl", "WT", "WT")], filter_out_numerator=True)
+    np.testing.assert_allclose(flipped.pvalue.values, result.pvalue.values[:len(flipped)])
+    np.testing.assert_allclose(flipped.Log2FC.values, result.Log2FC.values[:len(flipped)])
+
+    bonferroni = process.comparisions(specs[:1], fdr_method="bonferroni")
+    np.testing.assert_allclose(bonferroni.p_adjusted.values, np.minimum(bonferroni.pvalue.values * len(bonferroni), 1))
+
+
+def test_load_normalized_cache(tmpdir):
+    peptides_file, _ = _write_exports(tmpdir)
+    peptide_groups = containers.PeptideGroups(filepath_or_buffer=peptides_file, cache=False)
+
+    first = peptide_groups.load_normalized
+    assert peptide_groups.load_normalized_stats["computed"] == 1
+
+    # A cache hit does not build the Abundance category again.
+    peptide_groups._thermo_category_cache.clear()
+    assert peptide_groups.load_normalized is first
+    assert "Abundance" not in peptide_groups._thermo_category_cache
+    assert peptide_groups.load_normalized_stats["cache_hits"] == 1
+
+    peptide_groups.invalidate_load_normalized()
+    second = peptide_groups.load_normalized
+    assert second is not first
+    pandas.testing.assert_frame_equal(second._acetyl, first._acetyl)
+
+    # Changing the method or replacing raw recomputes it.
+    peptide_groups.normalization_method = "median"
+    assert peptide_groups.load_normalized is not second
+    peptide_groups.raw = peptide_groups.raw.copy()
+    third = peptide_groups.load_normalized
+    stats = peptide_groups.load_normalized_stats
+    assert (stats["computed"], stats["cache_hits"]) == (4, 1)
+    assert stats["seconds"] > 0
+
+    # A new raw is never mistaken for the old one, even if it reuses its id.
+    raw = peptide_groups.raw
+    del peptide_groups.raw
+    peptide_groups.raw = raw
+    assert peptide_groups.load_normalized is not third
+
+    # In place edits are picked up after raw_changed.
+    fourth = peptide_groups.load_normalized
+    column = peptide_groups.Abundance.columns[-1]
+    peptide_groups.raw[column] = peptide_groups.raw[column] * 2
+    peptide_groups.raw_changed()
+    assert peptide_groups.load_normalized is not fourth
+    assert peptide_groups.load_normalized_stats["computed"] == 6
+
+
+def test_thermo_category_cache(tmpdir):
+    from ..core.store import ProjectStore
+
+    peptides_file, _ = _write_exports(tmpdir)
+    peptide_groups = containers.PeptideGroups(filepath_or_buffer=peptides_file, cache=False)
+    peptide_groups._thermo_category_cache.clear()
+
+    # Every distinct object returned is one build of the category from raw.
+    accessed = [(name, getattr(peptide_groups, name))
+                for name in ["Abundance", "Sequence", "Modifications", "Sequence",
+                             "Positions_in_Proteins", "Abundance", "Modifications"]]
+    builds = dict()
+    for name, frame in accessed:
+        builds.setdefault(name, dict())[id(frame)] = frame
+
+    # Abundance is pinned, the others share the category_cache_size = 2 slots.
+    assert dict((k, len(v)) for k, v in builds.items()) == {"Abundance": 1, "Sequence": 1, "Modifications": 2,
+                                                            "Positions_in_Proteins": 1}
+    assert list(peptide_groups._thermo_category_cache) == ["Positions_in_Proteins", "Abundance", "Modifications"]
+    pandas.testing.assert_frame_equal(*builds["Modifications"].values())
+
+    # The study design is checked against the column positions, not the category.
+    peptide_groups._thermo_category_cache.clear()
+    design = peptide_groups.study_design
+    assert peptide_groups.study_design is design
+    assert list(peptide_groups._thermo_category_cache) == []
+
+    # Categories are built lazily and never stored with the container.
+    path = str(tmpdir.join("peptide_groups.omin"))
+    ProjectStore.dump(peptide_groups, path)
+    loaded = ProjectStore.load(path)
+    for name in containers.ProteomeDiscovererRaw._transient_attributes:
+        assert name not in loaded.__dict__
+    pandas.testing.assert_frame_equal(loaded.Abundance, peptide_groups.Abundance)
+    assert list(loaded._thermo_category_cache) == ["Abundance"]
+
+
+def test_data_loader_cache_keywords(tmpdir):
+    import inspect
+    from ..core.guipyter import DataLoader
+    from ..utils import TableCache
+
+    parameters = inspect.signature(DataLoader.__init__).parameters
+    assert parameters["cache"].kind == inspect.Parameter.KEYWORD_ONLY
+    assert parameters["cache_dir"].kind == inspect.Parameter.KEYWORD_ONLY
+
+    path = str(tmpdir.join("table.txt"))
+    pandas.DataFrame({"Accession": ["P1", "P2"]}).to_csv(path, sep="\t", index=False)
+    cache_dir = str(tmpdir.join("cache"))
+    first = DataLoader(path, delimiter="\t", cache_dir=cache_dir)
+    second = DataLoader(path, delimiter="\t", cache_dir=cache_dir)
+    assert not first.cache_hit and second.cache_hit == TableCache.available()
+    pandas.testing.assert_frame_equal(first.raw, second.raw)
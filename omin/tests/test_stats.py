@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from scipy.stats import ttest_ind
+
+from ..stats import kernels, parallel
+
+
+def test_ttest_batch_matches_scipy():
+    rng = np.random.RandomState(0)
+    matrix = rng.normal(size=(50, 6))
+    matrix[3, 1] = np.nan
+    comparisons = [[[0, 1, 2], [3, 4, 5]], [[3, 4, 5], [0, 1, 2]]]
+
+    for equal_var in [True, False]:
+        result = kernels.ttest_batch(matrix, comparisons, equal_var=equal_var)
+        expected = ttest_ind(matrix[:, :3], matrix[:, 3:], axis=1, equal_var=equal_var)
+        np.testing.assert_allclose(result["t"][:, 0], expected.statistic)
+        np.testing.assert_allclose(result["pvalue"][:, 0], expected.pvalue)
+        np.testing.assert_allclose(result["pvalue"][:, 1], expected.pvalue)
+        np.testing.assert_allclose(result["fold_change"][:, 0], -result["fold_change"][:, 1])
+
+    # Per row missing values are only used when min_n is given.
+    result = kernels.ttest_batch(matrix, comparisons[:1], min_n=2)
+    expected = ttest_ind(matrix[3, [0, 2]], matrix[3, 3:])
+    np.testing.assert_allclose(result["pvalue"][3, 0], expected.pvalue)
+    assert result["n_numerator"][3, 0] == 2
+
+
+def test_moderated_ttest_recovers_prior():
+    rng = np.random.RandomState(1)
+    # Row variances drawn from a scaled inverse chi-square prior with 4 df.
+    variances = 4 * 0.5 / rng.chisquare(4, 5000)
+    matrix = rng.normal(size=(5000, 6)) * np.sqrt(variances)[:, None]
+    matrix[0, 1] = np.nan
+
+    result = kernels.moderated_ttest_batch(matrix, [[[0, 1, 2], [3, 4, 5]]], min_n=1)
+    assert abs(result["var_prior"][0] - 0.5) < 0.05
+    assert abs(result["df_prior"][0] - 4) < 0.5
+    assert result["n_numerator"][0, 0] == 2
+    assert np.isfinite(result["pvalue"]).all()
+    # Under the null about 5% of the rows are called at p < .05.
+    assert abs(np.mean(result["pvalue"] < .05) - .05) < .01
+
+    complete = kernels.moderated_ttest_batch(matrix, [[[0, 1, 2], [3, 4, 5]]])
+    assert np.isnan(complete["pvalue"][0, 0])
+
+
+def test_ttest_batches_in_worker_processes():
+    rng = np.random.RandomState(2)
+    jobs = [(rng.normal(size=(40, 6)), [[[0, 1, 2], [3, 4, 5]], [[3, 4, 5], [0, 1, 2]]]),
+            (rng.normal(size=(10, 6)), [[[0, 1], [2, 3, 4, 5]]])]
+
+    serial = parallel.ttest_batches(jobs)
+    pooled = parallel.ttest_batches(jobs, n_jobs=2)
+    for left, right in zip(serial, pooled):
+        np.testing.assert_array_equal(left["pvalue"], right["pvalue"])
+        np.testing.assert_array_equal(left["fold_change"], right["fold_change"])
+
+    # One job with more comparisons than workers is split into chunks.
+    comparisons = [[[0, 1, 2], [3, 4, 5]], [[3, 4, 5], [0, 1, 2]], [[0, 1], [2, 3]]]
+    assert [len(i) for i in parallel._chunks(comparisons, 2)] == [1, 2]
+    assert parallel._chunks([], 2) == []
+    serial = parallel.ttest_batches([(jobs[0][0], comparisons)])
+    pooled = parallel.ttest_batches([(jobs[0][0], comparisons)], n_jobs=2)
+    np.testing.assert_array_equal(serial[0]["pvalue"], pooled[0]["pvalue"])
+
+    # A given executor gets one task per job unless n_jobs says how many workers it has.
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(2) as executor:
+        for n_jobs in [None, 2]:
+            shared = parallel.ttest_batches([(jobs[0][0], comparisons)], n_jobs=n_jobs, executor=executor)
+            np.testing.assert_array_equal(serial[0]["pvalue"], shared[0]["pvalue"])
+
+
+def test_ttest_job_attach_error():
+    if parallel.shared_memory is None:
+        return
+    matrix = parallel._SharedMatrix(np.zeros((2, 2)))
+    try:
+        # A shape larger than the block fails before values is bound.
+        state = matrix.__getstate__()
+        state["shape"] = (100, 100)
+        broken = parallel._SharedMatrix.__new__(parallel._SharedMatrix)
+        broken.__setstate__(state)
+        with pytest.raises(TypeError):
+            parallel._ttest_job(broken, [], True, None)
+    finally:
+        matrix.release()
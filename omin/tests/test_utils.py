@@ -0,0 +1,267 @@
+import os
+import sys
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..utils import TableCache
+from ..utils import SequenceAnnotationTools
+
+
+def test_table_cache_round_trip():
+    cache_dir = tempfile.mkdtemp()
+    src = os.path.join(cache_dir, "table.txt")
+    raw = pd.DataFrame({"Accession": ["P12345", np.nan], "Abundance: F1: 126": [1.5, np.nan]})
+    raw.to_csv(src, sep="\t", index=False)
+
+    key = TableCache.cache_key(src, {"delimiter": "\t"})
+    assert key != TableCache.cache_key(src, {"delimiter": ","})
+    assert TableCache.load(key, cache_dir=cache_dir) is None
+
+    if TableCache.available():
+        TableCache.dump(key, pd.read_table(src), cache_dir=cache_dir)
+        cached = TableCache.load(key, cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(cached, pd.read_table(src))
+        assert cached.Accession[1] is not None
+
+
+class StubQuery(object):
+    """Answers ONE OF accession queries from a dict like intermine would."""
+
+    def __init__(self, service):
+        self.service = service
+        self.accessions = []
+
+    def add_view(self, *args):
+        pass
+
+    def add_sort_order(self, *args):
+        pass
+
+    def add_constraint(self, path, op, value, code=None):
+        if code == "A":
+            self.accessions = value
+
+    def rows(self):
+        self.service.requests += 1
+        for accession in self.accessions:
+            if accession in self.service.genes:
+                yield {"primaryIdentifier": "MGI:" + accession,
+                       "ncbiGeneNumber": self.service.genes[accession],
+                       "proteins.primaryAccession": accession,
+                       "symbol": "Gene", "proteins.synonyms.value": "",
+                       "proteins.isFragment": False}
+
+
+class StubService(object):
+
+    def __init__(self, genes):
+        self.genes = genes
+        self.requests = 0
+
+    def new_query(self, root):
+        return StubQuery(self)
+
+
+def test_rescue_entrez_ids_batches_and_caches():
+    from ..utils import IntermineTools, EntrezCache
+
+    cache_path = os.path.join(tempfile.mkdtemp(), "entrez.json")
+    service = StubService({"P1": "11", "P2": "22"})
+    master_index = pd.DataFrame({"Accession": ["P1-2", "P2", "P3", "P4"],
+                                 "EntrezGeneID": [np.nan, np.nan, np.nan, "44"]})
+
+    IntermineTools.rescue_entrez_ids(master_index, batch_size=2, service=service,
+                                     cache=EntrezCache(cache_path))
+    assert master_index.EntrezGeneID.tolist()[:2] == ["11", "22"]
+    assert pd.isnull(master_index.EntrezGeneID[2]) and master_index.EntrezGeneID[3] == "44"
+    assert service.requests == 2
+
+    # Repeat projects are answered from the cache, misses included.
+    master_index.loc[[0, 1], "EntrezGeneID"] = np.nan
+    IntermineTools.rescue_entrez_ids(master_index, service=service, cache=EntrezCache(cache_path))
+    assert master_index.EntrezGeneID.tolist()[:2] == ["11", "22"]
+    assert service.requests == 2
+
+    # Misses expire after negative_ttl and are looked up again, hits do not.
+    cache = EntrezCache(cache_path, negative_ttl=0)
+    assert "P1" in cache and "P3" not in cache
+    service.genes["P3"] = "33"
+    IntermineTools.rescue_entrez_ids(master_index, service=service, cache=cache)
+    assert master_index.EntrezGeneID[2] == "33"
+    assert service.requests == 3
+    assert "P3" in EntrezCache(cache_path, negative_ttl=0)
+
+
+def test_accession_index_lookup():
+    from ..databases import AccessionIndex
+
+    tmp = tempfile.mkdtemp()
+    src = os.path.join(tmp, "idmapping.dat")
+    with open(src, "w") as f:
+        f.write("P11111\tGeneID\t11\n"
+                "P11111\tUniProtKB-ID\tA_MOUSE\n"
+                "Q22222\tGeneID\t22\n"
+                "Q33333\tGeneID\t33\n"
+                "Q33333\tGeneID\t34\n")
+
+    index = AccessionIndex.build(src, path=os.path.join(tmp, "index"))
+    assert len(index) == 2 + 1
+
+    result = index.lookup(pd.Series(["Q22222", "P11111-2", "Q33333", np.nan, "A_VERY_LONG_ACCESSION"]))
+    assert result.tolist()[:2] == [22, 11]
+    assert result[2:].isnull().all()
+
+    master_index = pd.DataFrame({"Accession": ["P11111", "Q22222"], "EntrezGeneID": [np.nan, "99"]})
+    assert index.fill(master_index) == 1
+    assert master_index.EntrezGeneID.tolist() == ["11", "99"]
+
+
+UNIPROT_ENTRIES = {
+    "P11111": "ID   A_MOUSE\nAC   P11111; Q00001;\nDR   BioGRID; 999;\nDR   GeneID; 11;\nDR   GO; GO:0005739; C:mitochondrion; IDA:MGI.\n//\n",
+    "P22222": "ID   B_MOUSE\nAC   P22222;\nDR   GeneID; 22;\n//\n",
+}
+
+
+def uniprot_stand_in():
+    """Start a local HTTP server that answers like the UniProt accessions endpoint."""
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        requests = []
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            accessions = parse_qs(url.query)["accessions"][0].split(",")
+            Handler.requests.append(accessions)
+            body = "".join(UNIPROT_ENTRIES[i] for i in accessions if i in UNIPROT_ENTRIES).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler.requests
+
+
+def test_uniprot_client_batches_and_caches():
+    from ..utils import UniProtClient, UniProtTools
+
+    server, requests = uniprot_stand_in()
+    try:
+        url = "http://127.0.0.1:{}/uniprotkb".format(server.server_address[1])
+        client = UniProtClient(base_url=url, cache_dir=tempfile.mkdtemp(), batch_size=2)
+        UniProtTools.client(client)
+
+        gene_ids = UniProtTools.get_gene_ids(["P11111", "P22222", "P33333"])
+        assert gene_ids["P11111"] == "11" and gene_ids["P22222"] == "22"
+        assert pd.isnull(gene_ids["P33333"])
+        assert len(requests) == 2
+        assert UniProtTools.go_anno("P11111") == ["GO:0005739"]
+        assert UniProtTools.get_gene_id("P22222") == "22"
+        assert pd.isnull(UniProtTools.get_gene_id("P33333"))
+        # Everything after the first call, misses included, came from the cache.
+        assert len(requests) == 2
+    finally:
+        UniProtTools._client = None
+        server.shutdown()
+
+
+class StubConnection(object):
+    """An http.client connection that fails with a given error or answers 200."""
+
+    def __init__(self, netloc=None, timeout=None, error=None):
+        self.error = error
+        self.closed = False
+
+    def request(self, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+
+    def getresponse(self):
+        response = type("Response", (object,), {"status": 200, "will_close": False})()
+        response.read = lambda: b"ok"
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool_retries_on_fresh_connections():
+    import http.client
+    from ..utils.network_tools import _ConnectionPool
+
+    pool = _ConnectionPool("http", "127.0.0.1")
+    pool.connection_class = StubConnection
+
+    # After a keep-alive timeout every idle connection is stale.
+    stale = [StubConnection(error=http.client.RemoteDisconnected()) for _ in range(2)]
+    for connection in stale:
+        pool._idle.put(connection)
+    assert pool.request("/") == (200, b"ok")
+    assert stale[1].closed and not stale[0].closed
+    assert pool._idle.qsize() == 2 and pool._idle.get_nowait() not in stale
+
+    # A read timeout is raised and its connection closed, not returned to the pool.
+    slow = StubConnection(error=TimeoutError())
+    pool._idle.put(slow)
+    with pytest.raises(TimeoutError):
+        pool.request("/")
+    assert slow.closed and pool._idle.qsize() == 1
+
+
+def test_import_is_lazy():
+    # A fresh interpreter, this one has already imported everything.
+    script = ("import sys, omin; "
+              "print([m for m in ['pandas', 'scipy', 'statsmodels', 'matplotlib', 'altair', "
+              "'dominate', 'xlrd', 'tkinter'] if m in sys.modules]); "
+              "omin.Process; "
+              "print('tkinter' in sys.modules)")
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir, os.environ.get("PYTHONPATH", "")]))
+    output = subprocess.check_output([sys.executable, "-c", script], env=env).decode().split("\n")
+    # Other lines may be warnings printed by the imports.
+    assert output[0] == "[]"
+    assert output[-2] == "False"
+
+
+def test_sequence_annotation_sites():
+    peptides = pd.DataFrame({"Sequence": ["IISYGTLICNEITPHLHK", "AKMK", "PEPTIDE"],
+                             "Modifications": ["1xTMT6plex [N-Term]; 1xAcetyl [K18(92.7)]",
+                                               "2xAcetyl [K2(99.1); K4(80.5)]; 1xOxidation [M3]", np.nan],
+                             "Positions in Proteins": ["P00005 [287-304]", "Q1 [10-13]; Q2 [1-4]", "P3 [1-7]"]},
+                            index=["a", "b", "c"])
+
+    best_pos = SequenceAnnotationTools.find_best_position(peptides, ["Acetyl"])
+    assert [i.tolist() for i in best_pos] == [[18], [2, 4], []]
+
+    tagged = SequenceAnnotationTools.tag_injector(peptides)
+    assert tagged.TaggedSequence.tolist() == ["IISYGTLICNEITPHLH<b>K</b>", "A<b>K</b>M<b>K</b>", "PEPTIDE"]
+    pd.testing.assert_frame_equal(tagged, SequenceAnnotationTools.tag_injector(peptides, best_pos))
+
+    sites = SequenceAnnotationTools.protein_sites(peptides)
+    assert sites.index.tolist() == ["a", "b", "b"]
+    assert sites.Accession.tolist() == ["P00005", "Q1", "Q1"]
+    assert sites.ProteinPosition.tolist() == [304, 11, 13]
+
+    # Sites are keyed on the master protein, which need not come first in Positions in Proteins.
+    peptides["Master Protein Accessions"] = ["P00005", "Q2; Q1", np.nan]
+    sites = SequenceAnnotationTools.protein_sites(peptides)
+    assert sites.Accession.tolist() == ["P00005", "Q2", "Q2"]
+    assert sites.ProteinPosition.tolist() == [304, 2, 4]
+    peptides["Master Protein Accessions"] = ["P00005", "Q3", np.nan]
+    assert np.isnan(SequenceAnnotationTools.protein_sites(peptides).ProteinPosition.values[1:]).all()
+
+    proteins = pd.DataFrame({"Modifications in Proteins": ["P00005 1xAcetyl [K304(100)];  Q1 1xAcetyl [K5(100)]", np.nan]})
+    cleaned = SequenceAnnotationTools.mods_in_proteins_cleaner(proteins)
+    assert cleaned.MIP_clean.tolist() == ["P00005 1xAcetyl [K304(100)]<br>Q1 1xAcetyl [K5(100)]", ""]
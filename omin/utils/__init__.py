@@ -4,12 +4,35 @@
 
 # FIXME: combinde the following into a single file.
 
-from .network_tools import IntermineTools, FastaTools, UniProtTools
-from .string_tools import StringTools
-from .io_tools import IOTools, UserProfile
-from .pd_tools import PDStudyTools # FIXME: Find a way to integrate into containers.
-from .sequence_annotation import SequenceAnnotationTools
-# from .r_tools import RTools
-
-#DESTROY the FOLLOWING
-from .selection_tools import SelectionTools
+import importlib
+
+# Names are imported from their modules on first attribute access so that
+# e.g. UserProfile does not pull in dominate or the network tools.
+# In the format: name -> module.
+_lazy_imports = {
+    "IntermineTools": ".network_tools",
+    "EntrezCache": ".network_tools",
+    "FastaTools": ".network_tools",
+    "UniProtTools": ".network_tools",
+    "UniProtClient": ".network_tools",
+    "StringTools": ".string_tools",
+    "IOTools": ".io_tools",
+    "UserProfile": ".io_tools",
+    "TableCache": ".io_tools",
+    "PDStudyTools": ".pd_tools",  # FIXME: Find a way to integrate into containers.
+    "SequenceAnnotationTools": ".sequence_annotation",
+    #DESTROY the FOLLOWING
+    "SelectionTools": ".selection_tools",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
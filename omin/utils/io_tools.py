@@ -10,7 +10,18 @@ Tools for file input output handling.
 import os
 import re
 import bz2
+import json
 import shutil
+import hashlib
+
+import numpy as np
+
+# pyarrow is optional, without it the TableCache is simply disabled.
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    feather = None
 
 
 class IOTools(object):
@@ -88,6 +99,9 @@ class IOTools(object):
 
 class UserProfile(object):
     """Creates user profile files for configuration and databases.
+
+    Nothing is written on import, call UserProfile.setup() before using the
+    profile. Operate.start does so.
     """
     user_profile = os.path.expanduser("~")
     omin_profile_dir = os.path.join(user_profile, ".omin")
@@ -127,4 +141,136 @@ class UserProfile(object):
         cls._copy_mitocarta()
 
 
-UserProfile._create_profile_dirs()
+    # Set once setup has run in this process.
+    _is_setup = False
+
+
+    @classmethod
+    def setup(cls):
+        """Create the profile dirs and databases once per process."""
+        if not cls._is_setup:
+            cls._create_profile_dirs()
+            cls._is_setup = True
+
+
+class TableCache(object):
+    """On-disk cache of parsed tables stored as uncompressed Feather files.
+
+    Tables are keyed by a SHA-1 digest of the source file's contents plus the
+    parameters that were used to parse it, so the same export loaded from a
+    different path (or by a different user pointed at the same cache_dir)
+    still hits the cache. Uncompressed Feather files are memory-mapped on
+    read which avoids re-tokenizing the text.
+
+    The cache dir defaults to ~/.omin/cache and can be overridden with the
+    OMIN_CACHE_DIR environment variable or the cache_dir argument.
+    """
+    # Bump this if the on-disk layout changes.
+    cache_version = 1
+    cache_dir = os.environ.get("OMIN_CACHE_DIR",
+                               os.path.join(UserProfile.omin_profile_dir, "cache"))
+    chunk_size = 1 << 20
+
+    @staticmethod
+    def available():
+        """Return True if pyarrow is installed."""
+        return feather is not None
+
+    @classmethod
+    def file_digest(cls, file_path):
+        """Return the SHA-1 hex digest of a file's contents."""
+        sha = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.chunk_size), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def restore_nans(dataframe):
+        """Return dataframe with the None values Arrow uses for missing strings set back to NaN.
+        """
+        obj = dataframe.columns[dataframe.dtypes == object]
+        if len(obj) > 0:
+            dataframe[obj] = dataframe[obj].where(dataframe[obj].notnull(), np.nan)
+        return dataframe
+
+    @classmethod
+    def cache_key(cls, file_path, params=None):
+        """Return the cache key for a file and the parameters used to parse it.
+
+        Parameters
+        ----------
+        file_path : str
+
+        params : dict
+            Keyword arguments passed to the parser. Values are converted with
+            repr so they only need to have a stable repr.
+
+        Returns
+        -------
+        key : str
+        """
+        params = params or dict()
+        params = json.dumps(sorted((k, repr(v)) for k, v in params.items()))
+        sha = hashlib.sha1()
+        sha.update(cls.file_digest(file_path).encode())
+        sha.update(params.encode())
+        sha.update(str(cls.cache_version).encode())
+        return sha.hexdigest()
+
+    @classmethod
+    def cache_path(cls, key, cache_dir=None):
+        """Return the path of the cache file for a given key."""
+        cache_dir = cache_dir or cls.cache_dir
+        return os.path.join(cache_dir, key + ".feather")
+
+    @classmethod
+    def load(cls, key, cache_dir=None):
+        """Return the cached DataFrame for key or None if it is not cached."""
+        result = None
+        path = cls.cache_path(key, cache_dir=cache_dir)
+        if cls.available() and os.path.exists(path):
+            try:
+                result = feather.read_table(path, memory_map=True).to_pandas()
+                result = cls.restore_nans(result)
+            except Exception as err:
+                print("Could not read cached table:", path, err)
+                result = None
+        return result
+
+    @classmethod
+    def dump(cls, key, dataframe, cache_dir=None):
+        """Write a DataFrame to the cache.
+
+        Tables that Arrow cannot represent are not cached.
+
+        Returns
+        -------
+        path : str or None
+            The path of the cache file if the table was written.
+        """
+        path = None
+        if cls.available():
+            cache_dir = cache_dir or cls.cache_dir
+            final_path = cls.cache_path(key, cache_dir=cache_dir)
+            tmp_path = final_path + ".{}.tmp".format(os.getpid())
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                feather.write_feather(dataframe, tmp_path, compression="uncompressed")
+                # Atomic so that concurrent readers never see partial files.
+                os.replace(tmp_path, final_path)
+                path = final_path
+            except Exception as err:
+                print("Could not cache table:", err)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return path
+
+    @classmethod
+    def clear(cls, cache_dir=None):
+        """Remove every cached table."""
+        cache_dir = cache_dir or cls.cache_dir
+        if os.path.isdir(cache_dir):
+            for fn in os.listdir(cache_dir):
+                if fn.endswith(".feather"):
+                    os.remove(os.path.join(cache_dir, fn))
@@ -18,11 +18,21 @@ Tools for investigating with fasta and uniprot.
 # ----------------
 # EXTERNAL IMPORTS
 # ----------------
+import os
 import re
+import json
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit, quote
 import pandas as pd
 import numpy as np
-from urllib.error import HTTPError
-from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+from .io_tools import UserProfile
 # Try to import the intermine package.
 try:
     from intermine.webservice import Service
@@ -30,12 +40,95 @@ except ImportError as err:
     print("Cannot import Intermine:", err)
 
 
+# ===========
+# ENTREZCACHE
+# ===========
+
+class EntrezCache(object):
+    """On-disk accession -> Entrez Gene ID cache for IntermineTools.rescue_entrez_ids.
+
+    Accessions that could not be resolved are stored with the time of the
+    lookup and are not looked up again for negative_ttl seconds, after that
+    they count as unknown so new database releases are picked up.
+    """
+    # Bump this if the on-disk layout changes.
+    cache_version = 2
+    default_path = os.path.join(UserProfile.omin_database_profile_dir, "entrez_rescue_cache.json")
+
+    # Seconds a miss is kept, a week by default.
+    negative_ttl = 7 * 24 * 60 * 60
+
+    def __init__(self, path=None, negative_ttl=None):
+        self.path = path or self.default_path
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        # In the format: accession -> Entrez Gene ID.
+        self.entries = dict()
+        # In the format: accession -> time.time() of the lookup that missed.
+        self.misses = dict()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    cached = json.load(f)
+                if cached.get("cache_version") == self.cache_version:
+                    self.entries = cached["entries"]
+                    self.misses = cached["misses"]
+                elif cached.get("cache_version") == 1:
+                    # Version 1 kept misses as None without a time, only the hits are kept.
+                    self.entries = dict((k, v) for k, v in cached["entries"].items() if v is not None)
+            except Exception as err:
+                print("Could not read the Entrez Gene ID cache:", self.path, err)
+
+    def __contains__(self, accession):
+        if accession in self.entries:
+            return True
+        missed = self.misses.get(accession)
+        return missed is not None and time.time() - missed < self.negative_ttl
+
+    def get(self, accession):
+        """Return the cached Entrez Gene ID for an accession or np.nan."""
+        result = self.entries.get(accession)
+        return np.nan if result is None else result
+
+    def update(self, entries):
+        """Add a dict of accession -> Entrez Gene ID (or np.nan)."""
+        now = time.time()
+        with self._lock:
+            for k, v in entries.items():
+                if pd.isnull(v):
+                    self.entries.pop(k, None)
+                    self.misses[k] = now
+                else:
+                    self.misses.pop(k, None)
+                    self.entries[k] = str(v)
+
+    def save(self):
+        """Write the cache to disk."""
+        tmp_path = self.path + ".{}.tmp".format(os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"cache_version": self.cache_version, "entries": self.entries, "misses": self.misses}, f)
+            # Atomic so that concurrent readers never see partial files.
+            os.replace(tmp_path, self.path)
+        except Exception as err:
+            print("Could not write the Entrez Gene ID cache:", err)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
 # ==============
 # INTERMINETOOLS
 # ==============
 
 class IntermineTools(object):
 
+    mousemine_url = "http://www.mousemine.org/mousemine/service"
+
+    # One Service per url shared by every query.
+    _services = dict()
+
     @staticmethod
     def mousemine_accession_lookup(accession, verbose=False):
         """Return an intermine query object for a given protien accession number.
@@ -70,7 +163,7 @@ class IntermineTools(object):
             accession = accession.split('-')[0]
         try:
             # Begin intermine call.
-            service = Service("http://www.mousemine.org/mousemine/service")
+            service = IntermineTools.service()
             query = service.new_query("Gene")
 
             query.add_view("primaryIdentifier",
@@ -202,17 +295,152 @@ class IntermineTools(object):
             return entrez_gene_id
 
     @classmethod
-    def rescue_entrez_ids(cls, protein_master_index):
+    def service(cls, url=None):
+        """Return the shared intermine Service for url, creating it on first use."""
+        url = url or cls.mousemine_url
+        if url not in cls._services:
+            cls._services[url] = Service(url)
+        return cls._services[url]
+
+    @classmethod
+    def mousemine_accessions_lookup(cls, accessions, service=None):
+        """Return an intermine query object for many protein accession numbers.
+
+        Like mousemine_accession_lookup but with a single ONE OF constraint
+        on the primary accession of the proteins, so one request covers the
+        whole batch. Isoform numbers should already be removed.
+
+        Parameters
+        ----------
+        accessions: list
+
+        service: intermine.webservice.Service
+            Defaults to the shared mousemine service.
+
+        Returns
+        -------
+        result: (:obj)
+            Intermine query object.
+        """
+        service = service or cls.service()
+        query = service.new_query("Gene")
+
+        query.add_view("primaryIdentifier",
+                       "ncbiGeneNumber",
+                       "proteins.primaryAccession",
+                       "symbol",
+                       "proteins.synonyms.value",
+                       "proteins.length",
+                       "proteins.isFragment",
+                       "proteins.dataSets.name")
+
+        # Declare sort order of results.
+        query.add_sort_order("Gene.symbol", "ASC")
+        query.add_sort_order("Gene.proteins.dataSets.name", "ASC")
+        query.add_sort_order("Gene.proteins.length", "DESC")
+
+        # Declare constraints.
+        query.add_constraint("organism.taxonId", "=", "10090", code="B")
+        query.add_constraint("proteins.isFragment", "=", "False", code="C")
+        query.add_constraint("proteins.dataSets.name",
+                             "ONE OF",
+                             ["Swiss-Prot data set", "TrEMBL data set"],
+                             code="D")
+
+        # Main constraint: find all with accession numbers in the batch.
+        query.add_constraint("proteins.primaryAccession", "ONE OF", list(accessions), code="A")
+        return query
+
+    @classmethod
+    def mousemine_accessions_to_entrez(cls, accessions, service=None, verbose=False):
+        """Return a dict of accession -> Entrez Gene ID for a batch of accessions.
+
+        Accessions without a single unambiguous Entrez Gene ID map to np.nan,
+        see mousemine_accession_lookup_reduce.
+        """
+        result = dict((i, np.nan) for i in accessions)
+        query = cls.mousemine_accessions_lookup(accessions, service=service)
+        df = cls.mousemine_query_format(query, verbose=verbose)
+        # mousemine_query_format returns a list when the request itself failed.
+        if not isinstance(df, pd.DataFrame):
+            raise IOError("The intermine query for {} accessions failed.".format(len(accessions)))
+        if df.shape[0] > 0:
+            for accession, group in df.groupby("proteinsprimaryAccession"):
+                if accession in result:
+                    result[accession] = cls.mousemine_accession_lookup_reduce(group, verbose=verbose)
+        return result
+
+    @classmethod
+    def rescue_entrez_ids(cls, protein_master_index, batch_size=500, max_workers=4,
+                          service=None, cache=None, accession_index=None, use_network=True, verbose=False):
         """Attempts to fill in missing Entrez Gene IDs from Intermine.
+
+        Missing accessions are first looked up in the offline AccessionIndex
+        when one has been built. The rest are looked up in batches of ONE OF
+        queries over one shared Service with at most max_workers requests in
+        flight. Results are kept in an EntrezCache so repeat projects do not
+        touch the network, misses for EntrezCache.negative_ttl seconds.
+
+        Parameters
+        ----------
+        protein_master_index: pandas.DataFrame
+            With Accession and EntrezGeneID columns, filled in place.
+
+        batch_size: int
+            Accessions per query. Defaults to 500.
+
+        max_workers: int
+            Maximum number of concurrent queries. Defaults to 4.
+
+        service: intermine.webservice.Service
+            Defaults to the shared mousemine service.
+
+        cache: EntrezCache
+            Defaults to the cache in the omin database profile dir.
+
+        accession_index: omin.databases.AccessionIndex
+            Defaults to the index in the omin database profile dir if it
+            has been built.
+
+        use_network: bool
+            If False only the accession index and the cache are used.
+            Defaults to True.
         """
-        print("Fetching missing Entrez Gene IDs from intermine. This may take a few minutes...")
-        c=0
-        for i in protein_master_index.index:
-            if protein_master_index.loc[i].EntrezGeneID is np.nan:
-                entrez_id = cls.mousemine_accession_to_entrez(protein_master_index.loc[i].Accession)
-                if entrez_id is not np.nan:
-                    c+=1
-                    protein_master_index.loc[i].EntrezGeneID = entrez_id
+        cache = cache or EntrezCache()
+
+        if accession_index is None:
+            # Imported here because omin.databases imports omin.core.
+            from ..databases.idmapping import AccessionIndex
+            accession_index = AccessionIndex.default()
+
+        if accession_index is not None:
+            print(accession_index.fill(protein_master_index), "Entrez Gene IDs found in the accession index.")
+
+        missing = protein_master_index.EntrezGeneID.isnull()
+        # Remove the isoform numbers if present.
+        accessions = protein_master_index.Accession[missing].astype(str).str.split("-").str[0]
+
+        to_fetch = [i for i in accessions.unique() if i not in cache]
+
+        if len(to_fetch) > 0 and use_network:
+            print("Fetching", len(to_fetch), "missing Entrez Gene IDs from intermine...")
+            batches = [to_fetch[i:i + batch_size] for i in range(0, len(to_fetch), batch_size)]
+
+            def fetch(batch):
+                try:
+                    cache.update(cls.mousemine_accessions_to_entrez(batch, service=service, verbose=verbose))
+                except Exception as err:
+                    # Leave the batch out of the cache so it is retried next time.
+                    print("Could not fetch Entrez Gene IDs:", err)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(fetch, batches))
+
+            cache.save()
+
+        rescued = accessions.map(cache.get)
+        c = rescued.notnull().sum()
+        protein_master_index.loc[rescued.index, "EntrezGeneID"] = rescued
 
         print(c,"Retrieved Entrez Gene IDs from availible protein accession numbers.")
         print(protein_master_index.EntrezGeneID.isnull().sum(), "Entrez Gene IDs could not be determined.")
@@ -262,45 +490,298 @@ class FastaTools(object):
         seq_num = [seq[i]+str(i+1) for i in range(len(seq))]
         return seq_num
 
+# =============
+# UNIPROTCLIENT
+# =============
+
+class _ConnectionPool(object):
+    """Keep-alive HTTP(S) connections to one host, at most size of them."""
+
+    def __init__(self, scheme, netloc, size=8, timeout=30):
+        self.connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        self.netloc = netloc
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def request(self, path):
+        """Return the status and body of a GET request.
+
+        A dropped connection is retried once, always on a fresh connection
+        since every idle one may be stale after a keep-alive timeout. A
+        connection that fails for any reason, e.g. a read timeout, is closed.
+        Only healthy keep-alive connections go back to the pool.
+        """
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self.connection_class(self.netloc, timeout=self.timeout)
+
+            for attempt in range(2):
+                returned = False
+                try:
+                    connection.request("GET", path, headers={"Connection": "keep-alive"})
+                    response = connection.getresponse()
+                    body = response.read()
+                    if not response.will_close:
+                        self._idle.put(connection)
+                        returned = True
+                    return response.status, body
+                except (http.client.HTTPException, ConnectionError):
+                    if attempt == 1:
+                        raise
+                finally:
+                    if not returned:
+                        connection.close()
+                connection = self.connection_class(self.netloc, timeout=self.timeout)
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+class UniProtClient(object):
+    """Pooled, concurrent and caching client for UniProtKB entries.
+
+    Entries are requested many accessions at a time from the accessions
+    endpoint over keep-alive connections, with at most max_connections
+    requests in flight. Every entry, including misses, is cached on disk for
+    ttl seconds so repeat calls do not touch the network.
+
+    Parameters
+    ----------
+    base_url: str
+        Defaults to the UniProt REST API, point it at a local stand-in for
+        testing.
+
+    cache_dir: str
+        Defaults to uniprot_cache in the omin database profile dir. None
+        values and cache=False disable the cache.
+
+    ttl: float
+        Seconds a cached entry is used for. Defaults to 30 days.
+
+    max_connections: int
+        Maximum number of concurrent requests. Defaults to 8.
+
+    batch_size: int
+        Accessions per request. Defaults to 100.
+    """
+    base_url = "https://rest.uniprot.org/uniprotkb"
+    default_cache_dir = os.path.join(UserProfile.omin_database_profile_dir, "uniprot_cache")
+
+    def __init__(self, base_url=None, cache_dir=None, cache=True, ttl=30 * 24 * 3600,
+                 max_connections=8, batch_size=100, timeout=30):
+        self.base_url = (base_url or self.base_url).rstrip("/")
+        self.cache_dir = (cache_dir or self.default_cache_dir) if cache else None
+        self.ttl = ttl
+        self.max_connections = max_connections
+        self.batch_size = batch_size
+        url = urlsplit(self.base_url)
+        self._base_path = url.path
+        self._pool = _ConnectionPool(url.scheme, url.netloc, size=max_connections, timeout=timeout)
+
+    def close(self):
+        """Close the idle connections."""
+        self._pool.close()
+
+    # -----
+    # CACHE
+    # -----
+    def _cache_path(self, accession, file_format):
+        name = hashlib.sha1(accession.encode()).hexdigest()
+        return os.path.join(self.cache_dir, file_format, name)
+
+    def _from_cache(self, accession, file_format):
+        """Return (hit, entry) for an accession, entry is None for a cached miss."""
+        if self.cache_dir is None:
+            return False, None
+        path = self._cache_path(accession, file_format)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return False, None
+            with open(path) as f:
+                entry = f.read()
+        except OSError:
+            return False, None
+        return True, entry or None
+
+    def _to_cache(self, accession, file_format, entry):
+        if self.cache_dir is None:
+            return
+        path = self._cache_path(accession, file_format)
+        tmp_path = path + ".{}.{}.tmp".format(os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(entry or "")
+            os.replace(tmp_path, path)
+        except OSError as err:
+            print("Could not cache UniProt entry:", accession, err)
+
+    # -------
+    # REQUEST
+    # -------
+    @staticmethod
+    def _split_entries(body, file_format):
+        """Return a dict of accession -> entry for a multi entry response."""
+        result = dict()
+        if file_format == "fasta":
+            for entry in body.split("\n>"):
+                entry = entry if entry.startswith(">") else ">" + entry
+                header = entry.split("\n", 1)[0].split("|")
+                if len(header) > 1:
+                    result[header[1]] = entry.rstrip("\n") + "\n"
+        else:
+            for entry in body.split("\n//"):
+                entry = entry.strip("\n")
+                if len(entry) == 0:
+                    continue
+                entry = entry + "\n//\n"
+                for accession in re.findall(r"^AC\s+(.+)$", entry, flags=re.M):
+                    for i in accession.split(";"):
+                        if i.strip():
+                            result.setdefault(i.strip(), entry)
+        return result
+
+    def _fetch_batch(self, accessions, file_format):
+        """Request one batch of entries and cache them."""
+        path = "{}/accessions?accessions={}&format={}".format(self._base_path,
+                                                               quote(",".join(accessions), safe=","),
+                                                               file_format)
+        status, body = self._pool.request(path)
+        if status == 404:
+            entries = dict()
+        elif status != 200:
+            raise IOError("UniProt responded with status {} for {}".format(status, path))
+        else:
+            entries = self._split_entries(body.decode(), file_format)
+
+        result = dict()
+        for accession in accessions:
+            result[accession] = entries.get(accession)
+            self._to_cache(accession, file_format, result[accession])
+        return result
+
+    async def fetch_async(self, accessions, file_format="txt"):
+        """Coroutine version of fetch."""
+        file_format = file_format.lstrip(".")
+        result = dict()
+        to_fetch = []
+        for accession in dict.fromkeys(accessions):
+            hit, entry = self._from_cache(accession, file_format)
+            if hit:
+                result[accession] = entry
+            else:
+                to_fetch.append(accession)
+
+        batches = [to_fetch[i:i + self.batch_size] for i in range(0, len(to_fetch), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.max_connections)
+        loop = asyncio.get_running_loop()
+
+        async def fetch_batch(batch):
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(None, self._fetch_batch, batch, file_format)
+                except Exception as err:
+                    # Not cached, so the batch is retried on the next call.
+                    print("Could not fetch UniProt entries:", err)
+                    return dict((i, None) for i in batch)
+
+        for entries in await asyncio.gather(*[fetch_batch(i) for i in batches]):
+            result.update(entries)
+        return result
+
+    def fetch(self, accessions, file_format="txt"):
+        """Return a dict of accession -> UniProt entry as a string or None.
+
+        Parameters
+        ----------
+        accessions: list-like
+
+        file_format: str
+            "txt" or "fasta". Defaults to "txt".
+        """
+        coroutine = self.fetch_async(list(accessions), file_format=file_format)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # Already inside an event loop (e.g. Jupyter), run on a separate thread.
+        result = dict()
+
+        def run():
+            result.update(asyncio.run(coroutine))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result
+
+
 # ============
 # UNIPROTTOOLS
 # ============
 
 class UniProtTools(object):
-    """Tools for querying the UniProt database."""
+    """Tools for querying the UniProt database.
+
+    Requests go through one shared UniProtClient, see client.
+    """
+
+    id_rx = re.compile(r'GeneID;\s(\d+);')
 
-    id_rx = re.compile('ID;\s(\d+);')
+    _client = None
+
+    @classmethod
+    def client(cls, client=None):
+        """Return the shared UniProtClient, replacing it first if client is given."""
+        if client is not None:
+            cls._client = client
+        if cls._client is None:
+            cls._client = UniProtClient()
+        return cls._client
 
     @classmethod
     def get_uniprot(cls, accession, file_format='.fasta'):
         """Retrieve UniProt data for a given accession."""
-        if file_format[0] != '.':
-            file_format = '.' + file_format
-
-        url = "http://www.uniprot.org/uniprot/"
-        req = ''.join([url, accession, file_format])
-        try:
-            data = urlopen(req)
-            return data.read().decode()
-        except HTTPError:
+        result = cls.client().fetch([accession], file_format=file_format)[accession]
+        if result is None:
             print('Entry :', accession, 'not found.')
-            return None
+        return result
+
+    @classmethod
+    def get_uniprots(cls, accessions, file_format='.fasta'):
+        """Retrieve UniProt data for many accessions as a dict."""
+        return cls.client().fetch(accessions, file_format=file_format)
 
     @classmethod
     def get_gene_id(cls, accession):
         """Retrieve the gene id for a given accession."""
-        result = cls.get_uniprot(accession, file_format='.txt')
-        result = cls.id_rx.findall(result)
-        result = result[0]
+        return cls.get_gene_ids([accession])[accession]
+
+    @classmethod
+    def get_gene_ids(cls, accessions):
+        """Retrieve the gene ids for many accessions as a dict, np.nan where unknown."""
+        result = dict()
+        for accession, txt in cls.get_uniprots(accessions, file_format='.txt').items():
+            ids = cls.id_rx.findall(txt or "")
+            result[accession] = ids[0] if len(ids) > 0 else np.nan
         return result
 
     @classmethod
     def go_anno(cls, accession, desc=False):
         """Retrieve GO annotations for a given accession."""
-        txt = cls.get_uniprot(accession, file_format='.txt')
+        return cls.go_annos([accession], desc=desc)[accession]
+
+    @classmethod
+    def go_annos(cls, accessions, desc=False):
+        """Retrieve GO annotations for many accessions as a dict."""
         if desc:
-            rx = re.compile('GO:\d+;.+\n')
+            rx = re.compile(r'GO:\d+;.+\n')
         else:
-            rx = re.compile('(GO:\d+);')
-        results = rx.findall(txt)
-        return results
+            rx = re.compile(r'(GO:\d+);')
+        return dict((k, rx.findall(v or ""))
+                    for k, v in cls.get_uniprots(accessions, file_format='.txt').items())
@@ -2,15 +2,26 @@
 # Copyright 2018 James Draper, Paul Grimsrud, Deborah Muoio, Colette Blach, Blair Chesnut, and Elizabeth Hauser.
 
 import re
-import pandas as pd
 import numpy as np
-import dominate
+
+from ..core.pandomics import pandas as pd
+from ..core.modifications import ModificationIndex
 
 
 class SequenceAnnotationTools(object):
-    """
+    """Locate modified sites and tag them in peptide sequences.
+
+    Sites are kept as flat CSR style arrays: the sites of row i are
+    positions[indptr[i]:indptr[i + 1]], 0 based positions in the peptide.
+    See site_offsets.
     """
 
+    # Modifications that are introduced by sample preparation.
+    chemical_modifications = {'Oxidation', 'Carbamidomethyl', 'TMT6plex', 'TMT10plex'}
+
+    # Joins the sequences while tags are injected, never found in a sequence.
+    _separator = "\x00"
+
     @staticmethod
     def modification_formatter(mod_list):
         """Return regex term for a list of modifications."""
@@ -26,79 +37,231 @@ class SequenceAnnotationTools(object):
 
         rx = re.compile("\d.{}.+?\]".format(mod_regex))
 
-        mod_interest = dataframe.Modifications.apply(rx.findall)
-        # Format the as DataFrame
-        mod_interest = pd.DataFrame(mod_interest,
-                                    index=dataframe.index)
-
-        mod_interest = mod_interest.Modifications.apply("".join)
+        mod_interest = dataframe.Modifications.fillna("").str.findall(rx).str.join("")
 
         return mod_interest
 
     @classmethod
-    def find_best_position(cls, dataframe, mod_list=None):
-        """Find the best postion of modification."""
+    def in_vivo_modifications(cls, dataframe):
+        """Return the modification types of dataframe that are not chemical."""
+        return [i for i in ModificationIndex(dataframe.Modifications).types if i not in cls.chemical_modifications]
+
+    @classmethod
+    def site_offsets(cls, dataframe, mod_list=None, modification_index=None):
+        """Return the localized sites of the modifications of interest.
+
+        Only sites with a localization probability e.g. "K18(92.7)" are used.
+
+        Parameters
+        ----------
+        dataframe : DataFrame
+            With a Modifications column.
+
+        mod_list : list
+            Modifications of interest (regexes), defaults to the in vivo
+            modifications.
+
+        modification_index : omin.core.modifications.ModificationIndex
+            An index of dataframe.Modifications that was already built e.g.
+            PeptideGroups.modification_index.
+
+        Returns
+        -------
+        indptr : numpy.ndarray
+            Of length len(dataframe) + 1.
+
+        sites : DataFrame
+            One row per site in row order, with the columns peptide (row
+            position), modification, residue, position (0 based) and
+            probability.
+        """
+        index = modification_index
+        if index is None:
+            index = ModificationIndex(dataframe.Modifications)
         if mod_list is None:
-            try:
-                mod_list = cls.findInVivoModifications(dataframe)
-            except Exception:
-                print("Please enter a mod_list and tray again.")
-                return
+            mod_list = [i for i in index.types if i not in cls.chemical_modifications]
+
+        types = set()
+        for mod in mod_list:
+            types.update(index.types[i] for i in index.type_positions(mod))
+
+        sites = index.sites
+        keep = sites.modification.isin(types).values & sites.probability.notnull().values & (sites.position.values > 0)
+        sites = sites.loc[keep].reset_index(drop=True)
+        sites["position"] = sites.position - 1
+
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(sites.peptide.values, minlength=len(dataframe)))])
+        return indptr, sites
+
+    @staticmethod
+    def _protein_starts(accessions, positions):
+        """Return the 1 based start of every peptide in its accession.
+
+        Parameters
+        ----------
+        accessions : array-like
+            One accession per peptide.
 
-        # Find the modifications of interest
-        mod_interest = cls.modifications_of_interest(dataframe, mod_list)
+        positions : array-like
+            The Positions in Proteins of every peptide e.g.
+            "P00005 [287-304]; Q1 [10-27]".
 
-        # Compile the regex to find best postions for modifications.
-        # rx = re.compile("\w(\d+)\(\d+\)")
-        rx = re.compile("\w(\d+)\(\d+.\d+\)")
+        Returns
+        -------
+        starts : numpy.ndarray
+            Float, NaN where the accession is not in the positions.
+        """
+        pairs = pd.MultiIndex.from_arrays([pd.Series(accessions).fillna("").astype(str).values,
+                                           pd.Series(positions).fillna("").astype(str).values])
+        # Peptides of the same protein share their positions, each pair is parsed once.
+        codes, uniques = pd.factorize(pairs)
+        starts = np.full(len(uniques) + 1, np.nan)
+        for n, (accession, text) in enumerate(uniques):
+            found = re.search(r"(?:^|;)\s*{}\s+\[(\d+)-\d+\]".format(re.escape(accession)), text) if accession else None
+            if found:
+                starts[n] = int(found.group(1))
+        return starts[codes]
 
-        # Apply the compiled regex using findall to Modifications column.
-        best_pos = mod_interest.apply(rx.findall)
+    @classmethod
+    def protein_sites(cls, dataframe, mod_list=None, modification_index=None):
+        """Return the sites of the modifications of interest in protein coordinates.
+
+        Sites are keyed on the master protein of the peptide, the first
+        member of Master Protein Accessions like the Accession of
+        master_index. Its position is parsed from the Positions in Proteins
+        column e.g. "P00005 [287-304]". Without a Master Protein Accessions
+        column the first protein of Positions in Proteins is used.
+
+        Returns
+        -------
+        result : DataFrame
+            One row per site indexed like dataframe, with the columns
+            Accession, Modification, Residue, PeptidePosition,
+            ProteinPosition (both 1 based) and Probability. ProteinPosition
+            is NaN when the peptide position is unknown.
+        """
+        indptr, sites = cls.site_offsets(dataframe, mod_list=mod_list, modification_index=modification_index)
+
+        positions = dataframe["Positions in Proteins"]
+        if "Master Protein Accessions" in dataframe:
+            accessions = dataframe["Master Protein Accessions"].first_member()
+        else:
+            accessions = positions.fillna("").str.extract(r"^\s*([^\s;\[]+)", expand=False)
+        peptides = sites.peptide.values
+        starts = cls._protein_starts(accessions.values[peptides], positions.values[peptides])
+
+        result = pd.DataFrame({"Accession": accessions.values[peptides],
+                               "Modification": sites.modification.values,
+                               "Residue": sites.residue.values,
+                               "PeptidePosition": sites.position.values + 1,
+                               "ProteinPosition": starts + sites.position.values,
+                               "Probability": sites.probability.values},
+                              index=dataframe.index[peptides])
+        return result
+
+    @classmethod
+    def find_best_position(cls, dataframe, mod_list=None):
+        """Find the best postion of modification.
+
+        Returns
+        -------
+        best_pos : Series
+            An int32 array of the 1 based site positions of every peptide.
+        """
+        if mod_list is None:
+            mod_list = cls.in_vivo_modifications(dataframe)
 
-        # Apply all of the find results
-        best_pos = best_pos.apply(lambda x: np.array(x, dtype="int32"))
+        indptr, sites = cls.site_offsets(dataframe, mod_list=mod_list)
+        positions = sites.position.values.astype("int32") + 1
+        best_pos = pd.Series(np.split(positions, indptr[1:-1]), index=dataframe.index, dtype=object)
 
         return best_pos
 
     @classmethod
     def mods_in_proteins_cleaner(cls, dataframe):
         """Return DataFrame of cleaned Modifications in proteins."""
-        # Compile the regex to find best postions for modifications.
-        rx = re.compile(".+\d+\(\d+\)\]")
+        column = dataframe.filter(regex="Mod.+Proteins$").iloc[:,0].fillna("")
+        # Everything up to the last site with a probability e.g. "[K304(100)]".
+        rx = re.compile(r".+\d+\(\d+\)\]")
+        split_rx = re.compile(r"\s*;\s*")
 
-        cln = dataframe.filter(regex="Mod.+Proteins$").iloc[:,0].fillna("").apply(rx.findall).apply("".join)
-        clnStr = lambda x:[i.strip() for i in x]
-        brStr = lambda x:"<br>".join(clnStr(x))
+        def clean(text):
+            found = rx.match(text)
+            return split_rx.sub("<br>", found.group(0).strip()) if found else ""
 
-        rx = re.compile(";")
-        cln = cln.apply(rx.split).apply(brStr)
+        # Identical strings (e.g. the empty ones) are cleaned once.
+        codes, uniques = pd.factorize(column.values)
+        cln = pd.Series(np.array([clean(i) for i in uniques] + [""], dtype=object)[codes], index=column.index, name=column.name)
         cln = pd.DataFrame(cln)
         cln.columns = ["MIP_clean"]
         return cln
 
+    @staticmethod
+    def _tag_parts(tag=None):
+        """Return the opening and closing html of a dominate tag."""
+        if tag is None:
+            import dominate.tags
+            tag = dominate.tags.b
+        return tuple(tag("{}").render().split("{}"))
 
     @classmethod
     def inject_single_sequence_tag(cls, seq, ind, tag=None):
         """Return sequence with HTML tags injected."""
-
-        tag = tag or dominate.tags.b
-
-        tags = tag("{}").render()
+        open_tag, close_tag = cls._tag_parts(tag)
 
         seq_list = list(seq)
         for i in ind:
-            seq_list[i] = tags.format(seq_list[i])
+            seq_list[i] = open_tag + seq_list[i] + close_tag
         return "".join(seq_list)
 
+    @classmethod
+    def inject_tags(cls, sequences, indptr, positions, tag=None):
+        """Return a list of the sequences with every site wrapped in tag.
+
+        Parameters
+        ----------
+        sequences : list or Series of str
+
+        indptr, positions : numpy.ndarray
+            The sites, see site_offsets. Positions outside of a sequence are
+            ignored.
+
+        tag : dominate.tags.html_tag
+            Defaults to dominate.tags.b.
+        """
+        open_tag, close_tag = cls._tag_parts(tag)
+        sequences = ["" if not isinstance(i, str) else i for i in sequences]
+        lengths = np.array([len(i) for i in sequences], dtype=np.int64)
+        # Each sequence is followed by the separator in joined.
+        starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]]).astype(np.int64)
+        joined = cls._separator.join(sequences)
+
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = np.repeat(np.arange(len(sequences)), np.diff(indptr))
+        valid = (positions >= 0) & (positions < lengths[rows])
+        cuts = np.unique(starts[rows[valid]] + positions[valid])
+
+        pieces = [None] * (2 * len(cuts) + 1)
+        pieces[::2] = [joined[a:b] for a, b in zip(np.concatenate([[0], cuts + 1]), np.concatenate([cuts, [len(joined)]]))]
+        pieces[1::2] = [open_tag + joined[i] + close_tag for i in cuts]
+        return "".join(pieces).split(cls._separator)
+
     @classmethod
     def tag_injector(cls, dataframe, best_pos=None, tag=None):
-        """Return dataframe of html injected sequences."""
+        """Return dataframe of html injected sequences.
 
+        best_pos is a Series of 1 based positions like find_best_position
+        returns, by default the sites are located in bulk.
+        """
         if best_pos is None:
-            best_pos = cls.find_best_position(dataframe)
+            indptr, sites = cls.site_offsets(dataframe, mod_list=cls.in_vivo_modifications(dataframe))
+            positions = sites.position.values
+        else:
+            best_pos = best_pos.reindex(dataframe.index)
+            best_pos = [np.asarray(i if isinstance(i, (list, np.ndarray)) else [], dtype=np.int64) for i in best_pos]
+            indptr = np.concatenate([[0], np.cumsum([len(i) for i in best_pos])])
+            positions = np.concatenate(best_pos + [np.zeros(0, dtype=np.int64)]) - 1
 
-        # inject_single_sequence_tag(dataframe.Sequence[1],best_pos[1]-1,style=style)
-        dataframe = dataframe.Sequence
-        result = [cls.inject_single_sequence_tag(dataframe[i], best_pos[i]-1, tag=tag) for i in dataframe.index]
+        result = cls.inject_tags(dataframe.Sequence, indptr, positions, tag=tag)
         result = pd.DataFrame(result, index=dataframe.index, columns=["TaggedSequence"])
         return result
@@ -39,6 +39,7 @@ setup(
                       'lxml',
                       'beautifulsoup4',
                       'matplotlib_venn'],
+    extras_require={'cache': ['pyarrow']},
     entry_points = {
         'console_scripts': [
             'omin=omin.cli.cli:main',